@@ -54,6 +54,8 @@ class ModelParams(ParamGroup):
         self._white_background = False
         self.data_device = "cuda"
         self.eval = False
+        self.load_workers = 8 # threads decoding the camera images, 0 to load them one by one
+        self.image_cache_dir = "" # if set, resized images and depths are cached there and reused by later runs on the same scene
         super().__init__(parser, "Loading Parameters", sentinel)
 
     def extract(self, args):
@@ -86,6 +88,9 @@ class OptimizationParams(ParamGroup):
         self.densification_interval = 100 # [default 100] Increase this to avoid running out of memory (how many iterations in between densifying/splitting gaussians)
         self.opacity_reset_interval = 1000 # [default 3000] Decrease all opacities (alpha) close to zero -> algo will automatically increase opacities again for important gaussians -> cull the rest
         self.remove_outliers_interval = 500 # [default 500]
+        self.outlier_knn_backend = "pytorch3d" # "pytorch3d" for the chunked brute force kNN (torch.cdist without pytorch3d), "voxel" for the voxel-grid index, both exact
+        self.outlier_knn_k = 0 # number of neighbours for outlier removal, 0 for sqrt(num_points)
+        self.outlier_stats_samples = 0 # if > 0, estimate the global kNN distance mean/std from this many sampled points
         self.densify_from_iter = 500 # [default 500] After this many iterations, start densifying
         self.densify_until_iter = int(0.6 * self.iterations) # [default 15_000] Decrease this to avoid running out of memory (after this many iterations, stop densifying)
         self.densify_grad_threshold = 0.0002 # [default 0.0002; Section 5.2: tau_pos] Increase this to avoid running out of memory. If very high, no densification will occur
@@ -94,6 +99,9 @@ class OptimizationParams(ParamGroup):
         self.sample_pseudo_interval = 10 # not use
         self.random_background = False
         self.pose_iterations = 4000
+        self.fused_densification = False # clone, split and prune in one pass instead of rebuilding all tensors after each step
+        self.capacity_growth = 0.0 # > 0 enables preallocated parameter storage with this much headroom (e.g. 0.5), densify/prune then write in place
+        self.cache_activations = False # cache the activated scaling/rotation/opacity/SH features for no-grad consumers (densification) between optimizer steps
         super().__init__(parser, "Optimization Parameters")
 
 def get_combined_args(parser : ArgumentParser):
@@ -0,0 +1,68 @@
+### benchmark of the per-view Gaussian activations in render.py, with and without frozen parameters
+import os
+import sys
+import time
+import argparse
+import torch
+from torch import nn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scene.gaussian_model import GaussianModel
+
+
+def make_gaussians(num_points, device, freeze, seed=0):
+    torch.manual_seed(seed)
+    gaussians = GaussianModel(3)
+    # as loaded by load_ply: parameters that require grad
+    gaussians._xyz = nn.Parameter(torch.randn((num_points, 3), device=device))
+    gaussians._features_dc = nn.Parameter(torch.randn((num_points, 1, 3), device=device))
+    gaussians._features_rest = nn.Parameter(torch.randn((num_points, 15, 3), device=device))
+    gaussians._scaling = nn.Parameter(torch.randn((num_points, 3), device=device) - 4)
+    gaussians._rotation = nn.Parameter(torch.randn((num_points, 4), device=device))
+    gaussians._opacity = nn.Parameter(torch.randn((num_points, 1), device=device))
+    if freeze:
+        # as in render_sets
+        for param in (gaussians._xyz, gaussians._features_dc, gaussians._features_rest, gaussians._scaling, gaussians._rotation, gaussians._opacity):
+            param.requires_grad_(False)
+    gaussians.enable_activation_cache()
+    return gaussians
+
+def render_view(gaussians):
+    """ The activations read by gaussian_renderer.render for one view """
+    return gaussians.get_xyz, gaussians.get_opacity, gaussians.get_scaling, gaussians.get_rotation, gaussians.get_features
+
+def synchronize(device):
+    if device.startswith('cuda'):
+        torch.cuda.synchronize()
+
+def run(gaussians, num_views, device):
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(num_views):
+        activations = render_view(gaussians)
+    synchronize(device)
+    return (time.perf_counter() - start) / num_views, activations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_points', type=int, nargs='+', default=[100_000, 1_000_000, 3_000_000])
+    parser.add_argument('--num_views', type=int, default=100)
+    parser.add_argument('--device', type=str, default='cuda')
+    args = parser.parse_args()
+
+    for n in args.num_points:
+        results, reference = {}, None
+        for name, freeze in (('requires_grad', False), ('frozen', True)):
+            gaussians = make_gaussians(n, args.device, freeze)
+            run(gaussians, 2, args.device) # warm up
+            results[name], activations = run(gaussians, args.num_views, args.device)
+            if reference is None:
+                reference = activations
+            else:
+                for a, b in zip(reference, activations):
+                    assert torch.equal(a.detach(), b), f'{name} activations differ'
+            # only the frozen parameters are served from the cache
+            assert (gaussians.get_opacity is gaussians.get_opacity) == freeze
+        print(f'N={n:>9d} points | ' + ' | '.join(f'{name} {t * 1e3:7.2f}ms/view' for name, t in results.items())
+              + f' | speedup {results["requires_grad"] / results["frozen"]:.1f}x')
@@ -0,0 +1,65 @@
+### benchmark of the CrossAttention backends at the sequence lengths of the SD1.5 SpatialTransformers
+import os
+import sys
+import time
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ldm.modules.attention import CrossAttention, available_attention_backends
+
+# (channels, sequence length of a 64x64 latent) of the SpatialTransformers of the UNet, 8 heads each
+LAYERS = [(320, 64 * 64), (640, 32 * 32), (1280, 16 * 16), (1280, 8 * 8)]
+
+
+def run(attn, x, context, backward, warmup, repeats, device):
+    def step():
+        out = attn(x, context=context)
+        if backward:
+            out.sum().backward()
+
+    for _ in range(warmup):
+        step()
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    base_memory = torch.cuda.memory_allocated() if device == "cuda" else 0
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / repeats
+    peak = (torch.cuda.max_memory_allocated() - base_memory) / 2 ** 20 if device == "cuda" else float("nan")
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', type=str, nargs='+', default=available_attention_backends())
+    parser.add_argument('--batch_size', type=int, default=2, help='2 per view with batched classifier-free guidance')
+    parser.add_argument('--dtype', type=str, default='float16', choices=['float16', 'bfloat16', 'float32'])
+    parser.add_argument('--backward', action='store_true', help='time forward + backward, as in train_lora.py')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+    dtype = getattr(torch, args.dtype)
+
+    for channels, length in LAYERS:
+        for kind, context_dim in (('self', None), ('cross', 768)):
+            torch.manual_seed(0)
+            x = torch.randn((args.batch_size, length, channels), device=args.device, dtype=dtype, requires_grad=args.backward)
+            context = torch.randn((args.batch_size, 77, context_dim), device=args.device, dtype=dtype) if context_dim else None
+            line = f'{kind:>5s} n={length:>4d} c={channels:>4d}'
+            for backend in args.backends:
+                attn = CrossAttention(channels, context_dim=context_dim, heads=8, dim_head=channels // 8, backend=backend)
+                attn = attn.to(args.device, dtype)
+                try:
+                    elapsed, peak = run(attn, x, context, args.backward, args.warmup, args.repeats, args.device)
+                    line += f' | {backend} {elapsed * 1e3:7.2f}ms {peak:7.1f}MB'
+                except RuntimeError as e: # out of memory
+                    line += f' | {backend} failed ({type(e).__name__})'
+                if args.device == "cuda":
+                    torch.cuda.empty_cache()
+            print(line)
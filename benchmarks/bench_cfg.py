@@ -0,0 +1,68 @@
+### benchmark of one guided DDIM step with cond/uncond as two UNet calls against one batched call
+import os
+import sys
+import time
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cldm.model import create_model
+from cldm.ddim_hacked import DDIMSampler
+
+
+def make_conditioning(model, batch_size, image_size, guess_mode):
+    control = torch.rand((batch_size, 3, image_size, image_size), device="cuda")
+    with torch.no_grad():
+        cond = {"c_concat": [control], "c_crossattn": [model.get_learned_conditioning(["a photo, best quality"] * batch_size)]}
+        un_cond = {"c_concat": None if guess_mode else [control], "c_crossattn": [model.get_learned_conditioning(["blur, lowres"] * batch_size)]}
+    return cond, un_cond
+
+@torch.no_grad()
+def run(sampler, x, cond, un_cond, scale, num_steps):
+    ts = torch.full((x.shape[0],), int(sampler.ddim_timesteps[-1]), device="cuda", dtype=torch.long)
+    sampler.p_sample_ddim(x, cond, ts, index=len(sampler.ddim_timesteps) - 1, # warm up
+                          unconditional_guidance_scale=scale, unconditional_conditioning=un_cond)
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        sampler.p_sample_ddim(x, cond, ts, index=len(sampler.ddim_timesteps) - 1,
+                              unconditional_guidance_scale=scale, unconditional_conditioning=un_cond)
+    torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / num_steps
+    return elapsed, (torch.cuda.max_memory_allocated() - base_memory) / 2 ** 20
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default='control_v11f1e_sd15_tile')
+    parser.add_argument('--ckpt', type=str, default='', help='optional weights, the timings do not depend on them')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--scale', type=float, default=7.5)
+    parser.add_argument('--num_steps', type=int, default=10)
+    parser.add_argument('--guess_mode', action='store_true')
+    args = parser.parse_args()
+
+    model = create_model(f'./models/{args.model_name}.yaml').cpu()
+    if args.ckpt:
+        from cldm.model import load_state_dict
+        model.load_state_dict(load_state_dict(args.ckpt, location='cpu'), strict=False)
+    model = model.cuda().eval()
+    model.control_scales = [1.0] * 13
+
+    for batch_size in args.batch_sizes:
+        cond, un_cond = make_conditioning(model, batch_size, args.image_size, args.guess_mode)
+        x = torch.randn((batch_size, 4, args.image_size // 8, args.image_size // 8), device="cuda")
+        line = f'b={batch_size:>3d}'
+        for name, batch_cfg in (('two calls', False), ('batched', True)):
+            sampler = DDIMSampler(model, batch_cfg=batch_cfg)
+            sampler.make_schedule(50, ddim_eta=1.0, verbose=False)
+            try:
+                elapsed, peak = run(sampler, x, cond, un_cond, args.scale, args.num_steps)
+                line += f' | {name} {elapsed * 1e3:8.1f}ms/step peak {peak:8.1f}MB'
+            except RuntimeError as e: # out of memory
+                line += f' | {name} failed ({type(e).__name__})'
+            torch.cuda.empty_cache()
+        print(line)
@@ -0,0 +1,52 @@
+### benchmark of the steady-state ControlNet + UNet step latency, eager against torch.compile / CUDA graphs
+import os
+import sys
+import time
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cldm.model import create_model
+
+
+@torch.no_grad()
+def step_latency(model, x, t, cond, warmup, repeats, device):
+    for _ in range(warmup): # compilation and graph capture happen here
+        model.apply_model(x, t, cond)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.apply_model(x, t, cond)
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default='control_v11f1e_sd15_tile')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 8])
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--modes', type=str, nargs='+', default=['default', 'reduce-overhead'])
+    parser.add_argument('--backend', type=str, default='inductor', help='e.g. aot_eager to run on CPU without a toolchain')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    model = create_model(f'./models/{args.model_name}.yaml').to(args.device).eval()
+    model.control_scales = [1.0] * 13
+
+    for batch_size in args.batch_sizes:
+        x = torch.randn((batch_size, 4, args.image_size // 8, args.image_size // 8), device=args.device)
+        t = torch.full((batch_size,), 500, device=args.device, dtype=torch.long)
+        cond = {"c_concat": [torch.rand((batch_size, 3, args.image_size, args.image_size), device=args.device)],
+                "c_crossattn": [torch.randn((batch_size, 77, 768), device=args.device)]}
+        model.compiled_denoise = None
+        line = f'b={batch_size:>3d} | eager {step_latency(model, x, t, cond, args.warmup, args.repeats, args.device) * 1e3:8.2f}ms'
+        for mode in args.modes:
+            model.compile_denoiser(mode=mode, backend=args.backend)
+            elapsed = step_latency(model, x, t, cond, args.warmup, args.repeats, args.device)
+            line += f' | {mode} {elapsed * 1e3:8.2f}ms'
+        print(line)
@@ -0,0 +1,93 @@
+### benchmark of the memoized DDIM schedule and of the precomputed per-step coefficients of p_sample_ddim
+import os
+import sys
+import time
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cldm.ddim_hacked import DDIMSampler
+
+
+class LegacyDDIMSampler(DDIMSampler):
+    """ The previous behaviour: a schedule rebuilt by every make_schedule, coefficients read per step """
+
+    def make_schedule(self, ddim_num_steps, ddim_discretize="uniform", ddim_eta=0., verbose=True):
+        self.build_schedule(ddim_num_steps, ddim_discretize=ddim_discretize, ddim_eta=ddim_eta, verbose=verbose)
+
+    def step_coefficients(self, index, b, device, use_original_steps=False):
+        return (torch.full((b, 1, 1, 1), self.ddim_alphas[index], device=device),
+                torch.full((b, 1, 1, 1), self.ddim_alphas_prev[index], device=device),
+                torch.full((b, 1, 1, 1), self.ddim_sigmas[index], device=device),
+                torch.full((b, 1, 1, 1), self.ddim_sqrt_one_minus_alphas[index], device=device))
+
+
+class NullModel:
+    """ Stands in for the ControlNet so that only the sampler overhead is timed """
+
+    def __init__(self, num_timesteps=1000):
+        betas = torch.linspace(0.00085 ** 0.5, 0.012 ** 0.5, num_timesteps, dtype=torch.float64) ** 2
+        alphas_cumprod = torch.cumprod(1. - betas, dim=0)
+        self.num_timesteps = num_timesteps
+        self.parameterization = "eps"
+        self.device = torch.device("cuda")
+        self.betas = betas.float().cuda()
+        self.alphas_cumprod = alphas_cumprod.float().cuda()
+        self.alphas_cumprod_prev = torch.cat([torch.ones(1, dtype=torch.float64), alphas_cumprod[:-1]]).float().cuda()
+
+    def apply_model(self, x, t, c):
+        return x * 0.1
+
+
+def time_make_schedule(sampler, ddim_steps, repeats):
+    sampler.make_schedule(ddim_steps, ddim_eta=1.0, verbose=False)
+    torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        sampler.make_schedule(ddim_steps, ddim_eta=1.0, verbose=False)
+    torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+@torch.no_grad()
+def time_decode(sampler, x, cond, ddim_steps, repeats):
+    sampler.make_schedule(ddim_steps, ddim_eta=1.0, verbose=False)
+    sampler.decode(x, cond, ddim_steps) # warm up
+    torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        sampler.decode(x, cond, ddim_steps)
+    torch.cuda.synchronize()
+    return (time.perf_counter() - start) / (repeats * ddim_steps)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default='', help='time the real ControlNet instead of a null model')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--image_size', type=int, default=512)
+    parser.add_argument('--ddim_steps', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.model_name:
+        from cldm.model import create_model
+        model = create_model(f'./models/{args.model_name}.yaml').cuda().eval()
+    else:
+        model = NullModel()
+
+    for name, cls in (('legacy', LegacyDDIMSampler), ('memoized', DDIMSampler)):
+        elapsed = time_make_schedule(cls(model), args.ddim_steps, args.repeats)
+        print(f'{name:>8s} make_schedule {elapsed * 1e3:8.3f}ms')
+    for batch_size in args.batch_sizes:
+        x = torch.randn((batch_size, 4, args.image_size // 8, args.image_size // 8), device="cuda")
+        control = torch.rand((batch_size, 3, args.image_size, args.image_size), device="cuda")
+        if args.model_name:
+            with torch.no_grad():
+                cond = {"c_concat": [control], "c_crossattn": [model.get_learned_conditioning([""] * batch_size)]}
+        else:
+            cond = {"c_concat": [control], "c_crossattn": [torch.zeros((batch_size, 77, 768), device="cuda")]}
+        line = f'b={batch_size:>3d}'
+        for name, cls in (('legacy', LegacyDDIMSampler), ('memoized', DDIMSampler)):
+            elapsed = time_decode(cls(model), x, cond, args.ddim_steps, args.repeats)
+            line += f' | {name} {elapsed * 1e3:8.3f}ms/step'
+        print(line)
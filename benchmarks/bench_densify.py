@@ -0,0 +1,91 @@
+### benchmark of the sequential clone -> split -> prune densification against the fused single pass
+import os
+import sys
+import time
+import argparse
+import torch
+from torch import nn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from arguments import OptimizationParams
+from scene.gaussian_model import GaussianModel, COLUMNAR_ATTRIBUTES
+
+
+def make_gaussians(num_points, opt, seed=0):
+    torch.manual_seed(seed)
+    gaussians = GaussianModel(3)
+    gaussians._xyz = nn.Parameter(torch.randn((num_points, 3), device="cuda"))
+    gaussians._features_dc = nn.Parameter(torch.randn((num_points, 1, 3), device="cuda"))
+    gaussians._features_rest = nn.Parameter(torch.randn((num_points, 15, 3), device="cuda"))
+    gaussians._scaling = nn.Parameter(torch.randn((num_points, 3), device="cuda") - 4)
+    gaussians._rotation = nn.Parameter(torch.randn((num_points, 4), device="cuda"))
+    gaussians._opacity = nn.Parameter(torch.randn((num_points, 1), device="cuda") * 3)
+    gaussians.max_radii2D = torch.zeros((num_points), device="cuda")
+    gaussians.spatial_lr_scale = 1.0
+    gaussians.training_setup(opt)
+
+    # populate the Adam moments and the densification statistics
+    loss = sum((p ** 2).sum() for p in (gaussians._xyz, gaussians._features_dc, gaussians._features_rest,
+                                        gaussians._scaling, gaussians._rotation, gaussians._opacity))
+    loss.backward()
+    gaussians.optimizer.step()
+    gaussians.optimizer.zero_grad(set_to_none=True)
+    gaussians.xyz_gradient_accum += torch.rand((num_points, 1), device="cuda") * 4 * opt.densify_grad_threshold
+    gaussians.denom += 1
+    return gaussians
+
+def snapshot(gaussians):
+    """ Host copies of every per-point tensor: the parameters, their Adam moments and the densification statistics """
+    tensors = {name: getattr(gaussians, attr).detach().cpu() for name, attr in COLUMNAR_ATTRIBUTES.items()}
+    for group in gaussians.optimizer.param_groups:
+        state = gaussians.optimizer.state[group["params"][0]]
+        for moment in ("exp_avg", "exp_avg_sq"):
+            tensors[f'{group["name"]}.{moment}'] = state[moment].detach().cpu()
+    for name in ("xyz_gradient_accum", "denom", "max_radii2D"):
+        tensors[name] = getattr(gaussians, name).detach().cpu()
+    return tensors
+
+def max_differences(reference, tensors):
+    """ Max abs difference per tensor, inf when the shapes differ """
+    return {name: (reference[name] - tensors[name]).abs().max().item() if reference[name].shape == tensors[name].shape else float('inf')
+            for name in reference}
+
+def run(num_points, opt, extent):
+    gaussians = make_gaussians(num_points, opt)
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base_memory = torch.cuda.memory_allocated()
+    torch.manual_seed(1) # the same split samples for every variant
+    start = time.perf_counter()
+    with torch.no_grad():
+        gaussians.densify_and_prune(opt.densify_grad_threshold, 0.005, extent, 20)
+    torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    peak = torch.cuda.max_memory_allocated() - base_memory
+    return elapsed, peak, snapshot(gaussians)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    op = OptimizationParams(parser)
+    parser.add_argument('--num_points', type=int, nargs='+', default=[100_000, 1_000_000, 3_000_000])
+    parser.add_argument('--extent', type=float, default=1.0)
+    args = parser.parse_args()
+    opt = op.extract(args)
+
+    for n in args.num_points:
+        results, reference = {}, None
+        for name, fused, growth in (('sequential', False, 0.0), ('fused', True, 0.0), ('fused+capacity', True, 0.5)):
+            opt.fused_densification, opt.capacity_growth = fused, growth
+            run(min(n, 10_000), opt, args.extent) # warm up
+            elapsed, peak, tensors = run(n, opt, args.extent)
+            torch.cuda.empty_cache()
+            if reference is None:
+                reference = tensors
+            else:
+                # the fused paths must reproduce the sequential one exactly, optimizer state included
+                differences = {key: value for key, value in max_differences(reference, tensors).items() if value != 0}
+                assert not differences, f'{name} differs from sequential: {differences}'
+            results[name] = (elapsed, peak)
+        print(f'N={n:>9d} points {reference["xyz"].shape[0]:>9d} after densification | '
+              + ' | '.join(f'{name} {t * 1e3:7.1f}ms peak {peak / 2 ** 20:7.1f}MB' for name, (t, peak) in results.items()))
@@ -0,0 +1,74 @@
+### benchmark of the kNN statistic used by GaussianModel.remove_outliers
+import os
+import sys
+import time
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.knn_utils import knn_distance_statistics
+
+
+def full_knn_statistics(points, K):
+    """ The original remove_outliers call: one knn_points over the whole cloud """
+    import pytorch3d.ops as p3dops
+    nearest_k_distance = p3dops.knn_points(points[None], points[None], K=K).dists
+    return nearest_k_distance.mean(dim=-1)[0], nearest_k_distance.mean(), nearest_k_distance.std()
+
+def sample_points(num_points, device):
+    # points on a noisy sphere plus a few far-away floaters, like a coarse 3DGS object
+    points = torch.randn((num_points, 3), device=device)
+    points = points / points.norm(dim=-1, keepdim=True) + 0.02 * torch.randn((num_points, 3), device=device)
+    points[:num_points // 100] *= 3
+    return points
+
+def measure(fn, device):
+    if device == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    result = fn()
+    if device == "cuda":
+        torch.cuda.synchronize()
+        return result, time.perf_counter() - start, (torch.cuda.max_memory_allocated() - base_memory) / 2 ** 20
+    return result, time.perf_counter() - start, float('nan')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_points', type=int, nargs='+', default=[10_000, 100_000, 300_000, 1_000_000])
+    parser.add_argument('--K', type=int, default=0, help='0 for sqrt(N), as in remove_outliers')
+    parser.add_argument('--sample_size', type=int, default=0)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--skip_full', action='store_true', help='skip the single knn_points call (it may run out of memory)')
+    args = parser.parse_args()
+
+    for n in args.num_points:
+        points = sample_points(n, args.device)
+        K = args.K or int(n ** 0.5)
+        methods = {
+            'voxel': lambda: knn_distance_statistics(points, K, backend='voxel', sample_size=args.sample_size),
+            # brute force: chunked knn_points, or torch.cdist + topk without pytorch3d
+            'brute-chunked': lambda: knn_distance_statistics(points, K, backend='pytorch3d', sample_size=args.sample_size),
+        }
+        if not args.skip_full:
+            methods['pytorch3d-full'] = lambda: full_knn_statistics(points, K)
+        line = f'N={n:>8d} K={K:>5d}'
+        results, times = {}, {}
+        for name, fn in methods.items():
+            try:
+                results[name], elapsed, peak = measure(fn, args.device)
+                times[name] = elapsed
+                line += f' | {name} {elapsed:7.3f}s {peak:8.1f}MB'
+            except (ImportError, RuntimeError) as e:
+                line += f' | {name} failed ({type(e).__name__})'
+        if 'brute-chunked' in results and 'voxel' in results:
+            ref_mean, ref_mu, ref_std = results['brute-chunked']
+            voxel_mean, mu, std = results['voxel']
+            ref_mask = ref_mean >= ref_mu + ref_std
+            mask = voxel_mean >= mu + std
+            line += f' | voxel speedup {times["brute-chunked"] / times["voxel"]:5.2f}x'
+            line += f' | voxel max rel error {((voxel_mean - ref_mean).abs() / ref_mean.clamp_min(1e-12)).max().item():.1e}'
+            line += f' | voxel mask agreement {(mask == ref_mask).float().mean().item() * 100:.2f}%'
+        print(line)
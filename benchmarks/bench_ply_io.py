@@ -0,0 +1,75 @@
+### micro-benchmark of the Gaussian PLY writer/reader against the plyfile path
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from plyfile import PlyData, PlyElement
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.ply_utils import write_vertex_ply, read_vertex_ply, sorted_attribute_names
+
+
+def gaussian_attribute_names(sh_degree):
+    l = ['x', 'y', 'z', 'nx', 'ny', 'nz']
+    l += ['f_dc_{}'.format(i) for i in range(3)]
+    l += ['f_rest_{}'.format(i) for i in range(3 * (sh_degree + 1) ** 2 - 3)]
+    l.append('opacity')
+    l += ['scale_{}'.format(i) for i in range(3)]
+    l += ['rot_{}'.format(i) for i in range(4)]
+    return l
+
+def plyfile_write(path, names, attributes):
+    elements = np.empty(attributes.shape[0], dtype=[(attribute, 'f4') for attribute in names])
+    elements[:] = list(map(tuple, attributes))
+    PlyData([PlyElement.describe(elements, 'vertex')]).write(path)
+
+def plyfile_read(path):
+    plydata = PlyData.read(path)
+    columns = []
+    for prefix in ('x', 'y', 'z', 'f_dc_', 'f_rest_', 'opacity', 'scale_', 'rot'):
+        if prefix in ('x', 'y', 'z', 'opacity'):
+            columns.append(np.asarray(plydata.elements[0][prefix])[:, None])
+            continue
+        names = sorted_attribute_names([p.name for p in plydata.elements[0].properties], prefix)
+        block = np.zeros((len(plydata.elements[0].data), len(names)))
+        for idx, attr_name in enumerate(names):
+            block[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        columns.append(block)
+    return np.concatenate(columns, axis=1)
+
+def fast_read(path):
+    names, vertices = read_vertex_ply(path)
+    return np.array(vertices[:, [i for i, name in enumerate(names) if not name.startswith('n')]])
+
+def timeit(fn, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_points', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--sh_degree', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    names = gaussian_attribute_names(args.sh_degree)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        ref_path, fast_path = os.path.join(tmp_dir, 'plyfile.ply'), os.path.join(tmp_dir, 'fast.ply')
+        for n in args.num_points:
+            attributes = np.random.randn(n, len(names)).astype(np.float32)
+            t_ref_w = timeit(plyfile_write, ref_path, names, attributes, repeat=args.repeat)
+            t_fast_w = timeit(write_vertex_ply, fast_path, names, attributes, repeat=args.repeat)
+            with open(ref_path, 'rb') as f_ref, open(fast_path, 'rb') as f_fast:
+                assert f_ref.read() == f_fast.read(), 'PLY files are not byte-identical'
+            t_ref_r = timeit(plyfile_read, ref_path, repeat=args.repeat)
+            t_fast_r = timeit(fast_read, fast_path, repeat=args.repeat)
+            assert np.array_equal(plyfile_read(ref_path).astype(np.float32), fast_read(fast_path))
+            print(f'N={n:>9d} | write plyfile {t_ref_w:.3f}s fast {t_fast_w:.3f}s ({t_ref_w / t_fast_w:.1f}x)'
+                  f' | read plyfile {t_ref_r:.3f}s fast {t_fast_r:.3f}s ({t_ref_r / t_fast_r:.1f}x)')
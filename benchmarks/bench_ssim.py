@@ -0,0 +1,101 @@
+### benchmark and numerical check of the separable SSIM against the previous 2D-window implementation
+import os
+import sys
+import time
+import argparse
+import torch
+import torch.nn.functional as F
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.loss_utils import create_window, ssim, l1_loss, l1_dssim_loss
+
+
+def legacy_ssim(img1, img2, window_size=11, size_average=True):
+    """ The previous utils.loss_utils.ssim: a new window per call and five 2D grouped convolutions """
+    channel = img1.size(-3)
+    window = create_window(window_size, channel).to(img1.device).type_as(img1)
+    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
+    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
+    mu1_sq, mu2_sq, mu1_mu2 = mu1.pow(2), mu2.pow(2), mu1 * mu2
+    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
+    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
+    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    C1, C2 = 0.01 ** 2, 0.03 ** 2
+    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+    return ssim_map.mean() if size_average else ssim_map.mean(1).mean(1).mean(1)
+
+def legacy_l1_dssim_loss(image, gt, lambda_dssim):
+    return (1.0 - lambda_dssim) * torch.abs(image - gt).mean() + lambda_dssim * (1.0 - legacy_ssim(image, gt))
+
+def check(shape, device, dtype, tolerance):
+    """ Max abs difference of the values and of the gradients w.r.t. the first image """
+    torch.manual_seed(0)
+    gt = torch.rand(shape, device=device, dtype=dtype)
+    image = (gt + 0.1 * torch.randn_like(gt)).clamp(0, 1).requires_grad_()
+    pairs = [(lambda a, b: ssim(a, b), legacy_ssim),
+             (lambda a, b: l1_dssim_loss(a, b, 0.2)[0], lambda a, b: legacy_l1_dssim_loss(a, b, 0.2))]
+    if len(shape) == 4: # per image values of a batch
+        pairs.append((lambda a, b: ssim(a, b, size_average=False), lambda a, b: legacy_ssim(a, b, size_average=False)))
+    errors = []
+    for fn, legacy_fn in pairs:
+        value = fn(image, gt)
+        grad, = torch.autograd.grad(value.sum(), image)
+        legacy_value = legacy_fn(image, gt)
+        legacy_grad, = torch.autograd.grad(legacy_value.sum(), image)
+        errors.append(max((value - legacy_value).abs().max().item(), (grad - legacy_grad).abs().max().item()))
+    assert max(errors) < tolerance, f'{shape} {dtype}: max error {max(errors)}'
+    return max(errors)
+
+def saved_megabytes(fn, image, gt):
+    """ Size of the tensors autograd keeps for the backward of fn """
+    storages = {}
+    def pack(tensor):
+        storages[tensor.untyped_storage().data_ptr()] = tensor.untyped_storage().nbytes()
+        return tensor
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn(image, gt)
+    return sum(storages.values()) / 2 ** 20
+
+def timing(fn, image, gt, backward, repeats, device):
+    def step():
+        value = fn(image, gt)
+        if backward:
+            value.backward()
+
+    for _ in range(3):
+        step()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    if device == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    # gradients of the fused loss w.r.t. both images, against finite differences
+    image, gt = (torch.rand((2, 3, 12, 13), dtype=torch.float64, requires_grad=True) for _ in range(2))
+    assert torch.autograd.gradcheck(lambda a, b: l1_dssim_loss(a, b, 0.2, window_size=5)[0], (image, gt))
+
+    for shape in ((3, 64, 48), (2, 3, 37, 64), (1, 1, 32, 32)):
+        print(f'check {str(shape):>18s}: max error {check(shape, args.device, torch.float64, 1e-8):.2e} (float64), '
+              f'{check(shape, args.device, torch.float32, 1e-5):.2e} (float32)')
+
+    for resolution in args.resolutions:
+        gt = torch.rand((3, resolution, resolution), device=args.device)
+        image = gt.clone().requires_grad_()
+        line = f'{resolution:>5d}^2'
+        for name, fn in (('legacy ssim', legacy_ssim), ('ssim', ssim),
+                         ('legacy l1+dssim', lambda a, b: legacy_l1_dssim_loss(a, b, 0.2)),
+                         ('l1 + ssim', lambda a, b: 0.8 * l1_loss(a, b) + 0.2 * (1.0 - ssim(a, b))),
+                         ('fused l1+dssim', lambda a, b: l1_dssim_loss(a, b, 0.2)[0])):
+            line += f' | {name} {timing(fn, image, gt, True, args.repeats, args.device) * 1e3:7.3f}ms {saved_megabytes(fn, image, gt):6.1f}MB'
+        print(line)
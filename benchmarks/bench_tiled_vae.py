@@ -0,0 +1,134 @@
+### peak memory and seam error of the tiled VAE encode/decode against the untiled one
+### --check: asserted CPU check of the tiling against a small randomly initialised VAE (no GPU or checkpoint needed)
+import os
+import sys
+import time
+import argparse
+import torch
+import torch.nn.functional as F
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cldm.model import create_model
+from ldm.models.autoencoder import AutoencoderKL, tile_starts, blend_ramp
+
+
+@torch.no_grad()
+def measure(fn, x):
+    torch.cuda.synchronize()
+    torch.cuda.reset_peak_memory_stats()
+    base_memory = torch.cuda.memory_allocated()
+    start = time.perf_counter()
+    try:
+        y = fn(x)
+    except RuntimeError as e: # out of memory
+        return None, type(e).__name__, 0.
+    torch.cuda.synchronize()
+    return y, time.perf_counter() - start, (torch.cuda.max_memory_allocated() - base_memory) / 2 ** 20
+
+def timing(t, peak):
+    return f'{t:>16s}' if isinstance(t, str) else f'{t * 1e3:7.1f}ms peak {peak:8.1f}MB'
+
+def error(y, ref):
+    if y is None or ref is None:
+        return '     n/a'
+    return f'{(y - ref).abs().max().item():8.5f}'
+
+def smooth_image(height, width, device):
+    """ A smooth image, as the VAE reconstructs rendered views: the seam error is not hidden by noise """
+    ys = torch.linspace(-1., 1., height, device=device)[:, None]
+    xs = torch.linspace(-1., 1., width, device=device)[None, :]
+    return torch.stack([torch.sin(3 * ys) * torch.cos(2 * xs),
+                        torch.cos(5 * ys).expand(height, width),
+                        torch.sin(4 * xs).expand(height, width)])[None]
+
+def local_vae(seed=0):
+    """
+    A small randomly initialised VAE (downsample factor 2) without its non-local layers: the
+    GroupNorms and the mid-block attention see the whole image, so with random weights the tiles
+    of the full model differ from the untiled pass by as much as its output. What remains differs
+    only by the zero padding at the tile borders, which the blend ramps are meant to hide.
+    """
+    torch.manual_seed(seed)
+    ddconfig = dict(double_z=True, z_channels=4, resolution=64, in_channels=3, out_ch=3, ch=32, ch_mult=[1, 2],
+                    num_res_blocks=1, attn_resolutions=[], dropout=0.0)
+    vae = AutoencoderKL(ddconfig, {"target": "torch.nn.Identity"}, embed_dim=4).eval()
+    for module in list(vae.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, torch.nn.GroupNorm) or name == 'attn_1':
+                setattr(module, name, torch.nn.Identity())
+    return vae
+
+@torch.no_grad()
+def check(tile_size, tile_overlap, tolerance):
+    # tiles cover the whole range, stride apart, the last one flush with the end and overlapping more when size - tile is not a multiple of the stride
+    assert tile_starts(64, 64, 48) == [0] and tile_starts(40, 64, 48) == [0]
+    assert tile_starts(100, 64, 48) == [0, 36] and tile_starts(160, 64, 48) == [0, 48, 96]
+    for size in range(1, 300):
+        starts = tile_starts(size, 64, 48)
+        assert starts[0] == 0 and starts[-1] == max(size - 64, 0)
+        assert all(0 < b - a <= 48 for a, b in zip(starts, starts[1:])), (size, starts)
+
+    # ramps over the overlaps only, and the ramps of two neighbouring tiles sum to 1
+    assert torch.equal(blend_ramp(8, 4, True, True, 'cpu'), torch.ones(8))
+    assert torch.equal(blend_ramp(8, 4, True, False, 'cpu'), torch.tensor([1., 1., 1., 1., 7 / 8, 5 / 8, 3 / 8, 1 / 8]))
+    assert torch.equal(blend_ramp(8, 4, False, True, 'cpu'), torch.tensor([1 / 8, 3 / 8, 5 / 8, 7 / 8, 1., 1., 1., 1.]))
+    assert torch.allclose(blend_ramp(32, 8, False, True, 'cpu')[:8] + blend_ramp(32, 8, True, False, 'cpu')[-8:], torch.ones(8))
+    assert (blend_ramp(6, 4, False, False, 'cpu') > 0).all() and torch.equal(blend_ramp(2, 4, True, True, 'cpu'), torch.ones(2))
+
+    # sizes that are not a multiple of the stride, and non-square inputs with one side within a single tile
+    vae = local_vae()
+    for height, width in ((100, 100), (150, 58), (58, 150)):
+        x = smooth_image(height, width, 'cpu')
+        # with a pointwise encoder / decoder the stitching itself must be exact
+        latents = F.avg_pool2d(x, 2)
+        for fn, input, tile, overlap, scale in ((lambda t: F.avg_pool2d(t, 2), x, tile_size, tile_overlap, 0.5),
+                                                (lambda t: F.interpolate(t, scale_factor=2), latents, tile_size // 2, tile_overlap // 2, 2)):
+            ref, y = fn(input), vae._tiled(fn, input, tile, overlap, scale)
+            assert y.shape == ref.shape and torch.allclose(y, ref, atol=1e-6), f'stitching {height}x{width} scale {scale}'
+
+        vae.enable_tiling(0)
+        ref_z = vae.encode(x).mode()
+        ref_x = vae.decode(ref_z)
+        vae.enable_tiling(tile_size, tile_overlap)
+        z = vae.encode(x).mode()
+        y = vae.decode(ref_z)
+        # max error relative to the largest output value
+        err_enc = ((z - ref_z).abs().max() / ref_z.abs().max()).item()
+        err_dec = ((y - ref_x).abs().max() / ref_x.abs().max()).item()
+        print(f'{height:>4d}x{width:<4d} tile {tile_size} overlap {tile_overlap} | encode err {err_enc:.4f} | decode err {err_dec:.4f}')
+        assert z.shape == ref_z.shape and err_enc < tolerance, f'tiled encode error {err_enc:.4f} >= {tolerance}'
+        assert y.shape == ref_x.shape and err_dec < tolerance, f'tiled decode error {err_dec:.4f} >= {tolerance}'
+    print('tiled VAE check passed')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default='control_v11f1e_sd15_tile')
+    parser.add_argument('--image_sizes', type=int, nargs='+', default=[512, 1024, 2048])
+    parser.add_argument('--tile_size', type=int, default=512)
+    parser.add_argument('--tile_overlaps', type=int, nargs='+', default=[32, 64, 128])
+    parser.add_argument('--check', action='store_true', help='only run the CPU check of the tiling, on a small random VAE')
+    parser.add_argument('--check_tolerance', type=float, default=0.05, help='max tiled error relative to the largest output value')
+    args = parser.parse_args()
+
+    if args.check:
+        check(64, 32, args.check_tolerance)
+        sys.exit(0)
+
+    model = create_model(f'./models/{args.model_name}.yaml').cuda().eval()
+    vae = model.first_stage_model
+
+    for image_size in args.image_sizes:
+        x = smooth_image(image_size, image_size, "cuda")
+        vae.enable_tiling(0)
+        ref_z, t, peak = measure(lambda x: vae.encode(x).mode(), x)
+        ref_x, t_dec, peak_dec = measure(vae.decode, ref_z) if ref_z is not None else (None, 'skipped', 0.)
+        print(f'{image_size:>5d}^2 untiled      | encode {timing(t, peak)}             | decode {timing(t_dec, peak_dec)}')
+        for overlap in args.tile_overlaps:
+            vae.enable_tiling(args.tile_size, overlap)
+            z, t_enc, peak_enc = measure(lambda x: vae.encode(x).mode(), x)
+            # decode the untiled latents when available, so that only the decoder seams are measured
+            y, t_dec, peak_dec = measure(vae.decode, ref_z if ref_z is not None else z) if z is not None else (None, 'skipped', 0.)
+            print(f'{image_size:>5d}^2 overlap {overlap:>4d} | encode {timing(t_enc, peak_enc)} err {error(z, ref_z)}'
+                  f' | decode {timing(t_dec, peak_dec)} err {error(y, ref_x)}')
+            torch.cuda.empty_cache()
@@ -0,0 +1,66 @@
+### quality and wall time of Gaussian repair with the DDIM sampler against DPM-Solver++
+# every sampler setting runs a full train_repair.py, then render.py evaluates the repaired Gaussians
+# on the test views, e.g.
+#   python benchmarks/eval_repair_sampler.py --tag kitchen -m output/gs_init/kitchen --sparse_view_num 4 \
+#       --init_pcd_name visual_hull_4 -- system.exp_name=output/controlnet_finetune/kitchen \
+#       data.data_dir=data/mip360/kitchen data.prompt="a photo of a xxy5syt00" system.refresh_size=8 data.refresh_size=8
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_repair(args, sampler, steps, extras):
+    tag = f'{args.tag}_{sampler}_{steps}'
+    cmd = [sys.executable, 'train_repair.py', '--config', args.config, '--train', '--gpu', args.gpu,
+           f'tag={tag}', f'system.init_dreamer={args.model_path}', f'system.sh_degree={args.sh_degree}',
+           f'system.repair_sampler={sampler}']
+    if sampler != 'ddim': # the steps of ddim are set by the repair loop
+        cmd.append(f'system.repair_sampler_steps={steps}')
+    cmd += extras
+    start = time.time()
+    subprocess.run(cmd, cwd=ROOT, check=True)
+    return tag, time.time() - start
+
+def evaluate(args, ply_path):
+    cmd = [sys.executable, 'render.py', '-m', args.model_path, '--sparse_view_num', str(args.sparse_view_num),
+           '--sh_degree', str(args.sh_degree), '--init_pcd_name', args.init_pcd_name, '--white_background',
+           '--skip_all', '--skip_train', '--not_generate_video', '--load_ply', ply_path]
+    subprocess.run(cmd, cwd=ROOT, check=True)
+    # render.py names the output after the loaded iteration, which is None for an external ply
+    with open(os.path.join(ROOT, args.model_path, 'test', 'ours_None', 'results.json')) as f:
+        return json.load(f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', type=str, default='configs/gaussian-object.yaml')
+    parser.add_argument('--tag', type=str, required=True)
+    parser.add_argument('-m', '--model_path', type=str, required=True, help='the gs_init output of the scene')
+    parser.add_argument('--sparse_view_num', type=int, default=4)
+    parser.add_argument('--init_pcd_name', type=str, default='visual_hull_4')
+    parser.add_argument('--sh_degree', type=int, default=2)
+    parser.add_argument('--gpu', type=str, default='0')
+    parser.add_argument('--exp_root_dir', type=str, default='output/gaussian_object')
+    parser.add_argument('--settings', type=str, nargs='+', default=['ddim:50', 'dpm_solver++:20', 'dpm_solver++:15', 'dpm_solver++:10'],
+                        help='sampler:steps, the steps of ddim are fixed to 50 by the repair loop')
+    args, extras = parser.parse_known_args()
+    extras = [e for e in extras if e != '--']
+
+    results = {}
+    for setting in args.settings:
+        sampler, steps = setting.split(':')
+        tag, elapsed = run_repair(args, sampler, int(steps), extras)
+        metrics = evaluate(args, os.path.join(args.exp_root_dir, tag, 'save', 'last.ply'))
+        results[setting] = dict(metrics, time=elapsed)
+
+    baseline = results.get(args.settings[0])
+    for setting, r in results.items():
+        print(f'{setting:>18s} | PSNR {r["PSNR"]:7.3f} | SSIM {r["SSIM"]:6.4f} | LPIPS {r["LPIPS"]:6.4f} | '
+              f'repair {r["time"]:8.1f}s ({baseline["time"] / r["time"]:4.2f}x vs {args.settings[0]})')
+    with open(os.path.join(ROOT, args.exp_root_dir, f'{args.tag}_sampler_eval.json'), 'w') as f:
+        json.dump(results, f, indent=True)
@@ -1,3 +1,4 @@
+import time
 import einops
 import torch
 import torch as th
@@ -18,6 +19,7 @@ from ldm.models.diffusion.ddpm import LatentDiffusion
 from ldm.util import log_txt_as_img, exists, instantiate_from_config
 from ldm.models.diffusion.ddim import DDIMSampler
 from minlora import get_lora_params
+from lightning_utilities.core.rank_zero import rank_zero_warn
 
 
 class ControlledUnetModel(UNetModel):
@@ -315,6 +317,49 @@ class ControlLDM(LatentDiffusion):
         self.only_mid_control = only_mid_control
         self.control_scales = [1.0] * 13
         self.global_average_pooling = global_average_pooling
+        self.cond_cache = {}
+        self.cond_cache_state = None
+        self.compiled_denoise = None
+        self._control_scales_tensor = (None, torch.zeros(0))
+        self.cond_cache_stats = {"hits": 0, "misses": 0, "time_saved": 0.0}
+        self._cond_encode_time = 0.0
+
+    def _cond_stage_state(self):
+        # parameter identities and in-place versions: changes when LoRA is added, loaded or stepped
+        return tuple((id(p), p._version) for p in self.cond_stage_model.parameters())
+
+    def invalidate_conditioning_cache(self):
+        self.cond_cache = {}
+        self.cond_cache_state = None
+
+    def get_learned_conditioning(self, c):
+        """
+        Text conditioning memoized per prompt. Only prompt lists encoded without grad are cached;
+        the cache is dropped whenever the weights of the cond stage model (e.g. its LoRA) change.
+        """
+        if torch.is_grad_enabled() or not isinstance(c, (list, tuple)) or not all(isinstance(x, str) for x in c):
+            return super().get_learned_conditioning(c)
+        state = self._cond_stage_state()
+        if state != self.cond_cache_state:
+            self.cond_cache = {}
+            self.cond_cache_state = state
+        missing = list(dict.fromkeys(x for x in c if x not in self.cond_cache))
+        hits = len(c) - len(missing)
+        self.cond_cache_stats["hits"] += hits
+        self.cond_cache_stats["misses"] += len(missing)
+        self.cond_cache_stats["time_saved"] += hits * self._cond_encode_time
+        if len(missing) > 0:
+            start = time.time()
+            embeddings = super().get_learned_conditioning(missing)
+            if embeddings.is_cuda:
+                torch.cuda.synchronize(embeddings.device)
+            self._cond_encode_time = (time.time() - start) / len(missing)
+            self.cond_cache.update(zip(missing, embeddings))
+        return torch.stack([self.cond_cache[x] for x in c], dim=0)
+
+    def conditioning_cache_hit_rate(self):
+        lookups = self.cond_cache_stats["hits"] + self.cond_cache_stats["misses"]
+        return self.cond_cache_stats["hits"] / max(lookups, 1)
 
     @torch.no_grad()
     def get_input(self, batch, k, bs=None, *args, **kwargs):
@@ -329,19 +374,70 @@ class ControlLDM(LatentDiffusion):
 
     def apply_model(self, x_noisy, t, cond, *args, **kwargs):
         assert isinstance(cond, dict)
+        cat = lambda tensors: tensors[0] if len(tensors) == 1 else torch.cat(tensors, 1)
+        cond_txt = cat(cond['c_crossattn'])
+        hint = None if cond['c_concat'] is None else cat(cond['c_concat'])
+
+        if self.compiled_denoise is not None:
+            eps = self._apply_compiled(x_noisy, t, cond_txt, hint)
+            if eps is not None:
+                return eps
+        return self.denoise(x_noisy, t, cond_txt, hint, self.control_scales)
+
+    def denoise(self, x_noisy, t, cond_txt, hint, control_scales):
+        """ One ControlNet + UNet evaluation; control_scales is a list of floats or a [13] tensor """
         diffusion_model = self.model.diffusion_model
-
-        cond_txt = torch.cat(cond['c_crossattn'], 1)
-
-        if cond['c_concat'] is None:
-            eps = diffusion_model(x=x_noisy, timesteps=t, context=cond_txt, control=None, only_mid_control=self.only_mid_control)
-        else:
-            control = self.control_model(x=x_noisy, hint=torch.cat(cond['c_concat'], 1), timesteps=t, context=cond_txt)
-            control = [c * scale for c, scale in zip(control, self.control_scales)]
-            if self.global_average_pooling:
-                control = [torch.mean(c, dim=(2, 3), keepdim=True) for c in control]
-            eps = diffusion_model(x=x_noisy, timesteps=t, context=cond_txt, control=control, only_mid_control=self.only_mid_control)
-
+        if hint is None:
+            return diffusion_model(x=x_noisy, timesteps=t, context=cond_txt, control=None, only_mid_control=self.only_mid_control)
+        control = self.control_model(x=x_noisy, hint=hint, timesteps=t, context=cond_txt)
+        control = [c * scale for c, scale in zip(control, control_scales)]
+        if self.global_average_pooling:
+            control = [torch.mean(c, dim=(2, 3), keepdim=True) for c in control]
+        return diffusion_model(x=x_noisy, timesteps=t, context=cond_txt, control=control, only_mid_control=self.only_mid_control)
+
+    def compile_denoiser(self, mode="reduce-overhead", backend="inductor", max_signatures=4):
+        """
+        Opt-in: run denoise through torch.compile. With the inductor backend, mode "reduce-overhead"
+        also captures the step into CUDA graphs replayed from static input buffers. Batches are
+        padded to the next power of two, so that the varying number of active rows of
+        DDIMSampler.decode maps to a few sizes; every input signature (padded shapes, dtypes,
+        device, with or without hint) is compiled once. Beyond max_signatures new signatures, or
+        for a signature whose compilation failed, apply_model runs eagerly.
+        Use backend "aot_eager" (or "inductor" with a C++ toolchain) to exercise it on CPU.
+        """
+        options = dict(mode=mode) if backend == "inductor" else {}
+        self.compiled_denoise = torch.compile(self.denoise, backend=backend, dynamic=False, **options)
+        self.compiled_signatures = set()
+        self.failed_signatures = set()
+        self.max_compiled_signatures = max_signatures
+
+    def _apply_compiled(self, x_noisy, t, cond_txt, hint):
+        batch_size = x_noisy.shape[0]
+        padding = (1 << (batch_size - 1).bit_length()) - batch_size
+        if padding > 0: # repeat the last row, rows are denoised independently
+            pad = lambda tensor: None if tensor is None else torch.cat([tensor, tensor[-1:].expand(padding, *tensor.shape[1:])])
+            x_noisy, t, cond_txt, hint = pad(x_noisy), pad(t), pad(cond_txt), pad(hint)
+        signature = (x_noisy.shape, x_noisy.dtype, x_noisy.device, t.shape, t.dtype, cond_txt.shape,
+                     None if hint is None else hint.shape)
+        if signature in self.failed_signatures:
+            return None
+        first_call = signature not in self.compiled_signatures
+        if first_call and len(self.compiled_signatures) >= self.max_compiled_signatures:
+            return None
+        # the scales become a tensor input so that changing their values does not recompile
+        scales = tuple(self.control_scales)
+        if self._control_scales_tensor[0] != scales or self._control_scales_tensor[1].device != x_noisy.device:
+            self._control_scales_tensor = (scales, torch.tensor(scales, dtype=x_noisy.dtype, device=x_noisy.device))
+        try:
+            # graph outputs are overwritten by the next replay, callers may hold on to this one
+            eps = self.compiled_denoise(x_noisy, t, cond_txt, hint, self._control_scales_tensor[1])[:batch_size].clone()
+        except Exception as e:
+            if not first_call:
+                raise
+            rank_zero_warn(f"compiled denoiser failed for inputs {signature} ({type(e).__name__}: {e}), running them eagerly")
+            self.failed_signatures.add(signature)
+            return None
+        self.compiled_signatures.add(signature)
         return eps
 
     @torch.no_grad()
@@ -435,6 +531,11 @@ class ControlLDM(LatentDiffusion):
         opt = torch.optim.AdamW(params, lr=lr)
         return opt
 
+    def on_train_batch_end(self, *args, **kwargs):
+        super().on_train_batch_end(*args, **kwargs)
+        self.log("cond_cache/hit_rate", self.conditioning_cache_hit_rate(), logger=True, on_step=True, on_epoch=False)
+        self.log("cond_cache/time_saved", self.cond_cache_stats["time_saved"], logger=True, on_step=True, on_epoch=False)
+
     def low_vram_shift(self, is_diffusing):
         if is_diffusing:
             self.model = self.model.cuda()
@@ -8,11 +8,22 @@ from ldm.modules.diffusionmodules.util import make_ddim_sampling_parameters, mak
 
 
 class DDIMSampler(object):
-    def __init__(self, model, schedule="linear", **kwargs):
+    # everything build_schedule sets
+    SCHEDULE_BUFFERS = ('ddim_timesteps', 'betas', 'alphas_cumprod', 'alphas_cumprod_prev', 'sqrt_alphas_cumprod',
+                        'sqrt_one_minus_alphas_cumprod', 'log_one_minus_alphas_cumprod', 'sqrt_recip_alphas_cumprod',
+                        'sqrt_recipm1_alphas_cumprod', 'ddim_sigmas', 'ddim_alphas', 'ddim_alphas_prev',
+                        'ddim_sqrt_one_minus_alphas', 'ddim_sqrt_alphas', 'ddim_step_coeffs',
+                        'ddim_sigmas_for_original_num_steps')
+
+    def __init__(self, model, schedule="linear", batch_cfg=True, **kwargs):
         super().__init__()
         self.model = model
         self.ddpm_num_timesteps = model.num_timesteps
         self.schedule = schedule
+        # run the conditional and unconditional branches of classifier-free guidance as one 2b batch
+        self.batch_cfg = batch_cfg
+        # (ddim_num_steps, ddim_discretize, ddim_eta) -> schedule buffers, see make_schedule
+        self.schedules = {}
 
     def register_buffer(self, name, attr):
         if type(attr) == torch.Tensor:
@@ -21,6 +32,16 @@ class DDIMSampler(object):
         setattr(self, name, attr)
 
     def make_schedule(self, ddim_num_steps, ddim_discretize="uniform", ddim_eta=0., verbose=True):
+        """ Set the schedule buffers, built once per (ddim_num_steps, ddim_discretize, ddim_eta) and reused """
+        key = (ddim_num_steps, ddim_discretize, float(ddim_eta))
+        if key not in self.schedules:
+            self.build_schedule(ddim_num_steps, ddim_discretize=ddim_discretize, ddim_eta=ddim_eta, verbose=verbose)
+            self.schedules[key] = {name: getattr(self, name) for name in self.SCHEDULE_BUFFERS}
+        else:
+            for name, value in self.schedules[key].items():
+                setattr(self, name, value)
+
+    def build_schedule(self, ddim_num_steps, ddim_discretize="uniform", ddim_eta=0., verbose=True):
         self.ddim_timesteps = make_ddim_timesteps(ddim_discr_method=ddim_discretize, num_ddim_timesteps=ddim_num_steps,
                                                   num_ddpm_timesteps=self.ddpm_num_timesteps,verbose=verbose)
         alphas_cumprod = self.model.alphas_cumprod
@@ -46,6 +67,12 @@ class DDIMSampler(object):
         self.register_buffer('ddim_alphas', ddim_alphas)
         self.register_buffer('ddim_alphas_prev', ddim_alphas_prev)
         self.register_buffer('ddim_sqrt_one_minus_alphas', np.sqrt(1. - ddim_alphas))
+        self.register_buffer('ddim_sqrt_alphas', torch.sqrt(torch.as_tensor(ddim_alphas)))
+        # per-step coefficients of p_sample_ddim gathered once on the device, so that no step reads a
+        # scalar back to the host: [S, 4, 1, 1, 1] for a_t, a_prev, sigma_t and sqrt(1 - a_t)
+        step_coeffs = [torch.as_tensor(np.asarray(v), dtype=torch.float32) for v in
+                       (ddim_alphas, ddim_alphas_prev, ddim_sigmas, np.sqrt(1. - ddim_alphas))]
+        self.register_buffer('ddim_step_coeffs', torch.stack(step_coeffs, dim=1).reshape(-1, 4, 1, 1, 1))
         sigmas_for_original_sampling_steps = ddim_eta * torch.sqrt(
             (1 - self.alphas_cumprod_prev) / (1 - self.alphas_cumprod) * (
                         1 - self.alphas_cumprod / self.alphas_cumprod_prev))
@@ -177,6 +204,19 @@ class DDIMSampler(object):
 
         return img, intermediates
 
+    def step_coefficients(self, index, b, device, use_original_steps=False):
+        """ a_t, a_prev, sigma_t and sqrt(1 - a_t) of step index, each broadcastable to [b, 1, 1, 1] """
+        if not use_original_steps:
+            return self.ddim_step_coeffs[index]
+        alphas = self.model.alphas_cumprod
+        alphas_prev = self.model.alphas_cumprod_prev
+        sqrt_one_minus_alphas = self.model.sqrt_one_minus_alphas_cumprod
+        sigmas = self.model.ddim_sigmas_for_original_num_steps
+        return (torch.full((b, 1, 1, 1), alphas[index], device=device),
+                torch.full((b, 1, 1, 1), alphas_prev[index], device=device),
+                torch.full((b, 1, 1, 1), sigmas[index], device=device),
+                torch.full((b, 1, 1, 1), sqrt_one_minus_alphas[index], device=device))
+
     @torch.no_grad()
     def p_sample_ddim(self, x, c, t, index, repeat_noise=False, use_original_steps=False, quantize_denoised=False,
                       temperature=1., noise_dropout=0., score_corrector=None, corrector_kwargs=None,
@@ -187,8 +227,12 @@ class DDIMSampler(object):
         if unconditional_conditioning is None or unconditional_guidance_scale == 1.:
             model_output = self.model.apply_model(x, t, c)
         else:
-            model_t = self.model.apply_model(x, t, c)
-            model_uncond = self.model.apply_model(x, t, unconditional_conditioning)
+            c_in = concat_cond(c, unconditional_conditioning) if self.batch_cfg else None
+            if c_in is not None:
+                model_t, model_uncond = self.model.apply_model(torch.cat([x, x]), torch.cat([t, t]), c_in).chunk(2)
+            else:
+                model_t = self.model.apply_model(x, t, c)
+                model_uncond = self.model.apply_model(x, t, unconditional_conditioning)
             model_output = model_uncond + unconditional_guidance_scale * (model_t - model_uncond)
 
         if self.model.parameterization == "v":
@@ -200,15 +244,8 @@ class DDIMSampler(object):
             assert self.model.parameterization == "eps", 'not implemented'
             e_t = score_corrector.modify_score(self.model, e_t, x, t, c, **corrector_kwargs)
 
-        alphas = self.model.alphas_cumprod if use_original_steps else self.ddim_alphas
-        alphas_prev = self.model.alphas_cumprod_prev if use_original_steps else self.ddim_alphas_prev
-        sqrt_one_minus_alphas = self.model.sqrt_one_minus_alphas_cumprod if use_original_steps else self.ddim_sqrt_one_minus_alphas
-        sigmas = self.model.ddim_sigmas_for_original_num_steps if use_original_steps else self.ddim_sigmas
         # select parameters corresponding to the currently considered timestep
-        a_t = torch.full((b, 1, 1, 1), alphas[index], device=device)
-        a_prev = torch.full((b, 1, 1, 1), alphas_prev[index], device=device)
-        sigma_t = torch.full((b, 1, 1, 1), sigmas[index], device=device)
-        sqrt_one_minus_at = torch.full((b, 1, 1, 1), sqrt_one_minus_alphas[index],device=device)
+        a_t, a_prev, sigma_t, sqrt_one_minus_at = self.step_coefficients(index, b, device, use_original_steps)
 
         # current prediction for x_0
         if self.model.parameterization != "v":
@@ -286,7 +323,7 @@ class DDIMSampler(object):
             sqrt_alphas_cumprod = self.sqrt_alphas_cumprod
             sqrt_one_minus_alphas_cumprod = self.sqrt_one_minus_alphas_cumprod
         else:
-            sqrt_alphas_cumprod = torch.sqrt(self.ddim_alphas)
+            sqrt_alphas_cumprod = self.ddim_sqrt_alphas
             sqrt_one_minus_alphas_cumprod = self.ddim_sqrt_one_minus_alphas
 
         if noise is None:
@@ -297,9 +334,13 @@ class DDIMSampler(object):
     @torch.no_grad()
     def decode(self, x_latent, cond, t_start, unconditional_guidance_scale=1.0, unconditional_conditioning=None,
                use_original_steps=False, callback=None):
-
+        """
+        t_start: number of denoising steps, either one int for the whole batch or one per sample.
+        With per-sample starts, every step only runs the model on the samples that reached it.
+        """
+        t_starts = np.broadcast_to(np.asarray(t_start), (x_latent.shape[0],))
         timesteps = np.arange(self.ddpm_num_timesteps) if use_original_steps else self.ddim_timesteps
-        timesteps = timesteps[:t_start]
+        timesteps = timesteps[:int(t_starts.max())]
 
         time_range = np.flip(timesteps)
         total_steps = timesteps.shape[0]
@@ -310,9 +351,47 @@ class DDIMSampler(object):
         x_dec = x_latent
         for i, step in enumerate(iterator):
             index = total_steps - i - 1
-            ts = torch.full((x_latent.shape[0],), step, device=x_latent.device, dtype=torch.long)
-            x_dec, _ = self.p_sample_ddim(x_dec, cond, ts, index=index, use_original_steps=use_original_steps,
-                                          unconditional_guidance_scale=unconditional_guidance_scale,
-                                          unconditional_conditioning=unconditional_conditioning)
+            active = t_starts > index
+            if active.all():
+                ts = torch.full((x_latent.shape[0],), step, device=x_latent.device, dtype=torch.long)
+                x_dec, _ = self.p_sample_ddim(x_dec, cond, ts, index=index, use_original_steps=use_original_steps,
+                                              unconditional_guidance_scale=unconditional_guidance_scale,
+                                              unconditional_conditioning=unconditional_conditioning)
+            else:
+                rows = torch.from_numpy(np.flatnonzero(active)).to(x_latent.device)
+                ts = torch.full((rows.shape[0],), step, device=x_latent.device, dtype=torch.long)
+                x_active, _ = self.p_sample_ddim(x_dec[rows], select_cond(cond, rows), ts, index=index,
+                                                 use_original_steps=use_original_steps,
+                                                 unconditional_guidance_scale=unconditional_guidance_scale,
+                                                 unconditional_conditioning=select_cond(unconditional_conditioning, rows))
+                x_dec = x_dec.index_copy(0, rows, x_active)
             if callback: callback(i)
         return x_dec
+
+
+def concat_cond(cond, uncond):
+    """
+    The conditional and unconditional conditionings stacked along the batch, or None if they cannot
+    go through the model together, e.g. in guess mode where only the conditional branch has a c_concat.
+    """
+    if isinstance(cond, torch.Tensor) and isinstance(uncond, torch.Tensor):
+        return torch.cat([cond, uncond]) if cond.shape[1:] == uncond.shape[1:] else None
+    if not isinstance(cond, dict) or not isinstance(uncond, dict) or cond.keys() != uncond.keys():
+        return None
+    out = {}
+    for k, v in cond.items():
+        u = uncond[k]
+        if v is None and u is None:
+            out[k] = None
+        elif v is None or u is None or len(v) != len(u) or any(a.shape[1:] != b.shape[1:] for a, b in zip(v, u)):
+            return None
+        else:
+            out[k] = [torch.cat([a, b]) for a, b in zip(v, u)]
+    return out
+
+
+def select_cond(cond, rows):
+    """ The rows of a conditioning dict ({key: [tensor] or None}) selected by the index tensor rows """
+    if cond is None:
+        return None
+    return {k: None if v is None else [c[rows] for c in v] for k, v in cond.items()}
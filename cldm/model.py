@@ -3,6 +3,7 @@ import torch
 
 from omegaconf import OmegaConf
 from ldm.util import instantiate_from_config
+from ldm.modules.attention import set_attention_backend
 
 
 def get_state_dict(d):
@@ -21,8 +22,14 @@ def load_state_dict(ckpt_path, location='cpu'):
     return state_dict
 
 
-def create_model(config_path):
+def create_model(config_path, attn_backend=None):
     config = OmegaConf.load(config_path)
-    model = instantiate_from_config(config.model).cpu()
+    # attn_backend overrides the ATTN_BACKEND environment variable for this model only
+    previous_backend = set_attention_backend(attn_backend) if attn_backend else None
+    try:
+        model = instantiate_from_config(config.model).cpu()
+    finally:
+        if previous_backend is not None:
+            set_attention_backend(previous_backend)
     print(f'Loaded model config from [{config_path}]')
     return model
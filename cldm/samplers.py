@@ -0,0 +1,108 @@
+"""SAMPLING ONLY."""
+
+import torch
+import numpy as np
+
+from cldm.ddim_hacked import DDIMSampler, concat_cond
+from ldm.models.diffusion.dpm_solver.dpm_solver import NoiseScheduleVP, DPM_Solver
+
+
+class DPMSolverImg2ImgSampler(DDIMSampler):
+    """
+    Partial-denoise img2img with multistep DPM-Solver++, as a drop-in replacement of DDIMSampler in
+    the repair loop.
+
+    The DDIM schedule of make_schedule only discretizes the denoise strength: stochastic_encode
+    noises the latents to the DDIM timestep t_enc exactly as DDIMSampler does, and decode then
+    integrates from that noise level down to t = 0 in at most `steps` DPM-Solver++ steps instead
+    of t_enc DDIM steps. The whole batch takes ceil(steps * t_max / ddim_num_steps) solver steps,
+    t_max the largest t_enc of the batch: every sample splits its own range [t_enc, 0] into that
+    many steps, so views with different strengths share every UNet call, the weaker ones taking
+    more (smaller) steps than they would alone.
+    """
+
+    SCHEDULE_BUFFERS = DDIMSampler.SCHEDULE_BUFFERS + ('noise_schedule',)
+
+    def __init__(self, model, steps=15, order=2, **kwargs):
+        super().__init__(model, **kwargs)
+        self.steps = steps
+        self.order = order
+
+    def build_schedule(self, ddim_num_steps, ddim_discretize="uniform", ddim_eta=0., verbose=True):
+        super().build_schedule(ddim_num_steps, ddim_discretize=ddim_discretize, ddim_eta=ddim_eta, verbose=verbose)
+        self.noise_schedule = NoiseScheduleVP('discrete', alphas_cumprod=self.alphas_cumprod)
+
+    def _model_fn(self, cond, unconditional_guidance_scale, unconditional_conditioning):
+        ns = self.noise_schedule
+        c_in = None
+        if unconditional_conditioning is not None and unconditional_guidance_scale != 1.:
+            c_in = concat_cond(cond, unconditional_conditioning) if self.batch_cfg else None
+
+        def apply_model(x, t):
+            if unconditional_conditioning is None or unconditional_guidance_scale == 1.:
+                return self.model.apply_model(x, t, cond)
+            if c_in is not None:
+                model_t, model_uncond = self.model.apply_model(torch.cat([x, x]), torch.cat([t, t]), c_in).chunk(2)
+            else:
+                model_t = self.model.apply_model(x, t, cond)
+                model_uncond = self.model.apply_model(x, t, unconditional_conditioning)
+            return model_uncond + unconditional_guidance_scale * (model_t - model_uncond)
+
+        def model_fn(x, t_continuous):
+            # continuous time in [1 / N, 1] to the discrete label of the UNet, as in dpm_solver.model_wrapper
+            output = apply_model(x, (t_continuous - 1. / ns.total_N) * 1000.)
+            if self.model.parameterization == "v":
+                alpha_t, sigma_t = ns.marginal_alpha(t_continuous), ns.marginal_std(t_continuous)
+                return alpha_t[:, None, None, None] * output + sigma_t[:, None, None, None] * x
+            return output
+
+        return model_fn
+
+    @torch.no_grad()
+    def decode(self, x_latent, cond, t_start, unconditional_guidance_scale=1.0, unconditional_conditioning=None,
+               use_original_steps=False, callback=None):
+        assert not use_original_steps, 'DPM-Solver decodes from the DDIM schedule'
+        ns = self.noise_schedule
+        device = x_latent.device
+        t_starts = np.broadcast_to(np.asarray(t_start), (x_latent.shape[0],))
+        num_steps = max(int(np.ceil(self.steps * t_starts.max() / len(self.ddim_timesteps))), 1)
+
+        # the noise level of stochastic_encode is alphas_cumprod[ddim_timesteps[t_enc]], i.e. t = (label + 1) / N
+        t_T = torch.from_numpy((self.ddim_timesteps[t_starts] + 1.) / ns.total_N).to(device, torch.float32)
+        t_0 = torch.full_like(t_T, 1. / ns.total_N)
+        # time_uniform grid per sample: [num_steps + 1, b]
+        timesteps = t_T[None] + (t_0 - t_T)[None] * torch.linspace(0., 1., num_steps + 1, device=device)[:, None]
+
+        solver = DPM_Solver(self._model_fn(cond, unconditional_guidance_scale, unconditional_conditioning), ns,
+                            predict_x0=True, thresholding=False)
+        x = x_latent
+        model_prev_list = [solver.model_fn(x, timesteps[0])]
+        t_prev_list = [timesteps[0]]
+        for step in range(1, num_steps + 1):
+            vec_t = timesteps[step]
+            # lower order for the first steps (not enough history) and the final ones (stability with few steps)
+            step_order = min(self.order, step, num_steps + 1 - step) if num_steps < 15 else min(self.order, step)
+            x = solver.multistep_dpm_solver_update(x, model_prev_list[-step_order:], t_prev_list[-step_order:], vec_t,
+                                                   step_order, solver_type='dpm_solver')
+            t_prev_list = (t_prev_list + [vec_t])[-self.order:]
+            # the model value at the final time is not needed
+            if step < num_steps:
+                model_prev_list = (model_prev_list + [solver.model_fn(x, vec_t)])[-self.order:]
+            if callback: callback(step - 1)
+        return x
+
+
+SAMPLERS = {
+    "ddim": DDIMSampler,
+    "dpm_solver++": DPMSolverImg2ImgSampler,
+}
+
+
+def make_sampler(name, model, **kwargs):
+    """ The img2img sampler `name` of SAMPLERS for model; kwargs are passed to its constructor """
+    if name not in SAMPLERS:
+        raise ValueError(f"unknown sampler {name}, expected one of {', '.join(SAMPLERS)}")
+    if name == "ddim" and "steps" in kwargs:
+        # DDIMSampler swallows unknown arguments, steps would silently do nothing
+        raise ValueError("the ddim sampler runs one step per DDIM step of the denoise strength, it does not take steps")
+    return SAMPLERS[name](model, **kwargs)
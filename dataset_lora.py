@@ -159,6 +159,7 @@ class GSCacheDataset(Dataset):
         ply_path = os.path.join(self.gaussian_dir, 'point_cloud', f'iteration_{self.iter}', 'point_cloud.ply')
         self.gaussian = GaussianModel(sh_degree=sh_degree)
         self.gaussian.load_ply(ply_path, False)
+        self.gaussian.enable_activation_cache()
         self.parser = ArgumentParser(description="Training script parameters")
         self.pipe = PipelineParams(self.parser)
 
@@ -16,25 +16,47 @@ from diff_gaussian_rasterization_w_pose import GaussianRasterizationSettings as
 from scene.gaussian_model import GaussianModel
 from utils.sh_utils import eval_sh
 
-def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+def _gaussian_activations(pc : GaussianModel, pipe, scaling_modifier = 1.0, override_color = None):
     """
-    Render the scene.
-
-    Background tensor (bg_color) must be on GPU!
+    View-independent inputs of the rasterizer: activated opacity, scaling / rotation (or the 3D
+    covariance) and SH features. Computed once per call of render / render_batch.
     """
+    activations = {
+        "means3D": pc.get_xyz,
+        "opacity": pc.get_opacity,
+        "scales": None,
+        "rotations": None,
+        "cov3D_precomp": None,
+        "shs": None,
+        "shs_view": None,
+        "colors_precomp": None,
+    }
 
-    # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
-    try:
-        screenspace_points.retain_grad()
-    except:
-        pass
+    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
+    # scaling / rotation by the rasterizer.
+    if pipe.compute_cov3D_python:
+        activations["cov3D_precomp"] = pc.get_covariance(scaling_modifier)
+    else:
+        activations["scales"] = pc.get_scaling
+        activations["rotations"] = pc.get_rotation
 
+    # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
+    # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
+    if override_color is None:
+        if pipe.convert_SHs_python:
+            activations["shs_view"] = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
+        else:
+            activations["shs"] = pc.get_features
+    else:
+        activations["colors_precomp"] = override_color
+    return activations
+
+def _rasterize(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier, screenspace_points, activations, with_pose=False, pose_delta=None):
     # Set up rasterization configuration
     tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
     tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
 
-    raster_settings = GaussianRasterizationSettings(
+    raster_settings = dict(
         image_height=int(viewpoint_camera.image_height),
         image_width=int(viewpoint_camera.image_width),
         tanfovx=tanfovx,
@@ -48,149 +70,105 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         prefiltered=False,
         debug=pipe.debug
     )
-
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
-
-    means3D = pc.get_xyz
-    means2D = screenspace_points
-    opacity = pc.get_opacity
-
-    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-    # scaling / rotation by the rasterizer.
-    scales = None
-    rotations = None
-    cov3D_precomp = None
-    if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
+    pose_args = {}
+    if with_pose:
+        raster_settings = GaussianRasterizationSettings_w_pose(projmatrix_raw=viewpoint_camera.projection_matrix, **raster_settings)
+        rasterizer = GaussianRasterizer_w_pose(raster_settings=raster_settings)
+        theta, rho = pose_delta if pose_delta is not None else (viewpoint_camera.cam_rot_delta, viewpoint_camera.cam_trans_delta)
+        pose_args = {"theta": theta, "rho": rho}
     else:
-        scales = pc.get_scaling
-        rotations = pc.get_rotation
+        rasterizer = GaussianRasterizer(raster_settings=GaussianRasterizationSettings(**raster_settings))
 
-    # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
-    # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
-    shs = None
-    colors_precomp = None
-    if override_color is None:
-        if pipe.convert_SHs_python:
-            shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
-            dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
-            sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
-            colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
-        else:
-            shs = pc.get_features
-    else:
-        colors_precomp = override_color
+    means3D = activations["means3D"]
+    colors_precomp = activations["colors_precomp"]
+    if activations["shs_view"] is not None:
+        dir_pp = (means3D - viewpoint_camera.camera_center.repeat(means3D.shape[0], 1))
+        dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
+        sh2rgb = eval_sh(pc.active_sh_degree, activations["shs_view"], dir_pp_normalized)
+        colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen).
-    rendered_image, radii, rendered_depth, rendered_alpha = rasterizer(
+    outputs = rasterizer(
         means3D = means3D,
-        means2D = means2D,
-        shs = shs,
+        means2D = screenspace_points,
+        shs = activations["shs"],
         colors_precomp = colors_precomp,
-        opacities = opacity,
-        scales = scales,
-        rotations = rotations,
-        cov3D_precomp = cov3D_precomp)
+        opacities = activations["opacity"],
+        scales = activations["scales"],
+        rotations = activations["rotations"],
+        cov3D_precomp = activations["cov3D_precomp"],
+        **pose_args)
+    rendered_image, radii, rendered_depth, rendered_alpha = outputs[:4]
 
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
     # They will be excluded from value updates used in the splitting criteria.
-    return {"render": rendered_image,
+    render_pkg = {"render": rendered_image,
             "viewspace_points": screenspace_points,
             "visibility_filter" : radii > 0,
             "radii": radii,
             "rendered_depth": rendered_depth, # depth
             "rendered_alpha": rendered_alpha, # acc
     }
+    if with_pose:
+        render_pkg["n_touched"] = outputs[4]
+    return render_pkg
 
-def render_w_pose(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
-    """
-    Render the scene.
-
-    Background tensor (bg_color) must be on GPU!
-    """
-
+def _screenspace_points(pc : GaussianModel):
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
     screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
     try:
         screenspace_points.retain_grad()
     except:
         pass
+    return screenspace_points
 
-    # Set up rasterization configuration
-    tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
-    tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
-
-    raster_settings = GaussianRasterizationSettings_w_pose(
-        image_height=int(viewpoint_camera.image_height),
-        image_width=int(viewpoint_camera.image_width),
-        tanfovx=tanfovx,
-        tanfovy=tanfovy,
-        bg=bg_color,
-        scale_modifier=scaling_modifier,
-        viewmatrix=viewpoint_camera.world_view_transform,
-        projmatrix=viewpoint_camera.full_proj_transform,
-        projmatrix_raw=viewpoint_camera.projection_matrix,
-        sh_degree=pc.active_sh_degree,
-        campos=viewpoint_camera.camera_center,
-        prefiltered=False,
-        debug=pipe.debug
-    )
+def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+    """
+    Render the scene.
 
-    rasterizer = GaussianRasterizer_w_pose(raster_settings=raster_settings)
+    Background tensor (bg_color) must be on GPU!
+    """
+    activations = _gaussian_activations(pc, pipe, scaling_modifier, override_color)
+    return _rasterize(viewpoint_camera, pc, pipe, bg_color, scaling_modifier, _screenspace_points(pc), activations)
 
-    means3D = pc.get_xyz
-    means2D = screenspace_points
-    opacity = pc.get_opacity
+def render_batch(viewpoint_cameras, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None, with_pose = False, cam_rot_deltas = None, cam_trans_deltas = None):
+    """
+    Render the scene from several cameras.
 
-    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-    # scaling / rotation by the rasterizer.
-    scales = None
-    rotations = None
-    cov3D_precomp = None
-    if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
-    else:
-        scales = pc.get_scaling
-        rotations = pc.get_rotation
+    The per-Gaussian activations are computed once and shared by all views. Returns the outputs of
+    render() stacked over the views ("render" [V, 3, H, W], "rendered_depth" / "rendered_alpha"
+    [V, 1, H, W], "radii" / "visibility_filter" [V, N]); if the cameras have different image sizes,
+    the image entries are lists instead. Each view matches what render() (render_w_pose() if
+    with_pose) returns for it. With with_pose, the [V, 3] cam_rot_deltas / cam_trans_deltas replace
+    the pose deltas of the cameras when given.
 
-    # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
-    # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
-    shs = None
-    colors_precomp = None
-    if override_color is None:
-        if pipe.convert_SHs_python:
-            shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
-            dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
-            sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
-            colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
+    Background tensor (bg_color) must be on GPU!
+    """
+    activations = _gaussian_activations(pc, pipe, scaling_modifier, override_color)
+    if not torch.is_grad_enabled():
+        # without autograd nothing is written to the screen-space points, so one buffer serves all views
+        screenspace_points = torch.zeros_like(pc.get_xyz)
+    outputs = []
+    for idx, viewpoint_camera in enumerate(viewpoint_cameras):
+        if torch.is_grad_enabled():
+            screenspace_points = _screenspace_points(pc)
+        pose_delta = (cam_rot_deltas[idx], cam_trans_deltas[idx]) if cam_rot_deltas is not None else None
+        outputs.append(_rasterize(viewpoint_camera, pc, pipe, bg_color, scaling_modifier, screenspace_points, activations, with_pose, pose_delta))
+
+    batch = {}
+    for key in outputs[0].keys() if outputs else []:
+        values = [output[key] for output in outputs]
+        if key == "viewspace_points" or len(set(getattr(value, "shape", None) for value in values)) > 1:
+            batch[key] = values
         else:
-            shs = pc.get_features
-    else:
-        colors_precomp = override_color
+            batch[key] = torch.stack(values)
+    return batch
 
-    # Rasterize visible Gaussians to image, obtain their radii (on screen).
-    rendered_image, radii, rendered_depth, rendered_alpha, n_touched = rasterizer(
-        means3D = means3D,
-        means2D = means2D,
-        shs = shs,
-        colors_precomp = colors_precomp,
-        opacities = opacity,
-        scales = scales,
-        rotations = rotations,
-        cov3D_precomp = cov3D_precomp,
-        theta = viewpoint_camera.cam_rot_delta,
-        rho = viewpoint_camera.cam_trans_delta
-    )
+def render_w_pose(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+    """
+    Render the scene, with gradients w.r.t. the camera pose deltas (cam_rot_delta, cam_trans_delta).
 
-    # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
-    # They will be excluded from value updates used in the splitting criteria.
-    return {"render": rendered_image,
-            "viewspace_points": screenspace_points,
-            "visibility_filter" : radii > 0,
-            "radii": radii,
-            "rendered_depth": rendered_depth, # depth
-            "rendered_alpha": rendered_alpha, # acc
-            "n_touched": n_touched,
-    }
+    Background tensor (bg_color) must be on GPU!
+    """
+    activations = _gaussian_activations(pc, pipe, scaling_modifier, override_color)
+    return _rasterize(viewpoint_camera, pc, pipe, bg_color, scaling_modifier, _screenspace_points(pc), activations, with_pose=True)
@@ -10,6 +10,26 @@ from ldm.util import instantiate_from_config
 from ldm.modules.ema import LitEma
 
 
+def tile_starts(size, tile, stride):
+    """ Start offsets of tiles of length tile covering [0, size), stride apart, the last one flush with the end """
+    if size <= tile:
+        return [0]
+    return list(range(0, size - tile, stride)) + [size - tile]
+
+
+def blend_ramp(length, overlap, first, last, device):
+    """ 1D weights of a tile: linear ramps over the overlaps with its neighbours, 1 elsewhere """
+    w = torch.ones(length, device=device)
+    overlap = min(overlap, length)
+    if overlap > 0:
+        ramp = (torch.arange(overlap, device=device) + 0.5) / overlap
+        if not first:
+            w[:overlap] = ramp
+        if not last:
+            w[-overlap:] = torch.minimum(w[-overlap:], ramp.flip(0))
+    return w
+
+
 class AutoencoderKL(pl.LightningModule):
     def __init__(self,
                  ddconfig,
@@ -30,6 +50,9 @@ class AutoencoderKL(pl.LightningModule):
         self.decoder = Decoder(**ddconfig)
         self.loss = instantiate_from_config(lossconfig)
         assert ddconfig["double_z"]
+        self.downsample_factor = 2 ** (len(ddconfig["ch_mult"]) - 1)
+        self.tile_size = 0 # tiling disabled
+        self.tile_overlap = 0
         self.quant_conv = torch.nn.Conv2d(2*ddconfig["z_channels"], 2*embed_dim, 1)
         self.post_quant_conv = torch.nn.Conv2d(embed_dim, ddconfig["z_channels"], 1)
         self.embed_dim = embed_dim
@@ -79,16 +102,54 @@ class AutoencoderKL(pl.LightningModule):
         if self.use_ema:
             self.model_ema(self)
 
+    def enable_tiling(self, tile_size=512, tile_overlap=64):
+        """
+        Encode and decode images larger than tile_size pixels tile by tile, tiles overlapping by
+        tile_overlap pixels and blended linearly, so that peak memory is bounded by the tile size.
+        tile_size=0 disables tiling.
+        """
+        assert tile_size == 0 or 0 <= tile_overlap < tile_size
+        assert tile_size % self.downsample_factor == 0 and tile_overlap % self.downsample_factor == 0, \
+            f"tile size and overlap must be multiples of {self.downsample_factor}"
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+
+    def _tiled(self, fn, x, tile, overlap, scale):
+        H, W = x.shape[-2:]
+        stride = tile - overlap
+        out = weight = None
+        for top in tile_starts(H, tile, stride):
+            for left in tile_starts(W, tile, stride):
+                y = fn(x[..., top:top + tile, left:left + tile])
+                if out is None:
+                    out = y.new_zeros(y.shape[:2] + (int(H * scale), int(W * scale)))
+                    weight = y.new_zeros((1, 1) + out.shape[-2:])
+                w = (blend_ramp(y.shape[-2], int(overlap * scale), top == 0, top + tile >= H, y.device)[:, None] *
+                     blend_ramp(y.shape[-1], int(overlap * scale), left == 0, left + tile >= W, y.device)[None, :])
+                top_out, left_out = int(top * scale), int(left * scale)
+                out[..., top_out:top_out + y.shape[-2], left_out:left_out + y.shape[-1]] += y * w
+                weight[..., top_out:top_out + y.shape[-2], left_out:left_out + y.shape[-1]] += w
+        return out / weight
+
+    def _encode_moments(self, x):
+        return self.quant_conv(self.encoder(x))
+
+    def _decode_latents(self, z):
+        return self.decoder(self.post_quant_conv(z))
+
     def encode(self, x):
-        h = self.encoder(x)
-        moments = self.quant_conv(h)
+        if self.tile_size > 0 and max(x.shape[-2:]) > self.tile_size:
+            moments = self._tiled(self._encode_moments, x, self.tile_size, self.tile_overlap, 1. / self.downsample_factor)
+        else:
+            moments = self._encode_moments(x)
         posterior = DiagonalGaussianDistribution(moments)
         return posterior
 
     def decode(self, z):
-        z = self.post_quant_conv(z)
-        dec = self.decoder(z)
-        return dec
+        tile = self.tile_size // self.downsample_factor
+        if self.tile_size > 0 and max(z.shape[-2:]) > tile:
+            return self._tiled(self._decode_latents, z, tile, self.tile_overlap // self.downsample_factor, self.downsample_factor)
+        return self._decode_latents(z)
 
     def forward(self, input, sample_posterior=True):
         posterior = self.encode(input)
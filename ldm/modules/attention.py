@@ -142,14 +142,103 @@ class SpatialSelfAttention(nn.Module):
         return x+h_
 
 
+def naive_attention(q, k, v, scale, mask=None):
+    # force cast to fp32 to avoid overflowing
+    if _ATTN_PRECISION =="fp32":
+        with torch.autocast(enabled=False, device_type = 'cuda'):
+            q, k = q.float(), k.float()
+            sim = einsum('b i d, b j d -> b i j', q, k) * scale
+    else:
+        sim = einsum('b i d, b j d -> b i j', q, k) * scale
+
+    del q, k
+
+    if exists(mask):
+        max_neg_value = -torch.finfo(sim.dtype).max
+        sim.masked_fill_(~mask, max_neg_value)
+
+    # attention, what we cannot get enough of
+    sim = sim.softmax(dim=-1)
+
+    return einsum('b i j, b j d -> b i d', sim.to(v.dtype), v)
+
+
+def sliced_attention(q, k, v, scale, mask=None):
+    # one (batch, head) slice at a time, so that a single similarity matrix is alive
+    # https://github.com/basujindal/stable-diffusion/blob/main/optimizedSD/splitAttention.py
+    out = v.new_empty(q.shape[:2] + v.shape[2:])
+    for i in range(0, q.shape[0], _ATTN_SLICE_SIZE):
+        rows = slice(i, i + _ATTN_SLICE_SIZE)
+        out[rows] = naive_attention(q[rows], k[rows], v[rows], scale, mask[rows] if exists(mask) else None)
+    return out
+
+
+def sdpa_attention(q, k, v, scale, mask=None):
+    return F.scaled_dot_product_attention(q, k, v, attn_mask=mask, scale=scale)
+
+
+def xformers_attention(q, k, v, scale, mask=None, op=None):
+    if exists(mask):
+        raise NotImplementedError
+    return xformers.ops.memory_efficient_attention(q.contiguous(), k.contiguous(), v.contiguous(),
+                                                   attn_bias=None, scale=scale, op=op)
+
+
+# kernels of CrossAttention over (b h) n d queries, keys and values; mask is a (b h) 1 j boolean
+ATTENTION_BACKENDS = {
+    "naive": naive_attention,
+    "sliced": sliced_attention,
+    "sdpa": sdpa_attention,
+    "xformers": xformers_attention,
+}
+
+# backend of the CrossAttention layers constructed from now on: "auto", or a key of ATTENTION_BACKENDS
+_ATTN_BACKEND = os.environ.get("ATTN_BACKEND", "auto")
+_ATTN_SLICE_SIZE = int(os.environ.get("ATTN_SLICE_SIZE", 1))
+
+
+def available_attention_backends():
+    backends = ["naive", "sliced"]
+    if hasattr(F, "scaled_dot_product_attention"):
+        backends.append("sdpa")
+    if XFORMERS_IS_AVAILBLE:
+        backends.append("xformers")
+    return backends
+
+
+def resolve_attention_backend(name=None):
+    """
+    The backend `name` (the current default if None); "auto" picks xformers, as the layers did before
+    the backends existed, then sdpa, then naive.
+    """
+    name = default(name, _ATTN_BACKEND)
+    available = available_attention_backends()
+    if name == "auto":
+        return next(backend for backend in ("xformers", "sdpa", "naive") if backend in available)
+    if name not in ATTENTION_BACKENDS:
+        raise ValueError(f"unknown attention backend {name}, expected one of {list(ATTENTION_BACKENDS)}")
+    if name not in available:
+        raise RuntimeError(f"attention backend {name} is not available, available: {available}")
+    return name
+
+
+def set_attention_backend(name):
+    """ Set the backend of the CrossAttention layers constructed from now on; returns the previous one """
+    global _ATTN_BACKEND
+    resolve_attention_backend(name)
+    previous, _ATTN_BACKEND = _ATTN_BACKEND, name
+    return previous
+
+
 class CrossAttention(nn.Module):
-    def __init__(self, query_dim, context_dim=None, heads=8, dim_head=64, dropout=0.):
+    def __init__(self, query_dim, context_dim=None, heads=8, dim_head=64, dropout=0., backend=None):
         super().__init__()
         inner_dim = dim_head * heads
         context_dim = default(context_dim, query_dim)
 
         self.scale = dim_head ** -0.5
         self.heads = heads
+        self.backend = resolve_attention_backend(backend)
 
         self.to_q = nn.Linear(query_dim, inner_dim, bias=False)
         self.to_k = nn.Linear(context_dim, inner_dim, bias=False)
@@ -160,6 +249,9 @@ class CrossAttention(nn.Module):
             nn.Dropout(dropout)
         )
 
+    def attention(self, q, k, v, mask=None):
+        return ATTENTION_BACKENDS[self.backend](q, k, v, self.scale, mask)
+
     def forward(self, x, context=None, mask=None):
         h = self.heads
 
@@ -170,96 +262,37 @@ class CrossAttention(nn.Module):
 
         q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> (b h) n d', h=h), (q, k, v))
 
-        # force cast to fp32 to avoid overflowing
-        if _ATTN_PRECISION =="fp32":
-            with torch.autocast(enabled=False, device_type = 'cuda'):
-                q, k = q.float(), k.float()
-                sim = einsum('b i d, b j d -> b i j', q, k) * self.scale
-        else:
-            sim = einsum('b i d, b j d -> b i j', q, k) * self.scale
-        
-        del q, k
-    
         if exists(mask):
             mask = rearrange(mask, 'b ... -> b (...)')
-            max_neg_value = -torch.finfo(sim.dtype).max
             mask = repeat(mask, 'b j -> (b h) () j', h=h)
-            sim.masked_fill_(~mask, max_neg_value)
-
-        # attention, what we cannot get enough of
-        sim = sim.softmax(dim=-1)
 
-        out = einsum('b i j, b j d -> b i d', sim, v)
+        out = self.attention(q, k, v, mask)
         out = rearrange(out, '(b h) n d -> b n (h d)', h=h)
         return self.to_out(out)
 
 
-class MemoryEfficientCrossAttention(nn.Module):
+class MemoryEfficientCrossAttention(CrossAttention):
     # https://github.com/MatthieuTPHR/diffusers/blob/d80b531ff8060ec1ea982b65a1b8df70f73aa67c/src/diffusers/models/attention.py#L223
     def __init__(self, query_dim, context_dim=None, heads=8, dim_head=64, dropout=0.0):
-        super().__init__()
-        print(f"Setting up {self.__class__.__name__}. Query dim is {query_dim}, context_dim is {context_dim} and using "
-              f"{heads} heads.")
-        inner_dim = dim_head * heads
-        context_dim = default(context_dim, query_dim)
-
-        self.heads = heads
-        self.dim_head = dim_head
-
-        self.to_q = nn.Linear(query_dim, inner_dim, bias=False)
-        self.to_k = nn.Linear(context_dim, inner_dim, bias=False)
-        self.to_v = nn.Linear(context_dim, inner_dim, bias=False)
-
-        self.to_out = nn.Sequential(nn.Linear(inner_dim, query_dim), nn.Dropout(dropout))
+        super().__init__(query_dim, context_dim=context_dim, heads=heads, dim_head=dim_head, dropout=dropout,
+                         backend="xformers")
         self.attention_op: Optional[Any] = None
 
-    def forward(self, x, context=None, mask=None):
-        q = self.to_q(x)
-        context = default(context, x)
-        k = self.to_k(context)
-        v = self.to_v(context)
-
-        b, _, _ = q.shape
-        q, k, v = map(
-            lambda t: t.unsqueeze(3)
-            .reshape(b, t.shape[1], self.heads, self.dim_head)
-            .permute(0, 2, 1, 3)
-            .reshape(b * self.heads, t.shape[1], self.dim_head)
-            .contiguous(),
-            (q, k, v),
-        )
-
-        # actually compute the attention, what we cannot get enough of
-        out = xformers.ops.memory_efficient_attention(q, k, v, attn_bias=None, op=self.attention_op)
-
-        if exists(mask):
-            raise NotImplementedError
-        out = (
-            out.unsqueeze(0)
-            .reshape(b, self.heads, out.shape[1], self.dim_head)
-            .permute(0, 2, 1, 3)
-            .reshape(b, out.shape[1], self.heads * self.dim_head)
-        )
-        return self.to_out(out)
+    def attention(self, q, k, v, mask=None):
+        return xformers_attention(q, k, v, self.scale, mask, op=self.attention_op)
 
 
 class BasicTransformerBlock(nn.Module):
-    ATTENTION_MODES = {
-        "softmax": CrossAttention,  # vanilla attention
-        "softmax-xformers": MemoryEfficientCrossAttention
-    }
     def __init__(self, dim, n_heads, d_head, dropout=0., context_dim=None, gated_ff=True, checkpoint=True,
-                 disable_self_attn=False):
+                 disable_self_attn=False, attn_backend=None):
         super().__init__()
-        attn_mode = "softmax-xformers" if XFORMERS_IS_AVAILBLE else "softmax"
-        assert attn_mode in self.ATTENTION_MODES
-        attn_cls = self.ATTENTION_MODES[attn_mode]
+        attn_backend = resolve_attention_backend(attn_backend)
         self.disable_self_attn = disable_self_attn
-        self.attn1 = attn_cls(query_dim=dim, heads=n_heads, dim_head=d_head, dropout=dropout,
-                              context_dim=context_dim if self.disable_self_attn else None)  # is a self-attention if not self.disable_self_attn
+        self.attn1 = CrossAttention(query_dim=dim, heads=n_heads, dim_head=d_head, dropout=dropout, backend=attn_backend,
+                                    context_dim=context_dim if self.disable_self_attn else None)  # is a self-attention if not self.disable_self_attn
         self.ff = FeedForward(dim, dropout=dropout, glu=gated_ff)
-        self.attn2 = attn_cls(query_dim=dim, context_dim=context_dim,
-                              heads=n_heads, dim_head=d_head, dropout=dropout)  # is self-attn if context is none
+        self.attn2 = CrossAttention(query_dim=dim, context_dim=context_dim, backend=attn_backend,
+                                    heads=n_heads, dim_head=d_head, dropout=dropout)  # is self-attn if context is none
         self.norm1 = nn.LayerNorm(dim)
         self.norm2 = nn.LayerNorm(dim)
         self.norm3 = nn.LayerNorm(dim)
@@ -287,7 +320,7 @@ class SpatialTransformer(nn.Module):
     def __init__(self, in_channels, n_heads, d_head,
                  depth=1, dropout=0., context_dim=None,
                  disable_self_attn=False, use_linear=False,
-                 use_checkpoint=True):
+                 use_checkpoint=True, attn_backend=None):
         super().__init__()
         if exists(context_dim) and not isinstance(context_dim, list):
             context_dim = [context_dim]
@@ -305,7 +338,7 @@ class SpatialTransformer(nn.Module):
 
         self.transformer_blocks = nn.ModuleList(
             [BasicTransformerBlock(inner_dim, n_heads, d_head, dropout=dropout, context_dim=context_dim[d],
-                                   disable_self_attn=disable_self_attn, checkpoint=use_checkpoint)
+                                   disable_self_attn=disable_self_attn, checkpoint=use_checkpoint, attn_backend=attn_backend)
                 for d in range(depth)]
         )
         if not use_linear:
@@ -1,5 +1,6 @@
 import sys
 import os
+import copy
 import uuid
 from argparse import ArgumentParser, Namespace
 from arguments import ModelParams, PipelineParams, OptimizationParams
@@ -14,10 +15,11 @@ from tqdm import tqdm
 from torchmetrics.functional.regression import pearson_corrcoef
 
 from utils.general_utils import safe_state
-from utils.loss_utils import l1_loss, ssim, monodisp
+from utils.loss_utils import l1_loss, l1_dssim_loss, monodisp
 from utils.image_utils import psnr
-from gaussian_renderer import render
-from scene import Scene, GaussianModel
+from gaussian_renderer import render, render_batch
+from scene import Scene, GaussianModel, load_scene_data
+from utils.job_utils import run_jobs, shared_data
 
 try:
     from torch.utils.tensorboard.writer import SummaryWriter
@@ -25,11 +27,11 @@ try:
 except ImportError:
     TENSORBOARD_FOUND = False
 
-def leave_one_out_training(args, dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from, train_id):
+def leave_one_out_training(args, dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from, train_id, scene_data=None):
     first_iter = 0
     tb_writer = prepare_output_and_logger(dataset)
     gaussians = GaussianModel(dataset.sh_degree)
-    scene = Scene(dataset, gaussians, shuffle=False, extra_opts=args) # make sure no shuffle
+    scene = Scene(dataset, gaussians, shuffle=False, extra_opts=args, scene_data=scene_data) # make sure no shuffle
     gaussians.training_setup(opt)
     if checkpoint:
         (model_params, first_iter) = torch.load(checkpoint)
@@ -94,7 +96,7 @@ def leave_one_out_training(args, dataset, opt, pipe, testing_iterations, saving_
                 progress_bar.close()
 
             # Log
-            training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, render, (pipe, background))
+            training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, render_batch, (pipe, background))
 
             # Save
             if (iteration in saving_iterations):
@@ -166,6 +168,9 @@ def prepare_output_and_logger(args):
         print("Tensorboard not available: not logging progress")
     return tb_writer
 
+# number of views rendered per render_batch call in training_report
+REPORT_BATCH_SIZE = 8
+
 def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_iterations, scene : Scene, renderFunc, renderArgs):
     if tb_writer:
         tb_writer.add_scalar('train_loss_patches/l1_loss', Ll1.item(), iteration)
@@ -182,15 +187,18 @@ def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_i
             if config['cameras'] and len(config['cameras']) > 0:
                 l1_test = 0.0
                 psnr_test = 0.0
-                for idx, viewpoint in enumerate(config['cameras']):
-                    image = torch.clamp(renderFunc(viewpoint, scene.gaussians, *renderArgs)["render"], 0.0, 1.0)
-                    gt_image = torch.clamp(viewpoint.original_image.to("cuda"), 0.0, 1.0)
-                    if tb_writer and (idx < 5):
-                        tb_writer.add_images(config['name'] + "_view_{}/render".format(viewpoint.image_name), image[None], global_step=iteration)
-                        if iteration == testing_iterations[0]:
-                            tb_writer.add_images(config['name'] + "_view_{}/ground_truth".format(viewpoint.image_name), gt_image[None], global_step=iteration)
-                    l1_test += l1_loss(image, gt_image).mean().double()
-                    psnr_test += psnr(image, gt_image).mean().double()
+                for start in range(0, len(config['cameras']), REPORT_BATCH_SIZE):
+                    viewpoints = config['cameras'][start:start + REPORT_BATCH_SIZE]
+                    images = renderFunc(viewpoints, scene.gaussians, *renderArgs)["render"]
+                    for idx, (viewpoint, image) in enumerate(zip(viewpoints, images), start):
+                        image = torch.clamp(image, 0.0, 1.0)
+                        gt_image = torch.clamp(viewpoint.original_image.to("cuda"), 0.0, 1.0)
+                        if tb_writer and (idx < 5):
+                            tb_writer.add_images(config['name'] + "_view_{}/render".format(viewpoint.image_name), image[None], global_step=iteration)
+                            if iteration == testing_iterations[0]:
+                                tb_writer.add_images(config['name'] + "_view_{}/ground_truth".format(viewpoint.image_name), gt_image[None], global_step=iteration)
+                        l1_test += l1_loss(image, gt_image).mean().double()
+                        psnr_test += psnr(image, gt_image).mean().double()
                 psnr_test /= len(config['cameras'])
                 l1_test /= len(config['cameras'])
                 print("\n[ITER {}] Evaluating {}: L1 {} PSNR {}".format(iteration, config['name'], l1_test, psnr_test))
@@ -213,8 +221,7 @@ def cal_loss(opt, args, image, render_pkg, viewpoint_cam, bg, silhouette_loss_ty
     gt_image = viewpoint_cam.original_image.to(image.dtype).cuda()
     if opt.random_background:
         gt_image = gt_image * viewpoint_cam.mask + bg[:, None, None] * (1 - viewpoint_cam.mask).squeeze()
-    Ll1 = l1_loss(image, gt_image)
-    loss = (1.0 - opt.lambda_dssim) * Ll1 + opt.lambda_dssim * (1.0 - ssim(image, gt_image))
+    loss, Ll1, _ = l1_dssim_loss(image, gt_image, opt.lambda_dssim)
 
     if hasattr(args, "use_mask") and args.use_mask:
         if silhouette_loss_type == "bce":
@@ -262,6 +269,23 @@ def cal_loss(opt, args, image, render_pkg, viewpoint_cam, bg, silhouette_loss_ty
 
     return loss, Ll1
 
+def leave_one_out_job(args, dataset, opt, pipe, train_id, init_state):
+    if init_state:
+        # fresh worker process
+        safe_state(args.quiet)
+        torch.autograd.set_detect_anomaly(args.detect_anomaly)
+    leave_one_out_training(args,
+                            dataset,
+                            opt,
+                            pipe,
+                            args.test_iterations,
+                            args.save_iterations,
+                            args.checkpoint_iterations,
+                            args.start_checkpoint,
+                            args.debug_from,
+                            train_id = train_id,
+                            scene_data = shared_data())
+
 def train_3dgs(args, ids):
     print("Optimizing " + args.model_path)
 
@@ -272,20 +296,18 @@ def train_3dgs(args, ids):
     pipeline = pp.extract(args)
     model_path_root = args.model_path
 
+    # the cameras and the input point cloud are the same for every job, load them once
+    scene_data = load_scene_data(dataset, extra_opts=args)
+
+    jobs = []
     for num_id, image_id in zip(range(args.sparse_view_num), ids): # num_id: leave one out id, image_id: the id of the image to be infered
-        args.model_path = os.path.join(model_path_root, f'leave_{image_id}')
-        dataset.model_path = args.model_path
-        os.makedirs(args.model_path, exist_ok=True)
-        leave_one_out_training(args,
-                                dataset,
-                                op.extract(args),
-                                pipeline,
-                                args.test_iterations,
-                                args.save_iterations,
-                                args.checkpoint_iterations,
-                                args.start_checkpoint,
-                                args.debug_from,
-                                train_id = (num_id, image_id))
+        job_args = copy.copy(args)
+        job_args.model_path = os.path.join(model_path_root, f'leave_{image_id}')
+        job_dataset = copy.copy(dataset)
+        job_dataset.model_path = job_args.model_path
+        os.makedirs(job_args.model_path, exist_ok=True)
+        jobs.append((f'leave_{image_id}', (job_args, job_dataset, op.extract(args), pipeline, (num_id, image_id), args.loo_workers > 1)))
+    run_jobs(leave_one_out_job, jobs, num_workers=args.loo_workers, shared=scene_data)
 
 
 if __name__ == "__main__":
@@ -315,6 +337,7 @@ if __name__ == "__main__":
     parser.add_argument("--init_pcd_name", default='origin', type=str, help="the init pcd name. 'random' for random, 'origin' for pcd from the whole scene")
     parser.add_argument('--mono_depth_weight', type=float, default=0.0005, help="The rate of monodepth loss")
     parser.add_argument('--mono_loss_type', type=str, default="mid")
+    parser.add_argument('--loo_workers', type=int, default=1, help="number of leave-one-out trainings run concurrently")
 
     args = parser.parse_args(sys.argv[1:])
     args.save_iterations.append(args.iterations)
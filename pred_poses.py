@@ -1,6 +1,7 @@
 import os
 import cv2
 import json
+import hashlib
 import numpy as np
 import trimesh
 import torch
@@ -10,9 +11,9 @@ from PIL import Image
 from tqdm import trange
 from torch.nn import functional as F
 from dust3r.viz import pts3d_to_trimesh, cat_meshes
-from dust3r.inference import inference, load_model
+from dust3r.inference import load_model, loss_of_one_batch, check_if_same_size
 from dust3r.utils.image import load_images
-from dust3r.utils.device import to_numpy
+from dust3r.utils.device import to_numpy, to_cpu, collate_with_cat
 from dust3r.image_pairs import make_pairs
 from dust3r.cloud_opt import global_aligner, GlobalAlignerMode
 from scene.colmap_loader import rotmat2qvec
@@ -121,10 +122,64 @@ def get_visual_hull(N, scale, Ks, Ts, original_images, original_masks):
 
     return idx.cpu().numpy(), color.cpu().numpy() / 255
 
+def hash_image(view):
+    """ md5 of the network input of a view, i.e. of the image content at the resolution it is processed at """
+    md5 = hashlib.md5(np.ascontiguousarray(view['true_shape']).tobytes())
+    md5.update(view['img'].detach().cpu().contiguous().numpy().tobytes())
+    return md5.hexdigest()
+
+def hash_checkpoint(model_path):
+    """ identifies a checkpoint file by its name, size and modification time, without reading it """
+    stat = os.stat(model_path)
+    return hashlib.md5(f'{os.path.basename(model_path)}_{stat.st_size}_{stat.st_mtime_ns}'.encode('utf-8')).hexdigest()
+
+@torch.no_grad()
+def cached_inference(pairs, model_path, device, batch_size=1, cache_path=None):
+    """
+    Same output as dust3r.inference.inference(pairs, load_model(model_path, device), ...), with the
+    predictions of each ordered pair cached under cache_path/<checkpoint>/<image 1>/<image 2>.pth,
+    keyed on the md5 of the two network inputs. Only the pairs missing from the cache are run, and
+    the model is only loaded if there are any.
+    """
+    multiple_shapes = not check_if_same_size(pairs)
+    if multiple_shapes: # force bs=1
+        batch_size = 1
+
+    paths = [None] * len(pairs)
+    if cache_path is not None:
+        cache_dir = os.path.join(cache_path, hash_checkpoint(model_path))
+        paths = [os.path.join(cache_dir, hash_image(view1), hash_image(view2) + '.pth') for view1, view2 in pairs]
+    preds = [torch.load(path) if path is not None and os.path.isfile(path) else None for path in paths]
+    missing = [i for i, pred in enumerate(preds) if pred is None]
+    print(f'>> Inference with model on {len(missing)} image pairs ({len(pairs) - len(missing)} cached)')
+
+    if len(missing) > 0:
+        model = load_model(model_path, device)
+        for start in trange(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            res = to_cpu(loss_of_one_batch(collate_with_cat([pairs[i] for i in batch]), model, None, device))
+            for n, i in enumerate(batch):
+                # clone, so that a saved slice does not drag the storage of the whole batch along
+                preds[i] = tuple({key: value[n:n + 1].clone() for key, value in res[pred].items()} for pred in ('pred1', 'pred2'))
+                if paths[i] is not None:
+                    os.makedirs(os.path.dirname(paths[i]), exist_ok=True)
+                    torch.save(preds[i], paths[i] + '.tmp')
+                    os.replace(paths[i] + '.tmp', paths[i])
+        del model
+        torch.cuda.empty_cache()
+
+    result = []
+    for pair, (pred1, pred2) in zip(pairs, preds):
+        view1, view2 = collate_with_cat([pair])
+        result.append(dict(view1=view1, view2=view2, pred1=pred1, pred2=pred2, loss=None))
+    return collate_with_cat(result, lists=multiple_shapes)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--source-path', type=str, default='data/realcap/rabbit')
     parser.add_argument('--sparse_num', type=int, default=4)
+    parser.add_argument('--cache_path', type=str, default=None, help='pairwise predictions cache, <source_path>/dust3r_cache by default')
+    parser.add_argument('--no_cache', action='store_true', help='run every pair and do not write the cache')
     args = parser.parse_args()
 
     model_path = 'models/DUSt3R_ViTLarge_BaseDecoder_512_dpt.pth'
@@ -134,8 +189,6 @@ if __name__ == "__main__":
     lr = 0.01
     niter = 300
 
-    model = load_model(model_path, device)
-
     sparse_num = args.sparse_num
     rescale = 1.
 
@@ -150,7 +203,8 @@ if __name__ == "__main__":
 
     loaded_images = load_images(images, size=512)
     pairs = make_pairs(loaded_images, scene_graph='complete', prefilter=None, symmetrize=True)
-    output = inference(pairs, model, device, batch_size=batch_size)
+    cache_path = None if args.no_cache else (args.cache_path or os.path.join(scene_path, 'dust3r_cache'))
+    output = cached_inference(pairs, model_path, device, batch_size=batch_size, cache_path=cache_path)
     scene = global_aligner(output, device=device, mode=GlobalAlignerMode.PointCloudOptimizer)
     loss = scene.compute_global_alignment(init="mst", niter=niter, schedule=schedule, lr=lr)
 
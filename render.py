@@ -11,22 +11,18 @@
 
 import json
 import os
-import subprocess
 from argparse import ArgumentParser
 from os import makedirs
 from pathlib import Path
 from typing import List
 
-import cv2
-import numpy as np
 import torch
-import torchvision
 import torchvision.transforms.functional as tf
 from PIL import Image
 from tqdm import tqdm
 
 from arguments import ModelParams, PipelineParams, get_combined_args
-from gaussian_renderer import GaussianModel, render, render_w_pose
+from gaussian_renderer import GaussianModel, render_batch
 import lpips
 from scene import Scene
 from utils.general_utils import safe_state
@@ -34,7 +30,9 @@ from utils.image_utils import psnr
 from utils.loss_utils import ssim
 from utils.graphics_utils import focal2fov, fov2focal, getProjectionMatrix
 from scene.cameras import Camera
-from utils.pose_utils import get_loss_tracking, update_pose
+from utils.pose_utils import refine_poses
+from utils.writer_utils import FrameWriter, to_uint8, depth_to_uint8
+from utils.metric_utils import MetricAccumulator
 
 
 def readImages(renders_dir, gt_dir):
@@ -49,7 +47,25 @@ def readImages(renders_dir, gt_dir):
         image_names.append(fname)
     return renders, gts, image_names
 
-def evaluate(model_paths):
+def evaluate_images(method_dir):
+    gt_dir = method_dir/ "gt"
+    renders_dir = method_dir / "renders"
+    renders, gts, image_names = readImages(renders_dir, gt_dir)
+
+    ssims = []
+    psnrs = []
+    lpipss = []
+
+    for idx in tqdm(range(len(renders)), desc="Metric evaluation progress"):
+        render = renders[idx].cuda()
+        gt = gts[idx].cuda()
+
+        ssims.append(ssim(render, gt))
+        psnrs.append(psnr(render, gt))
+        lpipss.append(lpips_fn(render, gt))
+    return ssims, psnrs, lpipss, image_names
+
+def evaluate(model_paths, recompute=False):
 
     full_dict = {}
     per_view_dict = {}
@@ -75,21 +91,14 @@ def evaluate(model_paths):
             per_view_dict_polytopeonly[scene_dir][method] = {}
 
             method_dir = test_dir / method
-            gt_dir = method_dir/ "gt"
-            renders_dir = method_dir / "renders"
-            renders, gts, image_names = readImages(renders_dir, gt_dir)
-
-            ssims = []
-            psnrs = []
-            lpipss = []
-
-            for idx in tqdm(range(len(renders)), desc="Metric evaluation progress"):
-                render = renders[idx].cuda()
-                gt = gts[idx].cuda()
-
-                ssims.append(ssim(render, gt))
-                psnrs.append(psnr(render, gt))
-                lpipss.append(lpips_fn(render, gt))
+            if (method_dir / "per_view.json").exists() and not recompute:
+                # written by render_set from the renders, no need to decode the images again
+                with open(method_dir / "per_view.json") as fp:
+                    per_view = json.load(fp)
+                image_names = list(per_view["SSIM"].keys())
+                ssims, psnrs, lpipss = ([per_view[metric][name] for name in image_names] for metric in ("SSIM", "PSNR", "LPIPS"))
+            else:
+                ssims, psnrs, lpipss, image_names = evaluate_images(method_dir)
 
             print("==FROM 3DGS==")
             print("  SSIM : {:>12.7f}".format(torch.tensor(ssims).mean(), ".5"))
@@ -121,135 +130,55 @@ def render_set(model_path, name, iteration, views: List[Camera], gaussians, pipe
     makedirs(render_path, exist_ok=True)
     makedirs(gts_path, exist_ok=True)
 
-    ssims = 0.
-    psnrs = 0.
-    lpipss = 0.
-    depths = []
-    for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
-        if extra_opts and extra_opts.use_dust3r:
-            opt_params = []
-            opt_params.append(
-                {
-                    "params": [view.cam_rot_delta],
-                    "lr": 0.0003,
-                    "name": "rot_{}".format(view.uid),
-                }
-            )
-            opt_params.append(
-                {
-                    "params": [view.cam_trans_delta],
-                    "lr": 0.0001,
-                    "name": "trans_{}".format(view.uid),
-                }
-            )
-            pose_optimizer = torch.optim.Adam(opt_params)
-            for _ in range(refine_iters):
-                render_pkg = render(view, gaussians, pipeline, background)
-                image, opacity = render_pkg["render"], render_pkg["rendered_alpha"]
-                pose_optimizer.zero_grad()
-                # image_ab = (torch.exp(view.exposure_a)) * image + view.exposure_b
-                # image_ab = image
-                loss_tracking = get_loss_tracking(
-                    image, opacity, view
-                )
-                # print(loss_tracking)
-                loss_tracking.backward()
-                with torch.no_grad():
-                    pose_optimizer.step()
-                    converged = update_pose(view)
-                if converged:
-                    break
-
-        render_pkg = render(view, gaussians, pipeline, background)
-        rendering = render_pkg["render"]
-        depths.append(render_pkg["rendered_depth"].detach().cpu().numpy()[0])
-        gt = view.original_image[0:3, :, :]
-        ssims += ssim(rendering, gt).mean().item()
-        psnrs += psnr(rendering, gt).mean().item()
-        lpipss += lpips_fn(rendering, gt).item() # NCHW
-        if save_images:
-            torchvision.utils.save_image(rendering, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
-            torchvision.utils.save_image(gt, os.path.join(gts_path, '{0:05d}'.format(idx) + ".png"))
-
-    print(f'{name} SSIM: {ssims / len(views)}')
-    print(f'{name} PSNR: {psnrs / len(views)}')
-    print(f'{name} LPIPS: {lpipss / len(views)}')
+    metrics = MetricAccumulator(lpips_fn, lpips_batch_size=extra_opts.lpips_batch_size if extra_opts else 8)
+    if extra_opts and extra_opts.use_dust3r and refine_iters > 0:
+        # refine the poses of refine_batch_size views at a time, concurrently
+        refine_fn = lambda cams, rot_deltas, trans_deltas: render_batch(cams, gaussians, pipeline, background, with_pose=True,
+                                                                        cam_rot_deltas=rot_deltas, cam_trans_deltas=trans_deltas)
+        batch_size = max(extra_opts.refine_batch_size, 1)
+        updates = []
+        for start in tqdm(range(0, len(views), batch_size), desc="Pose refinement progress"):
+            updates.append(refine_poses(views[start:start + batch_size], refine_fn, refine_iters))
+        print(f'{name} pose refinement: {torch.cat(updates).float().mean().item():.1f} updates per view')
+
+    writer = FrameWriter(num_workers=extra_opts.writer_workers, max_pending=extra_opts.writer_queue) if extra_opts else FrameWriter()
+    if not not_generate_video:
+        # the renders next to the gt, and the depths, streamed into the encoders
+        combined_video = writer.open_video(os.path.join(model_path, name, "ours_{}".format(iteration), "combined.mp4"), pix_fmt="yuv420p")
+        depth_video = writer.open_video(os.path.join(model_path, name, "ours_{}".format(iteration), "depth_compressed.mp4"), pix_fmt="yuv420p")
+
+    with torch.no_grad():
+        for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
+            render_pkg = render(view, gaussians, pipeline, background)
+            rendering = render_pkg["render"]
+            gt = view.original_image[0:3, :, :]
+            metrics.add('{0:05d}'.format(idx) + ".png", rendering, gt)
+            rendering_uint8, gt_uint8 = to_uint8(rendering), to_uint8(gt)
+            if save_images:
+                writer.save_image(rendering_uint8, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
+                writer.save_image(gt_uint8, os.path.join(gts_path, '{0:05d}'.format(idx) + ".png"))
+            if not not_generate_video:
+                combined_video.write(torch.cat([rendering_uint8, gt_uint8], dim=1))
+                depth_video.write(depth_to_uint8(render_pkg["rendered_depth"]))
 
     # since the eval is done in the render function, just dump the results to json
-    with open(os.path.join(model_path, name, "ours_{}".format(iteration), "results.json"), 'w') as fp:
-        json.dump({"SSIM": ssims / len(views), "PSNR": psnrs / len(views), "LPIPS": lpipss / len(views)}, fp, indent=True)
+    results = metrics.dump(os.path.join(model_path, name, "ours_{}".format(iteration)))
+    print(f'{name} SSIM: {results["SSIM"]}')
+    print(f'{name} PSNR: {results["PSNR"]}')
+    print(f'{name} LPIPS: {results["LPIPS"]}')
 
-    # Use ffmpeg to output video
-    if not not_generate_video:
-        renders_path = os.path.join(model_path, name, "ours_{}".format(iteration), "renders.mp4")
-        gt_path = os.path.join(model_path, name, "ours_{}".format(iteration), "gt.mp4")
-        combined_path = os.path.join(model_path, name, "ours_{}".format(iteration), "combined.mp4")
-        # Use ffmpeg to output video
-        subprocess.run(["ffmpeg", "-y",
-                    "-framerate", "24",
-                    "-i", os.path.join(render_path, "%05d.png"),
-                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
-                    "-c:v", "libx264",
-                    "-crf", "23",
-                    # "-pix_fmt", "yuv420p",  # Set pixel format for compatibility
-                    renders_path],
-                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-                    )
-        subprocess.run(["ffmpeg", "-y",
-                    "-framerate", "24",
-                    "-i", os.path.join(gts_path, "%05d.png"),
-                    "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
-                    "-c:v", "libx264",
-                    "-crf", "23",
-                    # "-pix_fmt", "yuv420p",  # Set pixel format for compatibility
-                    gt_path],
-                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-                    )
-        # Concatenate the videos vertically using the `concat` filter
-        command = [
-            "ffmpeg","-y",
-            "-i",renders_path,
-            "-i",gt_path,
-            "-filter_complex","[0:v][1:v]hstack=inputs=2[v]",
-            "-map","[v]",
-            "-c:v","libx264",
-            "-crf","23",
-            "-pix_fmt", "yuv420p",  # Set pixel format for compatibility
-            combined_path
-        ]
-        # Run the command
-        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) # , stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-
-        # Remove the original videos
-        os.remove(renders_path)
-        os.remove(gt_path)
-
-        # use opencv generate depth video
-        # import pdb
-        # pdb.set_trace()
-        depth_path = os.path.join(model_path, name, "ours_{}".format(iteration), "depth.mp4")
-        depth_video = cv2.VideoWriter(depth_path, cv2.VideoWriter_fourcc(*'mp4v'), 24, (depths[0].shape[1], depths[0].shape[0]), False)
-        for depth in depths:
-            # opencv need to convert to uint8
-            if depth.max() > 0:
-                depth[depth <= 0] = depth[depth>0].min()
-                depth_normalized = cv2.normalize(depth, depth, 0.0, 1.0, cv2.NORM_MINMAX)
-            else:
-                depth_normalized = np.zeros_like(depth)
-            depth_normalized = cv2.normalize(depth, None, 0, 255, cv2.NORM_MINMAX)
-            depth_uint8 = np.uint8(depth_normalized)
-            depth_video.write(depth_uint8)
-        depth_video.release()
-        # due to some bug, we need to use ffmpeg to convert the depth video to mp4
-        subprocess.run(["ffmpeg", "-y", "-i", depth_path, "-c:v", "libx264", "-crf", "23", depth_path.replace(".mp4", "_compressed.mp4")],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        os.remove(depth_path)
+    writer.close()
 
 def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool, skip_all : bool, extra_opts=None):
     # with torch.no_grad():
     load_ply = None if extra_opts.load_ply == 'origin' else extra_opts.load_ply
     gaussians = GaussianModel(dataset.sh_degree)
     scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False, extra_opts=extra_opts, load_ply=load_ply)
+    # the Gaussians are fixed while rendering, and pose refinement only needs the gradients of the
+    # pose deltas: without grad on the Gaussians their activations are computed once and cached
+    for param in (gaussians._xyz, gaussians._features_dc, gaussians._features_rest, gaussians._scaling, gaussians._rotation, gaussians._opacity):
+        param.requires_grad_(False)
+    gaussians.enable_activation_cache()
 
     bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
     background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
@@ -268,6 +197,8 @@ def render_path(dataset : ModelParams, iteration : int, pipeline : PipelineParam
     load_ply = None if extra_opts.load_ply == 'origin' else extra_opts.load_ply
     gaussians = GaussianModel(dataset.sh_degree)
     scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False, extra_opts=extra_opts, load_ply=load_ply)
+    # the Gaussians are fixed while rendering, activate them once
+    gaussians.enable_activation_cache()
 
     iteration = scene.loaded_iter
 
@@ -284,8 +215,7 @@ def render_path(dataset : ModelParams, iteration : int, pipeline : PipelineParam
 
     makedirs(render_path, exist_ok=True)
 
-    depths = []
-    for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
+    for view in views:
         if args.render_resize_method == 'crop':
             image_size = 512
         elif args.render_resize_method == 'pad':
@@ -302,23 +232,18 @@ def render_path(dataset : ModelParams, iteration : int, pipeline : PipelineParam
         view.projection_matrix = getProjectionMatrix(znear=view.znear, zfar=view.zfar, fovX=view.FoVx, fovY=view.FoVy).transpose(0,1).cuda().float()
         view.full_proj_transform = (view.world_view_transform.unsqueeze(0).bmm(view.projection_matrix.unsqueeze(0))).squeeze(0)
 
-        render_pkg = render(view, gaussians, pipeline, background)
-        rendering = render_pkg["render"]
-        depths.append(render_pkg["rendered_depth"].cpu().numpy()[0])
-        torchvision.utils.save_image(rendering, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
-
-    # Use ffmpeg to output video
-    renders_path = os.path.join(model_path, name, "ours_{}".format(iteration), "renders.mp4")
-    # Use ffmpeg to output video
-    subprocess.run(["ffmpeg", "-y",
-                "-framerate", "24",
-                "-i", os.path.join(render_path, "%05d.png"),
-                "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
-                "-c:v", "libx264",
-                "-crf", "23",
-                # "-pix_fmt", "yuv420p",  # Set pixel format for compatibility
-                renders_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-                )
+    writer = FrameWriter(num_workers=extra_opts.writer_workers, max_pending=extra_opts.writer_queue)
+    video = writer.open_video(os.path.join(model_path, name, "ours_{}".format(iteration), "renders.mp4"))
+
+    # all trajectory views share the same image size, so they are rendered in batches
+    batch_size = max(extra_opts.render_batch_size, 1)
+    for start in tqdm(range(0, len(views), batch_size), desc="Rendering progress"):
+        render_pkg = render_batch(views[start:start + batch_size], gaussians, pipeline, background)
+        for offset, rendering in enumerate(render_pkg["render"]):
+            rendering_uint8 = to_uint8(rendering)
+            writer.save_image(rendering_uint8, os.path.join(render_path, '{0:05d}'.format(start + offset) + ".png"))
+            video.write(rendering_uint8)
+    writer.close()
 
 if __name__ == "__main__":
     # Set up command line argument parser
@@ -335,6 +260,11 @@ if __name__ == "__main__":
     parser.add_argument("--is_eval", action="store_true")
     parser.add_argument("--render_path", action="store_true")
     parser.add_argument("--render_resize_method", default="crop", type=str)
+    parser.add_argument("--render_batch_size", default=8, type=int, help="number of trajectory views rendered per render_batch call")
+    parser.add_argument("--writer_workers", default=4, type=int, help="number of threads encoding the PNG outputs")
+    parser.add_argument("--writer_queue", default=16, type=int, help="maximum number of frames waiting to be written")
+    parser.add_argument("--lpips_batch_size", default=8, type=int, help="number of views per LPIPS call of the evaluation")
+    parser.add_argument("--recompute_metrics", action="store_true", help="with --is_eval, evaluate the saved images even if render.py stored their metrics")
     ### some exp args
     parser.add_argument("--sparse_view_num", type=int, default=-1,
                         help="Use sparse view or dense view, if sparse_view_num > 0, use sparse view, \
@@ -347,6 +277,7 @@ if __name__ == "__main__":
                         help='use dust3r estimated poses')
     parser.add_argument('--dust3r_json', type=str, default=None)
     parser.add_argument('--refine_iters', type=int, default=0)
+    parser.add_argument('--refine_batch_size', type=int, default=8, help='number of test views whose poses are refined concurrently')
     parser.add_argument("--transform_the_world", action="store_true", help="Transform the world to the origin")
     parser.add_argument("--load_ply", default="origin", type=str, help="Load other ply as init")
     args = get_combined_args(parser)
@@ -358,7 +289,7 @@ if __name__ == "__main__":
     # sometimes we only want to render the images, and do not want to evaluate the metrics
     if args.is_eval:
         with torch.no_grad():
-            evaluate([args.model_path])
+            evaluate([args.model_path], recompute=args.recompute_metrics)
         exit()
 
     if args.render_path:
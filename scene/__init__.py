@@ -16,17 +16,101 @@ from utils.system_utils import searchForMaxIteration
 from scene.dataset_readers import sceneLoadTypeCallbacks
 from scene.gaussian_model import GaussianModel
 from arguments import ModelParams
-from utils.camera_utils import cameraList_from_camInfos, camera_to_JSON
+from utils.camera_utils import cameraList_from_camInfos, cameraLists_from_camInfos_parallel, camera_to_JSON
+from utils.checkpoint_utils import COLUMNAR_EXTENSION
 import time
-
+from typing import NamedTuple
+from utils.graphics_utils import BasicPointCloud
+
+
+class SceneData(NamedTuple):
+    point_cloud: BasicPointCloud
+    json_cams: list
+    cameras_extent: float
+    train_cameras: dict # resolution scale -> camera list
+    test_cameras: dict
+    render_cameras: dict
+
+def _shuffled(cameras):
+    # Multi-res consistent random shuffling
+    order = None
+    shuffled = {}
+    for resolution_scale, camera_list in cameras.items():
+        if order is None:
+            order = list(range(len(camera_list)))
+            random.shuffle(order)
+        shuffled[resolution_scale] = [camera_list[i] for i in order]
+    return shuffled
+
+def load_scene_data(args : ModelParams, extra_opts=None, shuffle=False, resolution_scales=[1.0]):
+    """
+    Read the scene and load its cameras. The result can be passed to several Scenes (e.g. the
+    leave-one-out jobs) so that the images are decoded and the point cloud is read only once.
+    """
+    if hasattr(extra_opts, 'use_dust3r') and extra_opts.use_dust3r: # type: ignore
+        scene_info = sceneLoadTypeCallbacks["DUSt3R"](args.source_path, args.images, args.eval, extra_opts=extra_opts) # type: ignore
+    elif os.path.exists(os.path.join(args.source_path, "sparse")): # type: ignore
+        scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.eval, extra_opts=extra_opts) # type: ignore
+    elif os.path.exists(os.path.join(args.source_path, "transforms_alignz_train.json")): # type: ignore
+        print("Found transforms_alignz_train.json file, assuming OpenIllumination data set!")
+        scene_info = sceneLoadTypeCallbacks["OpenIllumination"](args.source_path, args.white_background, args.eval, extra_opts=extra_opts) # type: ignore
+    else:
+        assert False, "Could not recognize scene type!"
+
+    json_cams = []
+    camlist = []
+    if scene_info.test_cameras:
+        camlist.extend(scene_info.test_cameras)
+    if scene_info.train_cameras:
+        camlist.extend(scene_info.train_cameras)
+    if scene_info.render_cameras:
+        camlist.extend(scene_info.render_cameras)
+    for id, cam in enumerate(camlist):
+        json_cams.append(camera_to_JSON(id, cam))
+
+    if shuffle:
+        random.shuffle(scene_info.train_cameras)  # Multi-res consistent random shuffling
+        random.shuffle(scene_info.test_cameras)  # Multi-res consistent random shuffling
+
+    train_cameras, test_cameras, render_cameras = {}, {}, {}
+    load_workers = getattr(args, "load_workers", 0)
+    for resolution_scale in resolution_scales:
+        if load_workers > 0:
+            init_time = time.time()
+            cameras = cameraLists_from_camInfos_parallel({"train": (scene_info.train_cameras, "train"),
+                                                          "test": (scene_info.test_cameras, "test"),
+                                                          "render": (scene_info.render_cameras, "test")},
+                                                         resolution_scale, args, num_workers=load_workers)
+            train_cameras[resolution_scale] = cameras["train"]
+            test_cameras[resolution_scale] = cameras["test"]
+            render_cameras[resolution_scale] = cameras["render"]
+            print("Loading train/test/render cameras with {}s".format(time.time() - init_time))
+            continue
+        init_time = time.time()
+        train_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.train_cameras, resolution_scale, args, mode="train")
+        init_time2 = time.time()
+        print("Loading training cameras with {}s".format(init_time2 - init_time))
+        test_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.test_cameras, resolution_scale, args)
+        init_time3 = time.time()
+        print("Loading test cameras with {}s".format(time.time() - init_time2))
+        render_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.render_cameras, resolution_scale, args)
+        print("Loading render cameras with {}s".format(time.time() - init_time3))
+
+    return SceneData(point_cloud=scene_info.point_cloud,
+                     json_cams=json_cams,
+                     cameras_extent=scene_info.nerf_normalization["radius"],
+                     train_cameras=train_cameras,
+                     test_cameras=test_cameras,
+                     render_cameras=render_cameras)
 
 class Scene:
 
     gaussians : GaussianModel
 
-    def __init__(self, args : ModelParams, gaussians : GaussianModel, load_iteration=None, shuffle=False, resolution_scales=[1.0], extra_opts=None, load_ply=None):
+    def __init__(self, args : ModelParams, gaussians : GaussianModel, load_iteration=None, shuffle=False, resolution_scales=[1.0], extra_opts=None, load_ply=None, scene_data=None):
         """b
         :param path: Path to colmap scene main folder.
+        :param scene_data: SceneData from load_scene_data, to share the loaded cameras and point cloud between Scenes.
         """
         self.model_path = args.model_path # type: ignore
         self.loaded_iter = None
@@ -39,66 +123,46 @@ class Scene:
                 self.loaded_iter = load_iteration
             print("Loading trained model at iteration {}".format(self.loaded_iter))
 
-        self.train_cameras = {}
-        self.test_cameras = {}
-        self.render_cameras = {}
-
-        if hasattr(extra_opts, 'use_dust3r') and extra_opts.use_dust3r: # type: ignore
-            scene_info = sceneLoadTypeCallbacks["DUSt3R"](args.source_path, args.images, args.eval, extra_opts=extra_opts) # type: ignore
-        elif os.path.exists(os.path.join(args.source_path, "sparse")): # type: ignore
-            scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.eval, extra_opts=extra_opts) # type: ignore
-        elif os.path.exists(os.path.join(args.source_path, "transforms_alignz_train.json")): # type: ignore
-            print("Found transforms_alignz_train.json file, assuming OpenIllumination data set!")
-            scene_info = sceneLoadTypeCallbacks["OpenIllumination"](args.source_path, args.white_background, args.eval, extra_opts=extra_opts) # type: ignore
-        else:
-            assert False, "Could not recognize scene type!"
+        if scene_data is None:
+            scene_data = load_scene_data(args, extra_opts, shuffle=shuffle, resolution_scales=resolution_scales)
+        elif shuffle:
+            scene_data = scene_data._replace(train_cameras=_shuffled(scene_data.train_cameras),
+                                             test_cameras=_shuffled(scene_data.test_cameras))
 
         if not self.loaded_iter and load_ply is None:
             # NOTE :this dump use the file name, we dump the SceneInfo.pcd as the input.ply
-            json_cams = []
-            camlist = []
-            if scene_info.test_cameras:
-                camlist.extend(scene_info.test_cameras)
-            if scene_info.train_cameras:
-                camlist.extend(scene_info.train_cameras)
-            if scene_info.render_cameras:
-                camlist.extend(scene_info.render_cameras)
-            for id, cam in enumerate(camlist):
-                json_cams.append(camera_to_JSON(id, cam))
             with open(os.path.join(self.model_path, "cameras.json"), 'w') as file:
-                json.dump(json_cams, file)
+                json.dump(scene_data.json_cams, file)
 
-        if shuffle:
-            random.shuffle(scene_info.train_cameras)  # Multi-res consistent random shuffling
-            random.shuffle(scene_info.test_cameras)  # Multi-res consistent random shuffling
-
-        self.cameras_extent = scene_info.nerf_normalization["radius"]
-
-        for resolution_scale in resolution_scales:
-            init_time = time.time()
-            self.train_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.train_cameras, resolution_scale, args, mode="train")
-            init_time2 = time.time()
-            print("Loading training cameras with {}s".format(init_time2 - init_time))
-            self.test_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.test_cameras, resolution_scale, args)
-            init_time3 = time.time()
-            print("Loading test cameras with {}s".format(time.time() - init_time2))
-            self.render_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.render_cameras, resolution_scale, args)
-            print("Loading render cameras with {}s".format(time.time() - init_time3))
+        self.cameras_extent = scene_data.cameras_extent
+        self.train_cameras = dict(scene_data.train_cameras)
+        self.test_cameras = dict(scene_data.test_cameras)
+        self.render_cameras = dict(scene_data.render_cameras)
 
         if self.loaded_iter:
-            load_name = "point_cloud.ply"
-            self.gaussians.load_ply(os.path.join(self.model_path, "point_cloud", "iteration_" + str(self.loaded_iter), load_name))
+            point_cloud_path = os.path.join(self.model_path, "point_cloud", "iteration_" + str(self.loaded_iter))
+            # prefer the memory-mapped columnar checkpoint when one was saved next to the ply
+            load_name = "point_cloud" + COLUMNAR_EXTENSION
+            if not os.path.exists(os.path.join(point_cloud_path, load_name)):
+                load_name = "point_cloud.ply"
+            self.gaussians.load_ply(os.path.join(point_cloud_path, load_name))
         elif load_ply:
             self.gaussians.load_ply(load_ply)
             # in this case, we need it to be trainable, so we need to make sure the spatial_lr_scale is not 0
             self.gaussians.spatial_lr_scale = self.cameras_extent
         else:
-            self.gaussians.create_from_pcd(scene_info.point_cloud, self.cameras_extent)
+            self.gaussians.create_from_pcd(scene_data.point_cloud, self.cameras_extent)
             self.gaussians.save_ply(os.path.join(self.model_path, "input.ply"))
 
-    def save(self, iteration):
+    def save(self, iteration, columnar=False):
         point_cloud_path = os.path.join(self.model_path, "point_cloud/iteration_{}".format(iteration))
         self.gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"))
+        columnar_path = os.path.join(point_cloud_path, "point_cloud" + COLUMNAR_EXTENSION)
+        if columnar:
+            self.gaussians.save_columnar(columnar_path)
+        elif os.path.exists(columnar_path):
+            # loading prefers the columnar checkpoint, one left by an earlier run would shadow this ply
+            os.remove(columnar_path)
 
     def getTrainCameras(self, scale=1.0):
         return self.train_cameras[scale]
@@ -0,0 +1,120 @@
+import torch
+from torch import nn
+
+class CapacityStorage:
+    """
+    Preallocated, growable backing storage for the per-point tensors of a GaussianModel.
+
+    Every optimized attribute, its two Adam moments and the densification statistics live in the
+    leading rows of buffers sized for `capacity` points. The nn.Parameters handed to the optimizer
+    are views of the first `num_points` rows, so densification writes the new rows in place and
+    pruning compacts the surviving rows to the front. The buffers are only reallocated, with
+    `growth` headroom, when the capacity is exceeded.
+    """
+
+    MOMENTS = ("exp_avg", "exp_avg_sq")
+
+    def __init__(self, growth: float):
+        self.growth = growth
+        self.num_points = 0
+        self.capacity = 0
+        self.buffers = {}
+        self.num_reallocations = 0
+
+    def _reserve(self, num_points):
+        if num_points <= self.capacity:
+            return
+        capacity = int(num_points * (1 + self.growth))
+        for key, buffer in self.buffers.items():
+            new_buffer = buffer.new_zeros((capacity,) + tuple(buffer.shape[1:]))
+            new_buffer[:self.num_points] = buffer[:self.num_points]
+            self.buffers[key] = new_buffer
+        self.capacity = capacity
+        self.num_reallocations += 1
+
+    def view(self, key):
+        return self.buffers[key][:self.num_points]
+
+    @torch.no_grad()
+    def adopt(self, optimizer, stats):
+        """
+        Move the optimizer parameters, their Adam moments and the given statistics tensors
+        (name -> [N, ...] tensor) into freshly reserved buffers. Returns the rebound parameters.
+        """
+        self.buffers = {}
+        for group in optimizer.param_groups:
+            param = group["params"][0]
+            self.buffers[group["name"]] = param.detach()
+            for moment in self.MOMENTS:
+                self.buffers["{}.{}".format(group["name"], moment)] = torch.zeros_like(param.detach())
+        for name, tensor in stats.items():
+            self.buffers[name] = tensor
+        self.num_points = optimizer.param_groups[0]["params"][0].shape[0]
+        self.capacity = 0
+        self._reserve(self.num_points)
+        # the moments of an existing optimizer state are copied in by bind
+        return self.bind(optimizer, sync=True)
+
+    def _sync(self, optimizer):
+        # Adam creates its state lazily on the first step; copy any moments that are not views of
+        # our buffers yet, so that append/compact below see the up-to-date values
+        for group in optimizer.param_groups:
+            stored_state = optimizer.state.get(group['params'][0], None)
+            if not stored_state:
+                continue
+            for moment in self.MOMENTS:
+                view = self.view("{}.{}".format(group["name"], moment))
+                if stored_state[moment].data_ptr() != view.data_ptr():
+                    view.copy_(stored_state[moment])
+                stored_state[moment] = view
+
+    def bind(self, optimizer, names=None, sync=False):
+        """ Replace the optimizer parameters (and state) with views of the first num_points rows. """
+        if sync:
+            self._sync(optimizer)
+        optimizable_tensors = {}
+        for group in optimizer.param_groups:
+            if names is not None and group["name"] not in names:
+                continue
+            stored_state = optimizer.state.pop(group['params'][0], None)
+            group["params"][0] = nn.Parameter(self.view(group["name"]).requires_grad_(False), requires_grad=True)
+            if stored_state:
+                for moment in self.MOMENTS:
+                    stored_state[moment] = self.view("{}.{}".format(group["name"], moment))
+                optimizer.state[group['params'][0]] = stored_state
+            optimizable_tensors[group["name"]] = group["params"][0]
+        return optimizable_tensors
+
+    @torch.no_grad()
+    def append(self, optimizer, tensors_dict):
+        """ Append new points in place. Moments and statistics of the new rows are zero. """
+        self._sync(optimizer)
+        num_new = next(iter(tensors_dict.values())).shape[0]
+        self._reserve(self.num_points + num_new)
+        for key, buffer in self.buffers.items():
+            rows = buffer[self.num_points:self.num_points + num_new]
+            if key in tensors_dict:
+                rows.copy_(tensors_dict[key])
+            else:
+                rows.zero_()
+        self.num_points += num_new
+        return self.bind(optimizer)
+
+    @torch.no_grad()
+    def compact(self, optimizer, valid_mask):
+        """ Move the rows selected by valid_mask to the front of every buffer. """
+        self._sync(optimizer)
+        num_valid = int(valid_mask.sum())
+        for buffer in self.buffers.values():
+            buffer[:num_valid] = buffer[:self.num_points][valid_mask]
+        self.num_points = num_valid
+        return self.bind(optimizer)
+
+    @torch.no_grad()
+    def replace(self, optimizer, name, tensor):
+        """ Overwrite one attribute in place and reset its Adam moments. """
+        self._sync(optimizer)
+        self.view(name).copy_(tensor)
+        for moment in self.MOMENTS:
+            self.view("{}.{}".format(name, moment)).zero_()
+        return self.bind(optimizer, names=(name,))
@@ -11,16 +11,28 @@
 
 import torch
 import numpy as np
-from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotation
+from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotation, gather_extend_rows
 from torch import nn
 import os
 from utils.system_utils import mkdir_p
-from plyfile import PlyData, PlyElement
+from utils.ply_utils import write_vertex_ply, read_vertex_ply, sorted_attribute_names
+from utils.checkpoint_utils import write_columnar_checkpoint, is_columnar_checkpoint, ColumnarCheckpoint
 from utils.sh_utils import RGB2SH
 from simple_knn._C import distCUDA2
 from utils.graphics_utils import BasicPointCloud, z_score_from_percentage
 from utils.general_utils import strip_symmetric, build_scaling_rotation
-import pytorch3d.ops as p3dops
+from utils.knn_utils import knn_distance_statistics
+from scene.capacity_storage import CapacityStorage
+
+# attribute name in columnar checkpoints (same as the optimizer group name) -> GaussianModel member
+COLUMNAR_ATTRIBUTES = {
+    "xyz": "_xyz",
+    "f_dc": "_features_dc",
+    "f_rest": "_features_rest",
+    "opacity": "_opacity",
+    "scaling": "_scaling",
+    "rotation": "_rotation",
+}
 
 class GaussianModel:
 
@@ -58,6 +70,12 @@ class GaussianModel:
         self.percent_dense = 0
         self.spatial_lr_scale = 0
         self._backup_attributes = {}
+        self.storage = None
+        self.fused_densification = False
+        self.cache_activations = False
+        self._activation_cache = {}
+        self._param_version = 0
+        self._backup_activations = None
         self.setup_functions()
 
     def capture(self):
@@ -93,6 +111,8 @@ class GaussianModel:
         self.xyz_gradient_accum = xyz_gradient_accum
         self.denom = denom
         self.optimizer.load_state_dict(opt_dict)
+        if self.storage is not None:
+            self.setup_storage(self.storage.growth)
 
     @property
     def cache(self):
@@ -103,13 +123,40 @@ class GaussianModel:
                 self._rotation.detach(),
                 self._opacity.detach()]
 
+    def enable_activation_cache(self, enabled=True):
+        """
+        Cache get_scaling / get_rotation / get_features / get_opacity between parameter updates.
+        Only accesses that do not build an autograd graph (no_grad, or parameters that do not
+        require grad) are served from the cache, so the training forward pass is unaffected.
+        """
+        self.cache_activations = enabled
+        self.invalidate_activations()
+
+    def invalidate_activations(self):
+        self._param_version += 1
+        self._activation_cache.clear()
+
+    def _cached_activation(self, name, sources, activation):
+        if not self.cache_activations or not all(isinstance(source, nn.Parameter) for source in sources) \
+                or (torch.is_grad_enabled() and any(source.requires_grad for source in sources)):
+            return activation()
+        # the tensor version counters also catch in-place updates that did not go through
+        # invalidate_activations; temporary tensors (e.g. noisy copies) are never cached
+        key = (self._param_version, tuple(source._version for source in sources))
+        entry = self._activation_cache.get(name)
+        if entry is not None and entry[0] == key and all(a is b for a, b in zip(entry[1], sources)):
+            return entry[2]
+        value = activation()
+        self._activation_cache[name] = (key, sources, value)
+        return value
+
     @property
     def get_scaling(self):
-        return self.scaling_activation(self._scaling)
+        return self._cached_activation("scaling", (self._scaling,), lambda: self.scaling_activation(self._scaling))
 
     @property
     def get_rotation(self):
-        return self.rotation_activation(self._rotation)
+        return self._cached_activation("rotation", (self._rotation,), lambda: self.rotation_activation(self._rotation))
 
     @property
     def get_xyz(self):
@@ -119,11 +166,11 @@ class GaussianModel:
     def get_features(self):
         features_dc = self._features_dc
         features_rest = self._features_rest
-        return torch.cat((features_dc, features_rest), dim=1)
+        return self._cached_activation("features", (features_dc, features_rest), lambda: torch.cat((features_dc, features_rest), dim=1))
 
     @property
     def get_opacity(self):
-        return self.opacity_activation(self._opacity)
+        return self._cached_activation("opacity", (self._opacity,), lambda: self.opacity_activation(self._opacity))
 
     def get_covariance(self, scaling_modifier = 1.0):
         return self.covariance_activation(self.get_scaling, scaling_modifier, self._rotation)
@@ -177,6 +224,43 @@ class GaussianModel:
                                                     lr_delay_mult=training_args.position_lr_delay_mult,
                                                     max_steps=training_args.position_lr_max_steps)
 
+        self.fused_densification = getattr(training_args, "fused_densification", False)
+        if getattr(training_args, "cache_activations", False):
+            self.enable_activation_cache()
+        if hasattr(self.optimizer, "register_step_post_hook"):
+            self.optimizer.register_step_post_hook(lambda optimizer, args, kwargs: self.invalidate_activations())
+        self.storage = None
+        if getattr(training_args, "capacity_growth", 0) > 0:
+            self.setup_storage(training_args.capacity_growth)
+
+    def setup_storage(self, growth):
+        """
+        Move the parameters, their Adam moments and the densification statistics into preallocated
+        buffers with `growth` headroom, so that densify and prune become in-place writes and compactions.
+        """
+        self.storage = CapacityStorage(growth)
+        optimizable_tensors = self.storage.adopt(self.optimizer, {
+            "xyz_gradient_accum": self.xyz_gradient_accum,
+            "denom": self.denom,
+            "max_radii2D": self.max_radii2D,
+        })
+        self._set_optimizable_tensors(optimizable_tensors)
+        self._bind_storage_stats()
+
+    def _set_optimizable_tensors(self, optimizable_tensors):
+        self._xyz = optimizable_tensors["xyz"]
+        self._features_dc = optimizable_tensors["f_dc"]
+        self._features_rest = optimizable_tensors["f_rest"]
+        self._opacity = optimizable_tensors["opacity"]
+        self._scaling = optimizable_tensors["scaling"]
+        self._rotation = optimizable_tensors["rotation"]
+        self.invalidate_activations()
+
+    def _bind_storage_stats(self):
+        self.xyz_gradient_accum = self.storage.view("xyz_gradient_accum")
+        self.denom = self.storage.view("denom")
+        self.max_radii2D = self.storage.view("max_radii2D")
+
     def update_learning_rate(self, iteration):
         ''' Learning rate scheduling per step '''
         for param_group in self.optimizer.param_groups: # pyright: ignore[reportOptionalMemberAccess]
@@ -205,60 +289,64 @@ class GaussianModel:
     def save_ply(self, path):
         mkdir_p(os.path.dirname(path))
 
-        xyz = self._xyz.detach().cpu().numpy()
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
+        xyz = self._xyz.detach()
+        normals = torch.zeros_like(xyz)
+        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1)
+        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1)
+        opacities = self._opacity.detach()
+        scale = self._scaling.detach()
+        rotation = self._rotation.detach()
 
-        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
-
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
-        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-        elements[:] = list(map(tuple, attributes))
-        el = PlyElement.describe(elements, 'vertex')
-        PlyData([el]).write(path)
+        # one device-to-host copy and one contiguous write of the whole vertex block
+        attributes = torch.cat((xyz, normals, f_dc, f_rest, opacities, scale, rotation), dim=1).float().cpu().numpy()
+        write_vertex_ply(path, self.construct_list_of_attributes(), attributes)
 
     def reset_opacity(self):
         opacities_new = inverse_sigmoid(torch.min(self.get_opacity, torch.ones_like(self.get_opacity)*0.01))
         optimizable_tensors = self.replace_tensor_to_optimizer(opacities_new, "opacity")
         self._opacity = optimizable_tensors["opacity"]
+        self.invalidate_activations()
+
+    def save_columnar(self, path):
+        mkdir_p(os.path.dirname(path))
+        attributes = {name: getattr(self, attr).detach().float().cpu().numpy() for name, attr in COLUMNAR_ATTRIBUTES.items()}
+        write_columnar_checkpoint(path, attributes, meta={"max_sh_degree": self.max_sh_degree})
+
+    def load_columnar(self, path, requires_grad: bool = True):
+        """ Load a columnar checkpoint written by save_columnar """
+        checkpoint = ColumnarCheckpoint(path)
+        assert checkpoint.meta["max_sh_degree"] == self.max_sh_degree
+        for name in COLUMNAR_ATTRIBUTES.keys():
+            tensor = torch.tensor(np.asarray(checkpoint[name]), dtype=torch.float, device="cuda")
+            setattr(self, COLUMNAR_ATTRIBUTES[name], nn.Parameter(tensor.requires_grad_(requires_grad)))
+        self.max_radii2D = torch.zeros((checkpoint.num_points), device="cuda")
+        self.invalidate_activations()
+
+        self.active_sh_degree = self.max_sh_degree
 
     def load_ply(self, path, requires_grad: bool = True):
-        plydata = PlyData.read(path)
+        if is_columnar_checkpoint(path):
+            return self.load_columnar(path, requires_grad)
+
+        names, vertices = read_vertex_ply(path)
+        columns = {name: idx for idx, name in enumerate(names)}
 
-        xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                        np.asarray(plydata.elements[0]["y"]),
-                        np.asarray(plydata.elements[0]["z"])),  axis=1)
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
+        def gather(attr_names):
+            return np.ascontiguousarray(vertices[:, [columns[name] for name in attr_names]])
 
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
+        xyz = gather(["x", "y", "z"])
+        opacities = gather(["opacity"])
 
-        extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
-        extra_f_names = sorted(extra_f_names, key = lambda x: int(x.split('_')[-1]))
+        features_dc = gather(["f_dc_0", "f_dc_1", "f_dc_2"])[..., np.newaxis]
+
+        extra_f_names = sorted_attribute_names(names, "f_rest_")
         assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        features_extra = gather(extra_f_names)
         # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
         features_extra = features_extra.reshape((features_extra.shape[0], 3, (self.max_sh_degree + 1) ** 2 - 1))
 
-        scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-        scale_names = sorted(scale_names, key = lambda x: int(x.split('_')[-1]))
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-        rot_names = sorted(rot_names, key = lambda x: int(x.split('_')[-1]))
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
+        scales = gather(sorted_attribute_names(names, "scale_"))
+        rots = gather(sorted_attribute_names(names, "rot"))
 
         self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device="cuda").requires_grad_(requires_grad))
         self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(requires_grad))
@@ -267,10 +355,14 @@ class GaussianModel:
         self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(requires_grad))
         self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(requires_grad))
         self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.invalidate_activations()
 
         self.active_sh_degree = self.max_sh_degree
 
     def replace_tensor_to_optimizer(self, tensor, name):
+        if self.storage is not None:
+            return self.storage.replace(self.optimizer, name, tensor)
+
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             if group["name"] == name:
@@ -286,6 +378,9 @@ class GaussianModel:
         return optimizable_tensors
 
     def _prune_optimizer(self, mask):
+        if self.storage is not None:
+            return self.storage.compact(self.optimizer, mask)
+
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             stored_state = self.optimizer.state.get(group['params'][0], None)
@@ -306,13 +401,12 @@ class GaussianModel:
     def prune_points(self, mask):
         valid_points_mask = ~mask
         optimizable_tensors = self._prune_optimizer(valid_points_mask)
+        self._set_optimizable_tensors(optimizable_tensors)
 
-        self._xyz = optimizable_tensors["xyz"]
-        self._features_dc = optimizable_tensors["f_dc"]
-        self._features_rest = optimizable_tensors["f_rest"]
-        self._opacity = optimizable_tensors["opacity"]
-        self._scaling = optimizable_tensors["scaling"]
-        self._rotation = optimizable_tensors["rotation"]
+        if self.storage is not None:
+            # the statistics were compacted together with the parameters
+            self._bind_storage_stats()
+            return
 
         self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
 
@@ -320,6 +414,9 @@ class GaussianModel:
         self.max_radii2D = self.max_radii2D[valid_points_mask]
 
     def cat_tensors_to_optimizer(self, tensors_dict):
+        if self.storage is not None:
+            return self.storage.append(self.optimizer, tensors_dict)
+
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             assert len(group["params"]) == 1
@@ -341,6 +438,33 @@ class GaussianModel:
 
         return optimizable_tensors
 
+    def _gather_extend_optimizer(self, valid_mask, tensors_dict):
+        """
+        Keep the rows selected by valid_mask and append tensors_dict, building every parameter and
+        Adam moment with a single gather into a tensor of the final size.
+        """
+        if self.storage is not None:
+            self.storage.compact(self.optimizer, valid_mask)
+            return self.storage.append(self.optimizer, tensors_dict)
+
+        keep_idx = valid_mask.nonzero(as_tuple=True)[0]
+        optimizable_tensors = {}
+        for group in self.optimizer.param_groups:
+            assert len(group["params"]) == 1
+            extension_tensor = tensors_dict[group["name"]]
+            stored_state = self.optimizer.state.get(group['params'][0], None)
+            if stored_state is not None:
+                stored_state["exp_avg"] = gather_extend_rows(stored_state["exp_avg"], keep_idx, extension_tensor.shape[0])
+                stored_state["exp_avg_sq"] = gather_extend_rows(stored_state["exp_avg_sq"], keep_idx, extension_tensor.shape[0])
+
+                del self.optimizer.state[group['params'][0]]
+                group["params"][0] = nn.Parameter(gather_extend_rows(group["params"][0], keep_idx, extension_tensor).requires_grad_(True))
+                self.optimizer.state[group['params'][0]] = stored_state
+            else:
+                group["params"][0] = nn.Parameter(gather_extend_rows(group["params"][0], keep_idx, extension_tensor).requires_grad_(True))
+            optimizable_tensors[group["name"]] = group["params"][0]
+        return optimizable_tensors
+
     def densification_postfix(self, new_xyz, new_features_dc, new_features_rest, new_opacities, new_scaling, new_rotation):
         d = {"xyz": new_xyz,
         "f_dc": new_features_dc,
@@ -350,12 +474,14 @@ class GaussianModel:
         "rotation" : new_rotation}
 
         optimizable_tensors = self.cat_tensors_to_optimizer(d)
-        self._xyz = optimizable_tensors["xyz"]
-        self._features_dc = optimizable_tensors["f_dc"]
-        self._features_rest = optimizable_tensors["f_rest"]
-        self._opacity = optimizable_tensors["opacity"]
-        self._scaling = optimizable_tensors["scaling"]
-        self._rotation = optimizable_tensors["rotation"]
+        self._set_optimizable_tensors(optimizable_tensors)
+
+        if self.storage is not None:
+            self._bind_storage_stats()
+            self.xyz_gradient_accum.zero_()
+            self.denom.zero_()
+            self.max_radii2D.zero_()
+            return
 
         self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
         self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
@@ -401,6 +527,9 @@ class GaussianModel:
         self.densification_postfix(new_xyz, new_features_dc, new_features_rest, new_opacities, new_scaling, new_rotation)
 
     def densify_and_prune(self, max_grad, min_opacity, extent, max_screen_size):
+        if self.fused_densification:
+            return self.densify_and_prune_fused(max_grad, min_opacity, extent, max_screen_size)
+
         grads = self.xyz_gradient_accum / self.denom
         grads[grads.isnan()] = 0.0
 
@@ -414,7 +543,69 @@ class GaussianModel:
             prune_mask = torch.logical_or(torch.logical_or(prune_mask, big_points_vs), big_points_ws)
         self.prune_points(prune_mask)
 
-        torch.cuda.empty_cache()
+        if self.storage is None:
+            torch.cuda.empty_cache()
+
+    @torch.no_grad()
+    def densify_and_prune_fused(self, max_grad, min_opacity, extent, max_screen_size, N=2):
+        """
+        Single-pass equivalent of densify_and_clone + densify_and_split + prune_points.
+        The clone, split and prune masks are computed up front on the current points, and the final
+        parameters and optimizer state are gathered once instead of being rebuilt by every step.
+        """
+        grads = self.xyz_gradient_accum / self.denom
+        grads[grads.isnan()] = 0.0
+        selected_pts_mask = torch.norm(grads, dim=-1) >= max_grad
+        max_scaling = torch.max(self.get_scaling, dim=1).values
+        clone_mask = torch.logical_and(selected_pts_mask, max_scaling <= self.percent_dense*extent)
+        split_mask = torch.logical_and(selected_pts_mask, max_scaling > self.percent_dense*extent)
+
+        # The sequential path resets max_radii2D in densification_postfix before pruning,
+        # so only the opacity and world-space size tests can remove points there.
+        def prune_filter(opacity, max_scaling):
+            prune_mask = (opacity < min_opacity).squeeze(-1)
+            if max_screen_size:
+                prune_mask = torch.logical_or(prune_mask, max_scaling > 0.1 * extent)
+            return prune_mask
+
+        prune_mask = prune_filter(self.get_opacity, max_scaling)
+
+        # Split children, sampled exactly as in densify_and_split
+        split_idx = split_mask.nonzero(as_tuple=True)[0]
+        stds = self.get_scaling[split_idx].repeat(N,1)
+        means = torch.zeros((stds.size(0), 3),device="cuda")
+        samples = torch.normal(mean=means, std=stds)
+        rots = build_rotation(self._rotation[split_idx]).repeat(N,1,1)
+        child_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + self.get_xyz[split_idx].repeat(N, 1)
+        child_scaling = self.scaling_inverse_activation(self.get_scaling[split_idx].repeat(N,1) / (0.8*N))
+        child_parent = split_idx.repeat(N)
+        child_keep = ~prune_filter(self.get_opacity[child_parent], self.scaling_activation(child_scaling).max(dim=1).values)
+        child_parent = child_parent[child_keep]
+
+        clone_idx = torch.logical_and(clone_mask, ~prune_mask).nonzero(as_tuple=True)[0]
+        # Final layout, as in the sequential path: [kept originals, clones, split children]
+        new_idx = torch.cat((clone_idx, child_parent))
+        d = {"xyz": torch.cat((self._xyz[clone_idx], child_xyz[child_keep])),
+        "f_dc": self._features_dc[new_idx],
+        "f_rest": self._features_rest[new_idx],
+        "opacity": self._opacity[new_idx],
+        "scaling" : torch.cat((self._scaling[clone_idx], child_scaling[child_keep])),
+        "rotation" : self._rotation[new_idx]}
+
+        valid_points_mask = torch.logical_and(~split_mask, ~prune_mask)
+        optimizable_tensors = self._gather_extend_optimizer(valid_points_mask, d)
+        self._set_optimizable_tensors(optimizable_tensors)
+
+        if self.storage is not None:
+            self._bind_storage_stats()
+            self.xyz_gradient_accum.zero_()
+            self.denom.zero_()
+            self.max_radii2D.zero_()
+        else:
+            self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
+            self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
+            self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+            torch.cuda.empty_cache()
 
     def densify(self, max_grad, extent):
         grads = self.xyz_gradient_accum / self.denom
@@ -450,14 +641,14 @@ class GaussianModel:
             init_lambda_sigma = 1
             final_lambda_sigma = float(z_score_from_percentage(1))
             lambda_sigma = init_lambda_sigma + (final_lambda_sigma - init_lambda_sigma) * (step - iter_start) / (iter_end - iter_start)
-        nearest_k_distance = p3dops.knn_points(
-            xyz.unsqueeze(0),
-            xyz.unsqueeze(0),
-            K=int(num_points**0.5),
-        ).dists
-        mean_nearest_k_distance, std_nearest_k_distance = nearest_k_distance.mean(), nearest_k_distance.std()
-        mask = nearest_k_distance.mean(dim = -1) >= (mean_nearest_k_distance + lambda_sigma * std_nearest_k_distance)
-        mask = mask.squeeze()
+        # chunked kNN statistics: the [N, K] distance matrix is never materialized as a whole
+        point_nearest_k_distance, mean_nearest_k_distance, std_nearest_k_distance = knn_distance_statistics(
+            xyz,
+            K=getattr(opt, "outlier_knn_k", 0) or int(num_points**0.5),
+            backend=getattr(opt, "outlier_knn_backend", "pytorch3d"),
+            sample_size=getattr(opt, "outlier_stats_samples", 0),
+        )
+        mask = point_nearest_k_distance >= (mean_nearest_k_distance + lambda_sigma * std_nearest_k_distance)
 
         if remaining_rate > 0: # since the gs cannot generate point from None, we may need to keep some points incase of empty
             num_remove_points = mask.sum()
@@ -469,7 +660,8 @@ class GaussianModel:
             mask[keep_indices] = False
 
         self.prune_points(mask)
-        torch.cuda.empty_cache()
+        if self.storage is None:
+            torch.cuda.empty_cache()
 
     def add_densification_stats(self, viewspace_point_tensor, update_filter):
         self.xyz_gradient_accum[update_filter] += torch.norm(viewspace_point_tensor.grad[update_filter,:2], dim=-1, keepdim=True)
@@ -483,6 +675,12 @@ class GaussianModel:
         # Restore the attributes from backup
         for attr, value in self._backup_attributes.items():
             setattr(self, attr, value)
+        # the activations cached before add_statistics_noise are valid again
+        if self._backup_activations is not None:
+            self._param_version, self._activation_cache = self._backup_activations
+            self._backup_activations = None
+        else:
+            self.invalidate_activations()
 
     def add_statistics_noise(self, statistics_info, noise_dropout: float = 0., std_scale: float = 0.7):
         # List of attributes to add noise to '_xyz', '_features_dc', '_features_rest', '_scaling', '_rotation', '_opacity'
@@ -496,6 +694,9 @@ class GaussianModel:
             stds[key] = np.mean([info[key][1] for info in statistics_info], axis=0)
 
         # Backup and add noise
+        self._backup_activations = (self._param_version, self._activation_cache)
+        self._activation_cache = {}
+        self._param_version += 1
         for attr in attributes_to_noise:
             self._backup_attributes[attr] = getattr(self, attr)
             if attr in ['_xyz', '_scaling', '_rotation', '_opacity']:
@@ -28,10 +28,13 @@ from torchvision.utils import save_image, make_grid
 from torchmetrics.image import PeakSignalNoiseRatio as PSNR, StructuralSimilarityIndexMeasure as SSIM, LearnedPerceptualImagePatchSimilarity as LPIPS
 from torchmetrics.functional.regression import pearson_corrcoef
 from cldm.ddim_hacked import DDIMSampler
+from cldm.samplers import make_sampler
 from annotator.util import resize_image, HWC3
 from cldm.model import create_model, load_state_dict
 from minlora import add_lora, LoRAParametrization
 from threestudio.systems.base import BaseLift3DSystem
+from threestudio.utils.offload import OffloadManager
+from threestudio.utils.repair_cache import RepairCache
 from threestudio.utils.typing import *
 
 
@@ -52,45 +55,92 @@ def process(
     eta: float = 1.0,
     denoise_strength: float = 1.0
 ):
-    input_image = HWC3(input_image)
-    detected_map = input_image.copy()
+    return process_batch(
+        model, ddim_sampler, [input_image], [prompt], a_prompt, n_prompt, num_samples, image_resolution,
+        ddim_steps, guess_mode, strength, scale, eta, [denoise_strength], batch_size=num_samples
+    )[0]
 
-    img = resize_image(input_image, image_resolution)
-    H, W, C = img.shape
 
-    detected_map = cv2.resize(detected_map, (W, H), interpolation=cv2.INTER_LINEAR)
-
-    control = torch.from_numpy(detected_map.copy()).float().cuda() / 255.0
-    control = torch.stack([control for _ in range(num_samples)], dim=0)
-    control = einops.rearrange(control, 'b h w c -> b c h w').clone()
-
-    img = torch.from_numpy(img.copy()).float().cuda() / 127.0 - 1.0
-    img = torch.stack([img for _ in range(num_samples)], dim=0)
-    img = einops.rearrange(img, 'b h w c -> b c h w').clone()
-
-    cond = {"c_concat": [control], "c_crossattn": [model.get_learned_conditioning([prompt + ', ' + a_prompt] * num_samples)]}
-    un_cond = {"c_concat": None if guess_mode else [control], "c_crossattn": [model.get_learned_conditioning([n_prompt] * num_samples)]}
+@torch.no_grad()
+def process_batch(
+    model,
+    ddim_sampler: DDIMSampler,
+    input_images: List[np.ndarray],
+    prompts: List[str],
+    a_prompt: str = '',
+    n_prompt: str = '',
+    num_samples: int = 1,
+    image_resolution: int = 512,
+    ddim_steps: int = 50,
+    guess_mode: bool = False,
+    strength: float = 1.0,
+    scale: float = 1.0,
+    eta: float = 1.0,
+    denoise_strengths: List[float] = (1.0,),
+    batch_size: int = 8,
+    offload: Optional[OffloadManager] = None,
+    offload_next: Optional[str] = None
+):
+    """
+    `process` for several views of the same size at once. The num_samples samples of every view are
+    stacked into one latent batch that goes through the VAE and the DDIM decode batch_size latents
+    at a time; every distinct prompt is encoded once and every view keeps its own denoise strength.
+    With an offload manager holding the "cond_stage", "first_stage" and "denoiser" parts of model,
+    each part is prefetched while the previous one runs, and offload_next while the last batch is
+    decoded. Returns one (results, sds_w) pair per view, as returned by `process`.
+    """
+    controls, imgs = [], []
+    for input_image in input_images:
+        input_image = HWC3(input_image)
+        img = resize_image(input_image, image_resolution)
+        H, W, C = img.shape
+        detected_map = cv2.resize(input_image, (W, H), interpolation=cv2.INTER_LINEAR)
+        controls.append(torch.from_numpy(detected_map.copy()).float().cuda() / 255.0)
+        imgs.append(torch.from_numpy(img.copy()).float().cuda() / 127.0 - 1.0)
+    control = einops.rearrange(torch.stack(controls, dim=0), 'b h w c -> b c h w').clone()
+    img = einops.rearrange(torch.stack(imgs, dim=0), 'b h w c -> b c h w').clone()
+
+    if offload is not None:
+        offload.prefetch("first_stage")
+    unique_prompts = list(dict.fromkeys(prompts))
+    c_crossattn = model.get_learned_conditioning([prompt + ', ' + a_prompt for prompt in unique_prompts])
+    c_crossattn = c_crossattn[[unique_prompts.index(prompt) for prompt in prompts]]
+    uc_crossattn = model.get_learned_conditioning([n_prompt])
 
     ddim_sampler.make_schedule(ddim_steps, ddim_eta=eta, verbose=False)
-    t_enc = min(int(denoise_strength * ddim_steps), ddim_steps - 1)
-    z = model.get_first_stage_encoding(model.encode_first_stage(img))
-    z_enc = ddim_sampler.stochastic_encode(z, torch.tensor([t_enc] * num_samples).to(model.device))
+    t_encs = np.array([min(int(denoise_strength * ddim_steps), ddim_steps - 1) for denoise_strength in denoise_strengths])
 
     model.control_scales = [strength * (0.825 ** float(12 - i)) for i in range(13)] if guess_mode else ([strength] * 13)
     # Magic number. IDK why. Perhaps because 0.825**12<0.01 but 0.826**12>0.01
 
-    samples = ddim_sampler.decode(z_enc, cond, t_enc, unconditional_guidance_scale=scale, unconditional_conditioning=un_cond)
-
-    x_samples = model.decode_first_stage(samples)
-    x_samples = (einops.rearrange(x_samples, 'b c h w -> b h w c') * 127.5 + 127.5).cpu().numpy().clip(0, 255).astype(np.uint8)
-
-    results = [x_samples[i] for i in range(num_samples)]
-
+    # row r of the latent batch is sample r % num_samples of view r // num_samples
+    views = np.repeat(np.arange(len(input_images)), num_samples)
+    x_samples = []
+    for begin in range(0, views.shape[0], batch_size):
+        rows = views[begin:begin + batch_size]
+        rows_t = torch.from_numpy(rows).to(model.device)
+        cond = {"c_concat": [control[rows_t]], "c_crossattn": [c_crossattn[rows_t]]}
+        un_cond = {"c_concat": None if guess_mode else [control[rows_t]], "c_crossattn": [uc_crossattn.expand(rows.shape[0], -1, -1)]}
+
+        z = model.get_first_stage_encoding(model.encode_first_stage(img[rows_t]))
+        if offload is not None:
+            offload.prefetch("denoiser")
+        z_enc = ddim_sampler.stochastic_encode(z, torch.from_numpy(t_encs[rows]).to(model.device))
+        samples = ddim_sampler.decode(z_enc, cond, t_encs[rows], unconditional_guidance_scale=scale, unconditional_conditioning=un_cond)
+
+        if offload is not None:
+            offload.prefetch("first_stage")
+        x_chunk = model.decode_first_stage(samples)
+        if offload is not None and offload_next is not None and begin + batch_size >= views.shape[0]:
+            offload.prefetch(offload_next)
+        x_samples.append((einops.rearrange(x_chunk, 'b c h w -> b h w c') * 127.5 + 127.5).cpu().numpy().clip(0, 255).astype(np.uint8))
+    x_samples = np.concatenate(x_samples, axis=0)
 
     alphas = ddim_sampler.alphas_cumprod.cuda()
-    sds_w = (1 - alphas[t_enc]).view(-1, 1)
-
-    return results, sds_w
+    return [
+        ([x_samples[view * num_samples + i] for i in range(num_samples)], (1 - alphas[t_enc]).view(-1, 1))
+        for view, t_enc in enumerate(t_encs)
+    ]
 
 
 def compute_tv_norm(values: torch.Tensor, losstype='l2') -> torch.Tensor:
@@ -183,6 +233,16 @@ class GaussianDreamer(BaseLift3DSystem):
         refresh_interval: int = 100
         refresh_size: int = 20
         controlnet_num_samples: int = 1
+        controlnet_batch_size: int = 8
+        repair_sampler: str = "ddim" # or "dpm_solver++"
+        repair_sampler_steps: int = 0 # DPM-Solver++ steps for a full-strength repair, 0 for the sampler default (15); ddim does not take it
+        compile_denoiser: str = "" # torch.compile mode of the ControlNet step, e.g. "reduce-overhead" for CUDA graphs
+        vae_tile_size: int = 0 # encode/decode views larger than this in overlapping tiles, 0 disables tiling
+        vae_tile_overlap: int = 64
+        attn_backend: str = "" # auto, sdpa, xformers, sliced or naive; empty follows $ATTN_BACKEND
+        offload_budget: float = 0.0 # GB of device memory for the ControlNet and CLIP models, 0 keeps them all resident
+        repair_cache_dir: str = ""
+        repair_cache_size: float = 8.0 # GB
         sh_degree: int = 2
 
         ctrl_steps: int = 1000
@@ -190,6 +250,18 @@ class GaussianDreamer(BaseLift3DSystem):
         ctrl_loss_ratio_final: float = 0.5
 
     cfg: Config
+
+    # sampling settings of the ControlNet repair, part of the repair cache key
+    repair_kwargs = dict(
+        a_prompt = 'best quality',
+        n_prompt = 'blur, lowres, bad anatomy, bad hands, cropped, worst quality',
+        ddim_steps = 50,
+        guess_mode = False,
+        strength = 1.0,
+        scale = 1.0,
+        eta = 1.0
+    )
+
     def configure(self) -> None:
         self.gaussian = GaussianModel(sh_degree = self.cfg.sh_degree)
         self.cameras_extent = self.cfg.scene_extent
@@ -255,7 +327,8 @@ class GaussianDreamer(BaseLift3DSystem):
         if self.opt.random_background:
             gt_image = gt_image * viewpoint_cam.mask + bg[:, None, None] * (1 - viewpoint_cam.mask).squeeze()
         Ll1 = torch.nan_to_num(l1_loss(image, gt_image))
-        loss = (1.0 - self.opt.lambda_dssim) * Ll1 + self.opt.lambda_dssim * (1.0 - ssim(image, gt_image))
+        Lssim = 1.0 - ssim(image, gt_image)
+        loss = (1.0 - self.opt.lambda_dssim) * Ll1 + self.opt.lambda_dssim * Lssim
 
         if silhouette_loss_type == "bce":
             silhouette_loss = torch.nan_to_num(F.binary_cross_entropy(render_pkg["rendered_alpha"][0], viewpoint_cam.mask))
@@ -306,7 +379,7 @@ class GaussianDreamer(BaseLift3DSystem):
         return {
             'loss': loss,
             'l1_loss': Ll1,
-            'ssim_loss': 1.0 - ssim(image, gt_image),
+            'ssim_loss': Lssim,
             'silhouette_loss': silhouette_loss,
             'depth_loss': depth_loss
         }
@@ -357,7 +430,7 @@ class GaussianDreamer(BaseLift3DSystem):
 
     def on_fit_start(self) -> None:
         super().on_fit_start()
-        self.controlnet = create_model(f'models/{self.cfg.model_name}.yaml').cpu()
+        self.controlnet = create_model(f'models/{self.cfg.model_name}.yaml', attn_backend=self.cfg.attn_backend or None).cpu()
         self.controlnet.load_state_dict(load_state_dict('models/v1-5-pruned.ckpt', location='cuda'), strict=False)
         self.controlnet.load_state_dict(load_state_dict(f'models/{self.cfg.model_name}.pth', location='cuda'), strict=False)
         lora_config = {
@@ -383,7 +456,36 @@ class GaussianDreamer(BaseLift3DSystem):
             add_lora(self.controlnet.cond_stage_model, lora_config=lora_config)
         self.controlnet.load_state_dict(load_state_dict(f'{self.cfg.exp_name}/ckpts-lora/{self.cfg.lora_name}', location='cuda'), strict=False)
         self.controlnet = self.controlnet.cuda()
-        self.ddim_sampler = DDIMSampler(self.controlnet)
+        if self.cfg.compile_denoiser:
+            self.controlnet.compile_denoiser(mode=self.cfg.compile_denoiser)
+        if self.cfg.vae_tile_size > 0:
+            self.controlnet.first_stage_model.enable_tiling(self.cfg.vae_tile_size, self.cfg.vae_tile_overlap)
+        sampler_kwargs = dict(steps=self.cfg.repair_sampler_steps) if self.cfg.repair_sampler_steps > 0 else {}
+        self.ddim_sampler = make_sampler(self.cfg.repair_sampler, self.controlnet, **sampler_kwargs)
+        self.offload = None
+        if self.cfg.offload_budget > 0:
+            self.offload = OffloadManager(self.device, int(self.cfg.offload_budget * 2 ** 30))
+            self.offload.register("cond_stage", self.controlnet.cond_stage_model)
+            self.offload.register("first_stage", self.controlnet.first_stage_model)
+            if self.cfg.compile_denoiser:
+                # the compiled step captures the addresses of the weights, they stay resident
+                threestudio.warn("compile_denoiser is set, the denoiser is not offloaded")
+            else:
+                self.offload.register("denoiser", [self.controlnet.model, self.controlnet.control_model])
+            self.offload.register("clip", self.clip_model)
+        self.repair_cache = None
+        if self.cfg.repair_cache_dir:
+            lora_path = f'{self.cfg.exp_name}/ckpts-lora/{self.cfg.lora_name}'
+            lora_stat = os.stat(lora_path)
+            self.repair_cache = RepairCache(
+                self.cfg.repair_cache_dir,
+                int(self.cfg.repair_cache_size * 2 ** 30),
+                context = (
+                    self.cfg.model_name, os.path.abspath(lora_path), lora_stat.st_mtime_ns, lora_stat.st_size, self.cfg.lora_rank,
+                    self.cfg.add_diffusion_lora, self.cfg.add_control_lora, self.cfg.add_clip_lora,
+                    sorted(self.repair_kwargs.items()), self.cfg.repair_sampler, self.cfg.repair_sampler_steps, torch.initial_seed()
+                )
+            )
 
     def get_dis_from_ts(self, T):
         return torch.sort(torch.sqrt(torch.sum((T - self.all_T) ** 2, dim=-1)))[0]
@@ -406,6 +508,60 @@ class GaussianDreamer(BaseLift3DSystem):
             'txt': batch['txt']
         }
 
+    def repair_views(self, images, prompts, denoise_strengths, num_samples):
+        """ ControlNet repair of the rendered CHW images, batched over views; returns (samples, sds_w) per view """
+        images_np = [np.array(self.tensor_to_pil(image)) for image in images]
+        results = [None] * len(images_np)
+        keys = None
+        if self.repair_cache is not None:
+            keys = [self.repair_cache.key(image_np, prompt, denoise_strength, num_samples)
+                    for image_np, prompt, denoise_strength in zip(images_np, prompts, denoise_strengths)]
+            for idx, key in enumerate(keys):
+                cached = self.repair_cache.get(key)
+                if cached is not None:
+                    results[idx] = (cached[0], torch.from_numpy(cached[1]).cuda())
+        missing = [idx for idx, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            repaired = process_batch(
+                self.controlnet,
+                self.ddim_sampler,
+                [images_np[idx] for idx in missing],
+                prompts = [prompts[idx] for idx in missing],
+                num_samples = num_samples,
+                image_resolution = min(images_np[0].shape[0], images_np[0].shape[1]),
+                denoise_strengths = [denoise_strengths[idx] for idx in missing],
+                batch_size = self.cfg.controlnet_batch_size,
+                offload = self.offload,
+                offload_next = "clip" if num_samples > 1 else None,
+                **self.repair_kwargs
+            )
+            for idx, (samples, sds_w) in zip(missing, repaired):
+                results[idx] = (samples, sds_w)
+                if keys is not None:
+                    self.repair_cache.put(keys[idx], samples, sds_w.cpu().numpy())
+        if self.repair_cache is not None:
+            self.log("train/repair_cache_hits", float(self.repair_cache.hits))
+            self.log("train/repair_cache_misses", float(self.repair_cache.misses))
+        if self.offload is not None:
+            for k, v in self.offload.state().items():
+                self.log(f"train/offload_{k}", v)
+        return results
+
+    def best_controlnet_out(self, controlnet_samples, reduce=sum):
+        """ The sample whose CLIP features are closest to the gt views, scored with reduce over the gt views """
+        if len(controlnet_samples) == 1:
+            return controlnet_samples[0]
+        with torch.no_grad():
+            features = self.clip_model.encode_image(torch.stack([self.clip_preprocess(Image.fromarray(sample)) for sample in controlnet_samples]).to(self.device))
+        best_controlnet_out = controlnet_samples[0]
+        best_controlnet_out_score = 0.
+        for controlnet_out, image_features in zip(controlnet_samples, features):
+            score = reduce([torch.cosine_similarity(image_features[None], gt_features, dim=-1).mean() for gt_features in self.gt_features_all])
+            if score > best_controlnet_out_score:
+                best_controlnet_out = controlnet_out
+                best_controlnet_out_score = score
+        return best_controlnet_out
+
     def training_step(self, batch, batch_idx):
         if self.max_cam_dis == 0.:
             Ts = batch['gt_Ts']
@@ -430,41 +586,18 @@ class GaussianDreamer(BaseLift3DSystem):
                         with torch.no_grad():
                             gt_features = self.clip_model.encode_image(self.clip_preprocess(self.tensor_to_pil(gt_image[0])).unsqueeze(0).to(self.device))
                         self.gt_features_all.append(gt_features)
+                images = []
                 for R, T in batch['random_poses']:
                     controlent_batch = batch.copy()
                     controlent_batch['random_R'] = R
                     controlent_batch['random_T'] = T
                     controlent_batch = self.get_random_view_batch(controlent_batch)
                     render_results = self.render_gs(controlent_batch, renderbackground=self.background_tensor, need_loss=False)
-                    images = render_results['images']
-                    image = images[0]
-                    image_np = np.array(self.tensor_to_pil(image))
-                    denoise_strength = random.random() * (self.cfg.max_strength - self.cfg.min_strength) + self.cfg.min_strength
-                    controlnet_outs, sds_w = process(
-                        self.controlnet,
-                        self.ddim_sampler,
-                        image_np,
-                        prompt = batch['txt'][0],
-                        a_prompt = 'best quality',
-                        n_prompt = 'blur, lowres, bad anatomy, bad hands, cropped, worst quality',
-                        num_samples = self.cfg.controlnet_num_samples,
-                        image_resolution = min(image_np.shape[0], image_np.shape[1]),
-                        ddim_steps = 50,
-                        guess_mode = False,
-                        strength = 1.0,
-                        scale = 1.0,
-                        eta = 1.0,
-                        denoise_strength = denoise_strength
-                    )
-                    best_controlnet_out = controlnet_outs[0]
-                    best_controlnet_out_score = 0.
-                    for controlnet_out in controlnet_outs:
-                        with torch.no_grad():
-                            image_features = self.clip_model.encode_image(self.clip_preprocess(Image.fromarray(controlnet_out)).unsqueeze(0).to(self.device))
-                        score = sum([torch.cosine_similarity(image_features, gt_features, dim=-1).mean() for gt_features in self.gt_features_all])
-                        if score > best_controlnet_out_score:
-                            best_controlnet_out = controlnet_out
-                            best_controlnet_out_score = score
+                    images.append(render_results['images'][0])
+                denoise_strengths = [random.random() * (self.cfg.max_strength - self.cfg.min_strength) + self.cfg.min_strength for _ in images]
+                repaired = self.repair_views(images, [batch['txt'][0]] * len(images), denoise_strengths, self.cfg.controlnet_num_samples)
+                for controlnet_samples, sds_w in repaired:
+                    best_controlnet_out = self.best_controlnet_out(controlnet_samples, reduce=sum)
                     self.controlnet_outs.append(self.pil_to_tensor(best_controlnet_out).to(torch.float32).unsqueeze(0).cuda())
                     self.sds_ws.append(sds_w)
 
@@ -488,64 +621,25 @@ class GaussianDreamer(BaseLift3DSystem):
             controlnet_outs = []
             sds_ws = []
             if self.global_step < self.cfg.around_gt_steps:
-                for idx, image in enumerate(images):
-                    cached_controlnet_out = self.controlnet_outs[batch['index'][idx]]
-                    if cached_controlnet_out is not None:
-                        controlnet_out = cached_controlnet_out
-                        sds_w = self.sds_ws[batch['index'][idx]]
-                    else:
-                        image_np = np.array(self.tensor_to_pil(image))
-                        denoise_strength = self.cfg.max_strength
-                        controlnet_out, sds_w = process(
-                            self.controlnet,
-                            self.ddim_sampler,
-                            image_np,
-                            prompt = batch['txt'][idx],
-                            a_prompt = 'best quality',
-                            n_prompt = 'blur, lowres, bad anatomy, bad hands, cropped, worst quality',
-                            num_samples = 1,
-                            image_resolution = min(image_np.shape[0], image_np.shape[1]),
-                            ddim_steps = 50,
-                            guess_mode = False,
-                            strength = 1.0,
-                            scale = 1.0,
-                            eta = 1.0,
-                            denoise_strength = denoise_strength
-                        )
-                        controlnet_out = self.pil_to_tensor(controlnet_out).to(torch.float32).unsqueeze(0).cuda()
-                        self.controlnet_outs[batch['index'][idx]] = controlnet_out
+                missing = [idx for idx in range(len(images)) if self.controlnet_outs[batch['index'][idx]] is None]
+                if len(missing) > 0:
+                    repaired = self.repair_views(
+                        [images[idx] for idx in missing],
+                        [batch['txt'][idx] for idx in missing],
+                        [self.cfg.max_strength] * len(missing),
+                        num_samples = 1
+                    )
+                    for idx, (controlnet_samples, sds_w) in zip(missing, repaired):
+                        self.controlnet_outs[batch['index'][idx]] = self.pil_to_tensor(controlnet_samples[0]).to(torch.float32).unsqueeze(0).cuda()
                         self.sds_ws[batch['index'][idx]] = sds_w
-                    controlnet_outs.append(controlnet_out)
-                    sds_ws.append(sds_w)
+                for idx in range(len(images)):
+                    controlnet_outs.append(self.controlnet_outs[batch['index'][idx]])
+                    sds_ws.append(self.sds_ws[batch['index'][idx]])
             else:
-                for idx, image in enumerate(images):
-                    image_np = np.array(self.tensor_to_pil(image))
-                    denoise_strength = random.random() * (self.cfg.max_strength - self.cfg.min_strength) + self.cfg.min_strength
-                    controlnet_samples, sds_w = process(
-                        self.controlnet,
-                        self.ddim_sampler,
-                        image_np,
-                        prompt = batch['txt'][idx],
-                        a_prompt = 'best quality',
-                        n_prompt = 'blur, lowres, bad anatomy, bad hands, cropped, worst quality',
-                        num_samples = self.cfg.controlnet_num_samples,
-                        image_resolution = min(image_np.shape[0], image_np.shape[1]),
-                        ddim_steps = 50,
-                        guess_mode = False,
-                        strength = 1.0,
-                        scale = 1.0,
-                        eta = 1.0,
-                        denoise_strength = denoise_strength
-                    )
-                    best_controlnet_out = controlnet_samples[0]
-                    best_controlnet_out_score = 0.
-                    for controlnet_out in controlnet_samples:
-                        with torch.no_grad():
-                            image_features = self.clip_model.encode_image(self.clip_preprocess(Image.fromarray(controlnet_out)).unsqueeze(0).to(self.device))
-                        score = min([torch.cosine_similarity(image_features, gt_features, dim=-1).mean() for gt_features in self.gt_features_all])
-                        if score > best_controlnet_out_score:
-                            best_controlnet_out = controlnet_out
-                            best_controlnet_out_score = score
+                denoise_strengths = [random.random() * (self.cfg.max_strength - self.cfg.min_strength) + self.cfg.min_strength for _ in images]
+                repaired = self.repair_views(images, list(batch['txt'][:len(images)]), denoise_strengths, self.cfg.controlnet_num_samples)
+                for controlnet_samples, sds_w in repaired:
+                    best_controlnet_out = self.best_controlnet_out(controlnet_samples, reduce=min)
                     controlnet_outs.append(self.pil_to_tensor(best_controlnet_out).to(torch.float32).unsqueeze(0).cuda())
                     sds_ws.append(sds_w)
                 if self.global_step % self.cfg.refresh_interval == 0 and self.global_step != self.cfg.around_gt_steps:
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+import threestudio
+from threestudio.utils.typing import *
+
+
+class OffloadManager:
+    """
+    Keeps frozen modules in pinned host memory and moves each of them onto the device when it is
+    called, evicting the least recently used ones once the modules on the device would exceed
+    budget_bytes. prefetch() starts the copy of the module needed next on a side stream, so that
+    it overlaps with the computation of the current one.
+
+    Registered modules are treated as read only: evicting a module drops its device weights and
+    the host copy is the one loaded again, so register them once their weights are final.
+    """
+
+    def __init__(self, device: Union[str, torch.device], budget_bytes: int):
+        self.device = torch.device(device)
+        self.budget_bytes = budget_bytes
+        self.cuda = self.device.type == "cuda"
+        self.stream = torch.cuda.Stream(self.device) if self.cuda else None
+        self.modules: Dict[str, Dict[str, Any]] = {}
+        self.resident: "OrderedDict[str, None]" = OrderedDict() # least recently used first
+        self.pending: Dict[str, Any] = {} # prefetched modules -> copy done event
+        self.current: Optional[str] = None # the module loaded last, i.e. in use
+        self.loads = 0
+        self.prefetches = 0
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(self.modules[name]["bytes"] for name in self.resident)
+
+    def register(self, name: str, modules: Union[nn.Module, List[nn.Module]], children: bool = True):
+        """
+        Move modules, loaded and evicted together under `name`, to host memory and load them back
+        whenever one of them, or one of their direct children when children is set (e.g. the
+        encoder of a VAE called through its encode method), is called.
+        """
+        modules = [modules] if isinstance(modules, nn.Module) else modules
+        slots = []
+        for submodule in (submodule for module in modules for submodule in module.modules()):
+            for key, param in submodule._parameters.items():
+                if param is not None:
+                    slots.append((submodule._parameters, key, True))
+            for key, buffer in submodule._buffers.items():
+                if buffer is not None:
+                    slots.append((submodule._buffers, key, False))
+        hosts = []
+        for tensors, key, is_param in slots:
+            host = tensors[key].detach().to("cpu")
+            hosts.append(host.pin_memory() if self.cuda else host)
+        self.modules[name] = dict(
+            slots=slots,
+            hosts=hosts,
+            bytes=sum(host.numel() * host.element_size() for host in hosts),
+        )
+        self._assign(name, hosts)
+        hook = lambda *args: self.load(name)
+        for module in modules:
+            module.register_forward_pre_hook(hook)
+            if children:
+                for child in module.children():
+                    child.register_forward_pre_hook(hook)
+
+    def _assign(self, name: str, tensors: List[Tensor]):
+        for (container, key, is_param), tensor in zip(self.modules[name]["slots"], tensors):
+            if is_param:
+                container[key].data = tensor
+            else:
+                container[key] = tensor
+
+    def _copy(self, name: str) -> List[Tensor]:
+        return [host.to(self.device, non_blocking=True) for host in self.modules[name]["hosts"]]
+
+    def _make_room(self, nbytes: int, keep: Tuple[str, ...]) -> bool:
+        """
+        Evict least recently used modules not in keep until nbytes more fit in the budget; evicts
+        nothing and returns False if they would not fit even with keep alone resident.
+        """
+        kept_bytes = sum(self.modules[name]["bytes"] for name in self.resident if name in keep)
+        if kept_bytes + nbytes > self.budget_bytes:
+            return False
+        for name in list(self.resident):
+            if self.resident_bytes + nbytes <= self.budget_bytes:
+                break
+            if name not in keep:
+                self.offload(name)
+        return self.resident_bytes + nbytes <= self.budget_bytes
+
+    def load(self, name: str):
+        """ Make module `name` resident on the device, as the most recently used one """
+        self.current = name
+        if name in self.resident:
+            self.resident.move_to_end(name)
+            if name in self.pending:
+                torch.cuda.current_stream(self.device).wait_event(self.pending.pop(name))
+            return
+        if not self._make_room(self.modules[name]["bytes"], keep=(name,)):
+            threestudio.warn(f"offloaded module {name} alone exceeds the device memory budget, loading it anyway")
+            for other in list(self.resident):
+                self.offload(other)
+        self._assign(name, self._copy(name))
+        self.resident[name] = None
+        self.loads += 1
+
+    def prefetch(self, name: str):
+        """ Start loading module `name` on the side stream, if it fits next to the module in use """
+        if name in self.resident or not self.cuda:
+            return
+        if not self._make_room(self.modules[name]["bytes"], keep=(self.current,)):
+            return
+        # the copy does not wait for the work already queued on the compute stream, so that it
+        # overlaps with it; load() makes the compute stream wait for the copy before it is used
+        compute_stream = torch.cuda.current_stream(self.device)
+        with torch.cuda.stream(self.stream):
+            tensors = self._copy(name)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        for tensor in tensors:
+            tensor.record_stream(compute_stream)
+        self._assign(name, tensors)
+        self.resident[name] = None
+        self.pending[name] = event
+        self.prefetches += 1
+
+    def offload(self, name: str):
+        """ Drop the device copy of module `name` """
+        if name not in self.resident:
+            return
+        event = self.pending.pop(name, None)
+        if event is not None:
+            torch.cuda.current_stream(self.device).wait_event(event)
+        self._assign(name, self.modules[name]["hosts"])
+        del self.resident[name]
+
+    def state(self) -> Dict[str, float]:
+        return {
+            "resident_gb": self.resident_bytes / 2 ** 30,
+            "loads": float(self.loads),
+            "prefetches": float(self.prefetches),
+        }
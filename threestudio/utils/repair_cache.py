@@ -0,0 +1,88 @@
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+from threestudio.utils.typing import *
+
+
+class RepairCache:
+    """
+    Disk-backed, content-addressed cache of ControlNet repaired views.
+
+    An entry holds the samples and the sds weight produced for one rendered view; it is keyed by
+    the rendered image, the prompt, the denoise strength, the number of samples and a `context`
+    identifying everything else the result depends on (LoRA checkpoint, sampler settings, seed).
+    Entries are written atomically, so concurrent runs and dataloader workers can share the
+    directory. The least recently used entries are evicted once the cache exceeds max_bytes.
+    """
+
+    SUFFIX = ".npz"
+
+    def __init__(self, cache_dir: str, max_bytes: int, context: Tuple = ()):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.context = repr(context).encode("utf-8")
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue # evicted by another process
+            entries.append((entry.path, stat.st_mtime_ns, stat.st_size))
+        return entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def key(self, image: np.ndarray, prompt: str, denoise_strength: float, num_samples: int) -> str:
+        h = hashlib.sha1(self.context)
+        h.update(repr((image.shape, str(image.dtype), prompt, float(denoise_strength), num_samples)).encode("utf-8"))
+        h.update(np.ascontiguousarray(image).tobytes())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[List[np.ndarray], np.ndarray]]:
+        """ (samples, sds_w) stored under key, or None """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                samples, sds_w = list(data["samples"]), data["sds_w"]
+            os.utime(path) # the mtime is the LRU clock
+        except (OSError, ValueError, KeyError):
+            # missing, evicted meanwhile or truncated entry
+            self.misses += 1
+            return None
+        self.hits += 1
+        return samples, sds_w
+
+    def put(self, key: str, samples: List[np.ndarray], sds_w: np.ndarray):
+        path = self._path(key)
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.savez(f, samples=np.stack(samples, axis=0), sds_w=sds_w)
+        self._size += os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        # other processes write to the same directory, so the size is recounted from disk
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
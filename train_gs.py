@@ -13,6 +13,7 @@ import os
 import sys
 import uuid
 import json
+from functools import partial
 from argparse import ArgumentParser, Namespace
 from random import randint
 from typing import Optional
@@ -23,11 +24,11 @@ import torch.nn.functional as F
 from tqdm import tqdm
 from torchmetrics.functional.regression import pearson_corrcoef
 from arguments import ModelParams, OptimizationParams, PipelineParams
-from gaussian_renderer import network_gui
+from gaussian_renderer import network_gui, render_batch
 from scene import GaussianModel, Scene
 from utils.general_utils import safe_state
 from utils.image_utils import psnr
-from utils.loss_utils import l1_loss, ssim, monodisp
+from utils.loss_utils import l1_loss, l1_dssim_loss, monodisp
 from utils.pose_utils import update_pose, get_loss_tracking
 from torch.utils.tensorboard.writer import SummaryWriter
 TENSORBOARD_FOUND = True
@@ -128,10 +129,10 @@ def training(args, dataset, opt, pipe, testing_iterations, saving_iterations, ch
                 progress_bar.close()
 
             # Log and save
-            training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, render, (pipe, background))
+            training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, partial(render_batch, with_pose=args.use_dust3r), (pipe, background))
             if (iteration in saving_iterations):
                 print("\n[ITER {}] Saving Gaussians".format(iteration))
-                scene.save(iteration)
+                scene.save(iteration, columnar=args.save_columnar)
 
             # Densification
             if iteration < opt.densify_until_iter and num_gauss < opt.max_num_splats:
@@ -201,6 +202,9 @@ def prepare_output_and_logger(args):
         print("Tensorboard not available: not logging progress")
     return tb_writer
 
+# number of views rendered per render_batch call in training_report
+REPORT_BATCH_SIZE = 8
+
 def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_iterations, scene : Scene, renderFunc, renderArgs):
     if tb_writer:
         tb_writer.add_scalar('train_loss_patches/l1_loss', Ll1.item(), iteration)
@@ -218,15 +222,18 @@ def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_i
             if config['cameras'] and len(config['cameras']) > 0:
                 l1_test = 0.0
                 psnr_test = 0.0
-                for idx, viewpoint in enumerate(config['cameras']):
-                    image = torch.clamp(renderFunc(viewpoint, scene.gaussians, *renderArgs)["render"], 0.0, 1.0)
-                    gt_image = torch.clamp(viewpoint.original_image.to("cuda"), 0.0, 1.0)
-                    if tb_writer and (idx < 5):
-                        tb_writer.add_images(config['name'] + "_view_{}/render".format(viewpoint.image_name), image[None], global_step=iteration)
-                        if iteration == testing_iterations[0]:
-                            tb_writer.add_images(config['name'] + "_view_{}/ground_truth".format(viewpoint.image_name), gt_image[None], global_step=iteration)
-                    l1_test += l1_loss(image, gt_image).mean().double()
-                    psnr_test += psnr(image, gt_image).mean().double()
+                for start in range(0, len(config['cameras']), REPORT_BATCH_SIZE):
+                    viewpoints = config['cameras'][start:start + REPORT_BATCH_SIZE]
+                    images = renderFunc(viewpoints, scene.gaussians, *renderArgs)["render"]
+                    for idx, (viewpoint, image) in enumerate(zip(viewpoints, images), start):
+                        image = torch.clamp(image, 0.0, 1.0)
+                        gt_image = torch.clamp(viewpoint.original_image.to("cuda"), 0.0, 1.0)
+                        if tb_writer and (idx < 5):
+                            tb_writer.add_images(config['name'] + "_view_{}/render".format(viewpoint.image_name), image[None], global_step=iteration)
+                            if iteration == testing_iterations[0]:
+                                tb_writer.add_images(config['name'] + "_view_{}/ground_truth".format(viewpoint.image_name), gt_image[None], global_step=iteration)
+                        l1_test += l1_loss(image, gt_image).mean().double()
+                        psnr_test += psnr(image, gt_image).mean().double()
                 psnr_test /= len(config['cameras'])
                 l1_test /= len(config['cameras'])
                 print("\n[ITER {}] Evaluating {}: L1 {} PSNR {}".format(iteration, config['name'], l1_test, psnr_test))
@@ -248,9 +255,7 @@ def cal_loss(opt, args, image, render_pkg, viewpoint_cam, bg, silhouette_loss_ty
     gt_image = viewpoint_cam.original_image.to(image.dtype).cuda()
     if opt.random_background:
         gt_image = gt_image * viewpoint_cam.mask + bg[:, None, None] * (1 - viewpoint_cam.mask).squeeze()
-    Ll1 = l1_loss(image, gt_image)
-    Lssim = (1.0 - ssim(image, gt_image))
-    loss = (1.0 - opt.lambda_dssim) * Ll1 + opt.lambda_dssim * Lssim
+    loss, Ll1, Lssim = l1_dssim_loss(image, gt_image, opt.lambda_dssim)
     if tb_writer is not None:
         tb_writer.add_scalar('loss/l1_loss', Ll1, iteration)
         tb_writer.add_scalar('loss/ssim_loss', Lssim, iteration)
@@ -324,6 +329,8 @@ if __name__ == "__main__":
     parser.add_argument("--quiet", action="store_true")
     parser.add_argument("--checkpoint_iterations", nargs="+", type=int, default=[])
     parser.add_argument("--start_checkpoint", type=str, default = None)
+    parser.add_argument("--save_columnar", action="store_true",
+                        help="Also save a memory-mapped columnar checkpoint (point_cloud.gsc) next to each point_cloud.ply")
     ### some exp args
     parser.add_argument("--sparse_view_num", type=int, default=-1,
                         help="Use sparse view or dense view, if sparse_view_num > 0, use sparse view, \
@@ -45,10 +45,11 @@ if __name__ == '__main__':
     parser.add_argument('--add_control_lora', action='store_true', default=False)
     parser.add_argument('--add_clip_lora', action='store_true', default=False)
     parser.add_argument('--use_dust3r', action='store_true', default=False)
+    parser.add_argument('--attn_backend', type=str, default=None, help='auto, sdpa, xformers, sliced or naive; defaults to $ATTN_BACKEND')
 
     args = parser.parse_args()
 
-    model = create_model(f'./models/{args.model_name}.yaml').cpu()
+    model = create_model(f'./models/{args.model_name}.yaml', attn_backend=args.attn_backend).cpu()
     model.load_state_dict(load_state_dict('./models/v1-5-pruned.ckpt', location='cpu'), strict=False)
     model.load_state_dict(load_state_dict(f'./models/{args.model_name}.pth', location='cpu'), strict=False)
     model.learning_rate = args.learning_rate
@@ -78,6 +79,8 @@ if __name__ == '__main__':
                 add_lora(module, lora_config=lora_config)
     if args.add_clip_lora:
         add_lora(model.cond_stage_model, lora_config=lora_config)
+        # prompt embeddings memoized before this point were computed without the CLIP LoRA
+        model.invalidate_conditioning_cache()
 
     exp_path = os.path.join('./output', args.exp_name)
     dataset = GSCacheDataset(
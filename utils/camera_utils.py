@@ -10,14 +10,16 @@
 # GRAPHDECO research group, https://team.inria.fr/graphdeco
 import os
 import math
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from scene.cameras import Camera, Camera_w_pose
 import numpy as np
 from utils.general_utils import PILtoTorch
 from utils.graphics_utils import fov2focal
-from utils.sp_tqdm import tqdm
 import torch
-from torch.multiprocessing import Pool
 import cv2
+from PIL import Image
 from typing import NamedTuple, Optional, List, Tuple
 from scipy.special import softmax
 from utils.graphics_utils import getWorld2View2
@@ -66,7 +68,14 @@ def loadCam(args,
         scale = float(global_down) * float(resolution_scale)
         resolution = (int(orig_w / scale), int(orig_h / scale))
 
-    resized_image_rgb = PILtoTorch(cam_info.image, resolution)
+    cache_dir = getattr(args, "image_cache_dir", "")
+    if cache_dir and isinstance(cam_info.image, Image.Image):
+        # the cached array already has the target resolution, PILtoTorch only converts it
+        resized_image = cached_array(cache_dir, "image", cam_info.image_path, resolution,
+                                     lambda: np.array(cam_info.image.resize(resolution) if cam_info.image.size != resolution else cam_info.image))
+        resized_image_rgb = PILtoTorch(resized_image, resolution)
+    else:
+        resized_image_rgb = PILtoTorch(cam_info.image, resolution)
 
     gt_image = resized_image_rgb[:3, ...]
 
@@ -89,8 +98,8 @@ def loadCam(args,
     elif mode == 'train':
         mono_depth_path_png = os.path.join(os.path.dirname(os.path.dirname(cam_info.image_path)), "zoe_depth",cam_info.image_name+'.png')
         if os.path.exists(mono_depth_path_png):
-            loaded_depth = load_raw_depth(mono_depth_path_png)
-            resized_depth = cv2.resize(loaded_depth, resolution, interpolation=cv2.INTER_NEAREST)
+            resized_depth = cached_array(cache_dir, "depth", mono_depth_path_png, resolution,
+                                         lambda: cv2.resize(load_raw_depth(mono_depth_path_png), resolution, interpolation=cv2.INTER_NEAREST))
             mono_depth = torch.from_numpy(resized_depth).unsqueeze(0)
 
     confidence = None
@@ -142,34 +151,42 @@ def camera_to_JSON(id, camera : Camera):
     }
     return camera_entry
 
-#######
-# Original loader is slow, we use parallel loader instead
-
-# a wrapper for the loadCam function that is used in the parallel loader
-
-def _parallel_loader_loadCam(args):
-    torch.set_num_threads(1)
-    return loadCam(**args)
-
-# a wrapper for the cameraList_from_camInfos function that is used in the parallel loader
-def cameraList_from_camInfos_parallel_warpper(cam_infos, resolution_scale, args):
-    num_threads = 4
-    fn = _parallel_loader_loadCam
-    p = Pool(min(num_threads, len(cam_infos)))
-
-    camera_list = []
-    iterator = p.imap(fn, [{"args": args, 
-                            "id":i, 
-                            "cam_info": cam_infos[i], 
-                            'resolution_scale': resolution_scale
-                            } for i in range(len(cam_infos))])
-
-    for _ in tqdm(range(len(cam_infos)), desc='loading images ...'):
-        out = next(iterator)
-        if out is not None:
-            camera_list.append(out)
+def cameraLists_from_camInfos_parallel(split_cam_infos, resolution_scale, args, num_workers=8):
+    """
+    Load the cameras of several splits with one thread pool, so that the splits are also loaded
+    concurrently. Decoding and resizing (PIL, cv2) release the GIL, and threads avoid pickling
+    the CameraInfos to worker processes.
+    split_cam_infos: {name: (cam_infos, mode)}. Returns {name: camera list}, in input order.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = {name: [executor.submit(loadCam, args, id, c, resolution_scale, mode) for id, c in enumerate(cam_infos)]
+                   for name, (cam_infos, mode) in split_cam_infos.items()}
+        return {name: [future.result() for future in split_futures] for name, split_futures in futures.items()}
 
-    return camera_list
+def cached_array(cache_dir, kind, source_path, resolution, load_fn):
+    """
+    Return load_fn(), the `kind` array derived from source_path at the given resolution, from an
+    on-disk cache. Entries are keyed by the source path, its mtime and size and the resolution, so
+    an edited source is decoded again. Without cache_dir this is just load_fn().
+    """
+    if not cache_dir or not source_path or not os.path.exists(source_path):
+        return load_fn()
+    stat = os.stat(source_path)
+    key = "{}|{}|{}|{}|{}".format(kind, os.path.abspath(source_path), stat.st_mtime_ns, stat.st_size, tuple(resolution))
+    cache_path = os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".npy")
+    if os.path.exists(cache_path):
+        try:
+            return np.load(cache_path)
+        except (OSError, ValueError):
+            pass # truncated or corrupted entry, rebuild it
+    array = load_fn()
+    os.makedirs(cache_dir, exist_ok=True)
+    # concurrent runs may build the same entry, the rename keeps readers from seeing partial files
+    tmp_path = "{}.{}.{}.tmp".format(cache_path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, cache_path)
+    return array
 
 
 def resize_mask_image(mask, resolution):
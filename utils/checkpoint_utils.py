@@ -0,0 +1,79 @@
+import json
+import struct
+import numpy as np
+
+# Columnar Gaussian checkpoint (.gsc):
+#   8-byte magic | uint64 header size | JSON header | attribute blocks
+# The JSON header stores, for every attribute, its shape, dtype and offset relative to the
+# start of the data section. Blocks are aligned so that each one can be memory-mapped on its own.
+COLUMNAR_MAGIC = b'GSCOL\x00\x01\x00'
+COLUMNAR_EXTENSION = '.gsc'
+_ALIGNMENT = 64
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def is_columnar_checkpoint(path):
+    with open(path, 'rb') as f:
+        return f.read(len(COLUMNAR_MAGIC)) == COLUMNAR_MAGIC
+
+def write_columnar_checkpoint(path, attributes, meta=None):
+    """
+    Write a dict of per-point float32 arrays as a columnar checkpoint.
+    meta: optional JSON-serializable dict stored in the header (e.g. the SH degree).
+    """
+    arrays, entries, offset = {}, {}, 0
+    for name, array in attributes.items():
+        arrays[name] = np.ascontiguousarray(array, dtype='<f4')
+        entries[name] = {'offset': offset, 'shape': list(arrays[name].shape), 'dtype': '<f4'}
+        offset = _align(offset + arrays[name].nbytes)
+    header = json.dumps({'attributes': entries, 'meta': meta or {}}).encode('utf-8')
+    data_start = _align(len(COLUMNAR_MAGIC) + 8 + len(header))
+
+    with open(path, 'wb') as f:
+        f.write(COLUMNAR_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.write(b'\x00' * (data_start + entries[name]['offset'] - f.tell()))
+            array.tofile(f)
+
+class ColumnarCheckpoint:
+    """
+    Read-only view of a columnar checkpoint. Only the header is parsed on construction;
+    every attribute is memory-mapped the first time it is accessed, so a consumer that
+    only reads 'xyz' never touches the SH payload.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic = f.read(len(COLUMNAR_MAGIC))
+            assert magic == COLUMNAR_MAGIC, "{} is not a columnar Gaussian checkpoint".format(path)
+            header_size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        self._data_start = _align(len(COLUMNAR_MAGIC) + 8 + header_size)
+        self._entries = header['attributes']
+        self.meta = header['meta']
+        self._arrays = {}
+
+    def keys(self):
+        return self._entries.keys()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __getitem__(self, name):
+        if name not in self._arrays:
+            entry = self._entries[name]
+            shape = tuple(entry['shape'])
+            if np.prod(shape) == 0:
+                self._arrays[name] = np.empty(shape, dtype=entry['dtype'])
+            else:
+                self._arrays[name] = np.memmap(self.path, dtype=entry['dtype'], mode='r',
+                                               offset=self._data_start + entry['offset'], shape=shape)
+        return self._arrays[name]
+
+    @property
+    def num_points(self):
+        return next(iter(self._entries.values()))['shape'][0] if self._entries else 0
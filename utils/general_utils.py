@@ -72,6 +72,20 @@ def get_expon_lr_func(
 
     return helper
 
+def gather_extend_rows(tensor, keep_idx, extension):
+    """
+    Equivalent to torch.cat((tensor[keep_idx], extension)) with a single allocation of the output.
+    extension: tensor of rows to append, or a number of zero rows.
+    """
+    num_extension = extension if isinstance(extension, int) else extension.shape[0]
+    out = tensor.new_empty((keep_idx.shape[0] + num_extension,) + tuple(tensor.shape[1:]))
+    torch.index_select(tensor, 0, keep_idx, out=out[:keep_idx.shape[0]])
+    if isinstance(extension, int):
+        out[keep_idx.shape[0]:] = 0
+    else:
+        out[keep_idx.shape[0]:] = extension
+    return out
+
 def strip_lowerdiag(L):
     uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
 
@@ -0,0 +1,48 @@
+import time
+import torch.multiprocessing as mp
+
+# data shared by all the jobs of run_jobs, set once per worker process
+_shared_data = None
+
+def shared_data():
+    """ The `shared` object passed to run_jobs, as seen by the running job """
+    return _shared_data
+
+def _init_worker(shared):
+    global _shared_data
+    _shared_data = shared
+
+def _timed_job(job_fn, name, job_args):
+    start = time.time()
+    result = job_fn(*job_args)
+    return name, time.time() - start, result
+
+def run_jobs(job_fn, jobs, num_workers=1, shared=None):
+    """
+    Run job_fn(*job_args) for every (name, job_args) in jobs, in up to num_workers spawned worker
+    processes, or one after another in this process if num_workers <= 1.
+
+    shared: object handed once to every worker (see shared_data()). It is sent through
+    torch.multiprocessing, so its tensors are shared (CUDA tensors through IPC handles) instead of
+    copied; jobs must treat it as read-only. job_fn and its arguments must be picklable.
+    Prints the wall time of every job and of the whole run, and returns {name: result}.
+    """
+    start = time.time()
+    results = {}
+    if num_workers <= 1 or len(jobs) <= 1:
+        _init_worker(shared)
+        timed = (_timed_job(job_fn, name, job_args) for name, job_args in jobs)
+        for name, elapsed, result in timed:
+            print("[{}] finished in {:.1f}s".format(name, elapsed))
+            results[name] = result
+    else:
+        # CUDA cannot be re-initialized in forked processes
+        context = mp.get_context("spawn")
+        with context.Pool(min(num_workers, len(jobs)), initializer=_init_worker, initargs=(shared,)) as pool:
+            pending = [pool.apply_async(_timed_job, (job_fn, name, job_args)) for name, job_args in jobs]
+            for job in pending:
+                name, elapsed, result = job.get()
+                print("[{}] finished in {:.1f}s".format(name, elapsed))
+                results[name] = result
+    print("{} jobs finished in {:.1f}s with {} worker(s)".format(len(jobs), time.time() - start, max(1, min(num_workers, len(jobs)))))
+    return results
@@ -0,0 +1,182 @@
+import itertools
+import torch
+
+
+class VoxelGridKNN:
+    """
+    Exact k-nearest-neighbour search accelerated by a uniform voxel grid.
+
+    Points are sorted by voxel key. The queries of a voxel share one candidate set, the points of
+    the 27 voxels around it, so a batch of voxels costs one [B, Q, C] distance block, where Q is
+    the largest voxel and C the largest neighbourhood of the batch; voxels are batched by
+    neighbourhood size to keep the padding small, and a batch holds at most max_candidates
+    distances. The candidates of a query include every point closer than the distance from the
+    query to the border of its 27-voxel block; queries whose K-th distance reaches beyond it
+    (e.g. isolated floaters) are searched again against the whole cloud, so results are exact.
+    Works on CPU and CUDA tensors.
+    """
+
+    def __init__(self, points, K, voxel_size=None, max_candidates=2 ** 23):
+        self.points = points
+        self.K = K
+        self.max_candidates = max_candidates
+        self.origin = points.min(dim=0).values
+        self.voxel_size = voxel_size if voxel_size is not None else self._estimate_voxel_size(K)
+        self._build()
+
+    def _voxelize(self, voxel_size):
+        coords = ((self.points - self.origin) / voxel_size).floor().long()
+        dims = coords.max(dim=0).values + 1
+        keys = (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+        return coords, dims, keys
+
+    def _estimate_voxel_size(self, K, num_iters=3):
+        # aim for ~K/4 points per occupied voxel: fewer candidates per query, at the price of
+        # more queries whose K-th neighbour lies beyond their 27-voxel block and need the fallback
+        target = max(K / 4, 1)
+        extent = (self.points.max(dim=0).values - self.origin).clamp_min(1e-6)
+        voxel_size = float((extent.prod() * target / self.points.shape[0]) ** (1 / 3))
+        for _ in range(num_iters):
+            _, _, keys = self._voxelize(voxel_size)
+            mean_count = self.points.shape[0] / torch.unique(keys).shape[0]
+            # occupancy grows between quadratically (surfaces) and cubically (volumes) with the voxel size
+            voxel_size *= (target / mean_count) ** (1 / 2.5)
+        return voxel_size
+
+    def _build(self):
+        self.coords, self.dims, keys = self._voxelize(self.voxel_size)
+        self.order = torch.argsort(keys)
+        self.voxel_keys, self.voxel_counts = torch.unique_consecutive(keys[self.order], return_counts=True)
+        self.voxel_starts = torch.cumsum(self.voxel_counts, dim=0) - self.voxel_counts
+        voxel_coords = self.coords[self.order[self.voxel_starts]]                                  # [V, 3]
+
+        # the (up to) 27 occupied voxels around each occupied voxel
+        offsets = torch.tensor(list(itertools.product((-1, 0, 1), repeat=3)), device=voxel_coords.device)
+        neighbor_coords = voxel_coords[:, None, :] + offsets[None]                                # [V, 27, 3]
+        in_bounds = ((neighbor_coords >= 0) & (neighbor_coords < self.dims)).all(dim=-1)
+        neighbor_coords = torch.minimum(neighbor_coords.clamp_min(0), self.dims - 1)
+        neighbor_keys = (neighbor_coords[..., 0] * self.dims[1] + neighbor_coords[..., 1]) * self.dims[2] + neighbor_coords[..., 2]
+        neighbors = torch.searchsorted(self.voxel_keys, neighbor_keys).clamp_max(self.voxel_keys.shape[0] - 1)
+        found = in_bounds & (self.voxel_keys[neighbors] == neighbor_keys)
+        self.neighbor_starts = self.voxel_starts[neighbors]
+        self.neighbor_counts = torch.where(found, self.voxel_counts[neighbors], 0)
+        self.candidate_counts = self.neighbor_counts.sum(dim=1)
+
+    def _search_radius(self, index):
+        """ Squared distance from points[index] to the border of their 27-voxel block; the grid border is open """
+        coords = self.coords[index]
+        fractions = (self.points[index] - self.origin) / self.voxel_size - coords
+        lower = torch.where(coords > 0, fractions + 1, float('inf'))
+        upper = torch.where(coords < self.dims - 1, 2 - fractions, float('inf'))
+        return (torch.minimum(lower, upper).min(dim=1).values * self.voxel_size) ** 2
+
+    def _query_voxels(self, voxels):
+        """ Squared distances from the points of `voxels` to their K nearest candidates; returns (index [n], dists [n, K]) """
+        num_queries = int(self.voxel_counts[voxels].max())
+        num_candidates = max(int(self.candidate_counts[voxels].max()), self.K)
+        device = self.points.device
+
+        slots = torch.arange(num_queries, device=device)
+        query_valid = slots < self.voxel_counts[voxels, None]                                     # [B, Q]
+        queries = self.order[(self.voxel_starts[voxels, None] + slots).clamp_max(self.points.shape[0] - 1)]
+
+        # candidate slot j of a voxel lies in the neighbour whose running count first exceeds j
+        counts = self.neighbor_counts[voxels]                                                     # [B, 27]
+        ends = torch.cumsum(counts, dim=1)
+        slots = torch.arange(num_candidates, device=device).expand(voxels.shape[0], -1).contiguous()
+        neighbor = torch.searchsorted(ends, slots, right=True).clamp_max(counts.shape[1] - 1)    # [B, C]
+        candidates = self.neighbor_starts[voxels].gather(1, neighbor) + slots - (ends - counts).gather(1, neighbor)
+        candidate_valid = slots < ends[:, -1:]
+        candidates = self.order[candidates.clamp(0, self.points.shape[0] - 1)]
+
+        # distances relative to the voxel, so that the matmul-based cdist stays accurate
+        center = self.points[queries[:, 0]][:, None, :]
+        dists = torch.cdist(self.points[queries] - center, self.points[candidates] - center).pow(2)  # [B, Q, C]
+        dists = dists.masked_fill(~candidate_valid[:, None, :], float('inf'))
+        dists = dists.topk(self.K, dim=2, largest=False).values
+        return queries[query_valid], dists[query_valid]
+
+    def chunks(self):
+        """ Yields (index, dists), the squared distances [n, K] from points[index] to their K nearest neighbours (itself included) """
+        # voxels by neighbourhood size, so that the candidates of a batch are padded to similar sizes
+        voxels = torch.argsort(self.candidate_counts)
+        candidate_counts = self.candidate_counts[voxels].clamp_min(self.K).tolist()
+        query_counts = self.voxel_counts[voxels].tolist()
+        start = 0
+        while start < len(voxels):
+            end, max_queries = start, 0
+            while end < len(voxels):
+                max_queries = max(max_queries, query_counts[end])
+                if end > start and (end + 1 - start) * max_queries * candidate_counts[end] > self.max_candidates:
+                    break
+                end += 1
+            index, dists = self._query_voxels(voxels[start:end])
+            start = end
+
+            inexact = dists[:, -1] > self._search_radius(index)
+            if inexact.any():
+                dists[inexact] = torch.cat([exact for _, exact in exact_knn_chunks(
+                    self.points, self.K, index[inexact], max_candidates=self.max_candidates)])
+            yield index, dists
+
+
+def exact_knn_chunks(points, K, index, chunk_size=8192, max_candidates=2 ** 23):
+    """
+    Yields (index chunk, squared distances [n, K] to the K nearest neighbours in points), for
+    chunks of up to chunk_size queries: with pytorch3d's knn_points if it is installed, else with
+    torch.cdist + topk, on chunks of at most max_candidates distances.
+    """
+    try:
+        import pytorch3d.ops as p3dops
+        query = lambda chunk: p3dops.knn_points(points[chunk][None], points[None], K=K).dists[0]
+    except ImportError:
+        chunk_size = max(1, min(chunk_size, max_candidates // points.shape[0]))
+        center = points.mean(dim=0)
+        query = lambda chunk: torch.cdist(points[chunk] - center, points - center).pow(2).topk(K, dim=1, largest=False).values
+    for start in range(0, index.shape[0], chunk_size):
+        chunk = index[start:start + chunk_size]
+        yield chunk, query(chunk)
+
+@torch.no_grad()
+def knn_distance_statistics(points, K, backend="voxel", chunk_size=8192, sample_size=0, max_candidates=2 ** 23):
+    """
+    Mean squared distance of every point to its K nearest neighbours (itself included, as with
+    pytorch3d.ops.knn_points), plus the mean and std of all N*K squared distances.
+
+    backend: "voxel" for the VoxelGridKNN index, "pytorch3d" for the chunked brute force search
+    (with pytorch3d's knn_points, or torch.cdist + topk when pytorch3d is not installed); both are exact.
+    sample_size: if > 0, the global mean and std are estimated from the distances of that many
+    randomly chosen points instead of being accumulated over the whole cloud.
+    max_candidates: bound on the number of distances evaluated at once; knn_points keeps its own
+    bound of chunk_size queries.
+    Returns (per_point_mean [N], global_mean, global_std).
+    """
+    num_points = points.shape[0]
+    K = min(K, num_points)
+    if backend == "voxel":
+        chunks = VoxelGridKNN(points, K, max_candidates=max_candidates).chunks()
+    elif backend == "pytorch3d":
+        chunks = exact_knn_chunks(points, K, torch.arange(num_points, device=points.device), chunk_size, max_candidates)
+    else:
+        raise ValueError(f"unknown kNN backend {backend}, expected 'voxel' or 'pytorch3d'")
+
+    per_point_mean = torch.empty(num_points, device=points.device)
+    stats_mask = None
+    if 0 < sample_size < num_points:
+        stats_mask = torch.zeros(num_points, dtype=torch.bool, device=points.device)
+        stats_mask[torch.randperm(num_points, device=points.device)[:sample_size]] = True
+    total = torch.zeros((), dtype=torch.float64, device=points.device)
+    total_sq = torch.zeros((), dtype=torch.float64, device=points.device)
+    count = 0
+    for index, dists in chunks:
+        per_point_mean[index] = dists.mean(dim=-1)
+        if stats_mask is not None:
+            dists = dists[stats_mask[index]]
+        dists = dists.double()
+        total += dists.sum()
+        total_sq += (dists ** 2).sum()
+        count += dists.numel()
+
+    mean = total / count
+    std = ((total_sq - total ** 2 / count) / max(count - 1, 1)).clamp_min(0).sqrt()
+    return per_point_mean, mean.float(), std.float()
@@ -11,7 +11,6 @@
 
 import torch
 import torch.nn.functional as F
-from torch.autograd import Variable
 from typing import Optional
 from math import exp
 
@@ -31,41 +30,117 @@ def gaussian(window_size, sigma):
 def create_window(window_size, channel):
     _1D_window = gaussian(window_size, 1.5).unsqueeze(1)
     _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
-    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
+    window = _2D_window.expand(channel, 1, window_size, window_size).contiguous()
     return window
 
-def ssim(img1, img2, window_size=11, size_average=True):
-    channel = img1.size(-3)
-    window = create_window(window_size, channel)
+# (window_size, channel, dtype, device) -> horizontal [channel, 1, 1, K] and vertical [channel, 1, K, 1] windows
+_separable_windows = {}
 
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
+def separable_window(window_size, channel, dtype, device):
+    """ The 1D factors of create_window(window_size, channel), cached per channel count, dtype and device """
+    key = (window_size, channel, dtype, device)
+    if key not in _separable_windows:
+        _1D_window = gaussian(window_size, 1.5).to(device=device, dtype=dtype)
+        _separable_windows[key] = (_1D_window.view(1, 1, 1, window_size).expand(channel, 1, 1, window_size).contiguous(),
+                                   _1D_window.view(1, 1, window_size, 1).expand(channel, 1, window_size, 1).contiguous())
+    return _separable_windows[key]
 
-    return _ssim(img1, img2, window, window_size, channel, size_average)
+def _blur(maps, window_size, channel):
+    """ Gaussian filtering of the stacked maps, one horizontal and one vertical grouped 1D convolution """
+    window_h, window_v = separable_window(window_size, channel, maps.dtype, maps.device)
+    maps = F.conv2d(maps, window_h, padding=(0, window_size // 2), groups=channel)
+    return F.conv2d(maps, window_v, padding=(window_size // 2, 0), groups=channel)
 
-def _ssim(img1, img2, window, window_size, channel, size_average=True):
-    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
+def _ssim_terms(stats, channel):
+    """ Numerator and denominator factors of the SSIM map, from the filtered statistics of _ssim_stats """
+    mu1, mu2, img1_sq, img2_sq, img1_img2 = stats.split(channel, dim=-3)
 
     mu1_sq = mu1.pow(2)
     mu2_sq = mu2.pow(2)
     mu1_mu2 = mu1 * mu2
 
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    sigma1_sq = img1_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img1_img2 - mu1_mu2
 
     C1 = 0.01 ** 2
     C2 = 0.03 ** 2
 
-    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+    return mu1, mu2, 2 * mu1_mu2 + C1, 2 * sigma12 + C2, mu1_sq + mu2_sq + C1, sigma1_sq + sigma2_sq + C2
+
+def _ssim_stats(img1, img2, window_size, channel):
+    # the five local statistics are filtered together: the inputs are stacked along the channels
+    stats = torch.cat([img1, img2, img1 * img1, img2 * img2, img1 * img2], dim=-3)
+    return _blur(stats, window_size, 5 * channel)
+
+def ssim(img1, img2, window_size=11, size_average=True):
+    channel = img1.size(-3)
+    return _ssim(img1, img2, window_size, channel, size_average)
+
+def _ssim(img1, img2, window_size, channel, size_average=True):
+    _, _, luminance, structure, luminance_norm, structure_norm = _ssim_terms(_ssim_stats(img1, img2, window_size, channel), channel)
+    ssim_map = (luminance * structure) / (luminance_norm * structure_norm)
 
     if size_average:
         return ssim_map.mean()
     else:
         return ssim_map.mean(1).mean(1).mean(1)
 
+class _L1SSIM(torch.autograd.Function):
+    """
+    Mean L1 and mean SSIM of two images in one pass. The filtered statistics of the forward are kept
+    for the backward, which filters the gradients w.r.t. the statistics (the Gaussian filter is its
+    own adjoint) instead of replaying autograd through the five channel stack.
+    """
+
+    @staticmethod
+    def forward(ctx, img1, img2, window_size):
+        channel = img1.size(-3)
+        stats = _ssim_stats(img1, img2, window_size, channel)
+        _, _, luminance, structure, luminance_norm, structure_norm = _ssim_terms(stats, channel)
+        ctx.save_for_backward(img1, img2, stats)
+        ctx.window_size = window_size
+        return (img1 - img2).abs().mean(), ((luminance * structure) / (luminance_norm * structure_norm)).mean()
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad_l1, grad_ssim):
+        img1, img2, stats = ctx.saved_tensors
+        channel = img1.size(-3)
+        mu1, mu2, luminance, structure, luminance_norm, structure_norm = _ssim_terms(stats, channel)
+        # d mean(ssim_map) w.r.t. the factors of ssim_map = luminance * structure / (luminance_norm * structure_norm)
+        scale = grad_ssim / img1.numel() / (luminance_norm * structure_norm)
+        d_luminance, d_structure = structure * scale, luminance * scale
+        ssim_map_scale = luminance * structure * scale
+        d_luminance_norm, d_structure_norm = -ssim_map_scale / luminance_norm, -ssim_map_scale / structure_norm
+        # ... and w.r.t. the filtered statistics
+        d_mu1 = 2 * mu2 * (d_luminance - d_structure) + 2 * mu1 * (d_luminance_norm - d_structure_norm)
+        d_img1_img2 = 2 * d_structure
+        l1_sign = torch.sign(img1 - img2) * (grad_l1 / img1.numel())
+
+        grad_img1 = grad_img2 = None
+        if ctx.needs_input_grad[1]:
+            d_mu2 = 2 * mu1 * (d_luminance - d_structure) + 2 * mu2 * (d_luminance_norm - d_structure_norm)
+            d_mu1, d_mu2, d_img1_sq, d_img2_sq, d_img1_img2 = _blur(
+                torch.cat([d_mu1, d_mu2, d_structure_norm, d_structure_norm, d_img1_img2], dim=-3), ctx.window_size, 5 * channel).split(channel, dim=-3)
+            grad_img2 = d_mu2 + 2 * img2 * d_img2_sq + img1 * d_img1_img2 - l1_sign
+        else:
+            d_mu1, d_img1_sq, d_img1_img2 = _blur(
+                torch.cat([d_mu1, d_structure_norm, d_img1_img2], dim=-3), ctx.window_size, 3 * channel).split(channel, dim=-3)
+        if ctx.needs_input_grad[0]:
+            grad_img1 = d_mu1 + 2 * img1 * d_img1_sq + img2 * d_img1_img2 + l1_sign
+        return grad_img1, grad_img2, None
+
+def l1_dssim_loss(network_output, gt, lambda_dssim, window_size=11):
+    """
+    (1 - lambda_dssim) * L1 + lambda_dssim * (1 - SSIM), the photometric loss of the 3DGS training
+    scripts, fused: both terms share one pass over the images and the SSIM statistics are reused by
+    the backward. Returns the loss and its L1 and D-SSIM terms.
+    """
+    Ll1, ssim_value = _L1SSIM.apply(network_output, gt, window_size)
+    Lssim = 1.0 - ssim_value
+    return (1.0 - lambda_dssim) * Ll1 + lambda_dssim * Lssim, Ll1, Lssim
+
 def monodisp(gt_depth: torch.Tensor, dyn_depth: torch.Tensor, loss_type: str = "l1", weight_map: Optional[torch.Tensor] = None):
     t_d = torch.median(dyn_depth, dim=-1, keepdim=True).values
     s_d = torch.mean(torch.abs(dyn_depth - t_d), dim=-1, keepdim=True)
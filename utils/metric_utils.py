@@ -0,0 +1,66 @@
+import json
+import os
+
+import torch
+
+from utils.image_utils import psnr
+from utils.loss_utils import ssim
+
+
+class MetricAccumulator:
+    """
+    Streaming SSIM / PSNR / LPIPS of rendered views against their gt, kept on the device: the
+    per-view values are only read back by results(), and LPIPS runs on batches of up to
+    lpips_batch_size views of the same size. The values of a view are those render.py computed
+    with ssim(...).mean(), psnr(...).mean() and lpips_fn(...) on the [3, H, W] images.
+    """
+
+    def __init__(self, lpips_fn, lpips_batch_size=8):
+        self.lpips_fn = lpips_fn
+        self.lpips_batch_size = max(lpips_batch_size, 1)
+        self.names = []
+        self.ssims = []
+        self.psnrs = []
+        self.lpipss = []
+        self.pending = [] # (render, gt) waiting for LPIPS
+
+    @torch.no_grad()
+    def add(self, name, render, gt):
+        render, gt = render.detach(), gt.detach()
+        self.names.append(name)
+        self.ssims.append(ssim(render, gt).mean())
+        self.psnrs.append(psnr(render, gt).mean())
+        if len(self.pending) > 0 and self.pending[0][0].shape != render.shape:
+            self._flush()
+        self.pending.append((render, gt))
+        if len(self.pending) >= self.lpips_batch_size:
+            self._flush()
+
+    @torch.no_grad()
+    def _flush(self):
+        if len(self.pending) == 0:
+            return
+        renders, gts = (torch.stack(images) for images in zip(*self.pending))
+        self.lpipss.append(self.lpips_fn(renders, gts).flatten())
+        self.pending = []
+
+    def results(self):
+        """ ({metric: mean}, {metric: {view name: value}}), with a single device to host copy """
+        self._flush()
+        if len(self.names) == 0:
+            return {}, {}
+        values = torch.stack([torch.stack(self.ssims), torch.stack(self.psnrs), torch.cat(self.lpipss)]).tolist()
+        full, per_view = {}, {}
+        for metric, metric_values in zip(("SSIM", "PSNR", "LPIPS"), values):
+            full[metric] = sum(metric_values) / len(metric_values)
+            per_view[metric] = {name: value for name, value in zip(self.names, metric_values)}
+        return full, per_view
+
+    def dump(self, output_dir):
+        """ Write results.json and per_view.json into output_dir; returns the means """
+        full, per_view = self.results()
+        with open(os.path.join(output_dir, "results.json"), 'w') as fp:
+            json.dump(full, fp, indent=True)
+        with open(os.path.join(output_dir, "per_view.json"), 'w') as fp:
+            json.dump(per_view, fp, indent=True)
+        return full
@@ -0,0 +1,84 @@
+import numpy as np
+from plyfile import PlyData
+
+# Only float32 properties are handled by the fast path, which is what
+# GaussianModel.save_ply emits. Anything else goes through plyfile.
+_FLOAT32_TYPES = ('float', 'float32')
+
+def write_vertex_ply(path, attribute_names, attributes):
+    """
+    Write a binary little-endian PLY with a single float32 'vertex' element.
+
+    The output is byte-identical to
+    PlyData([PlyElement.describe(elements, 'vertex')]).write(path)
+    but the vertex block is written with one contiguous buffer write.
+    """
+    attributes = np.ascontiguousarray(attributes, dtype='<f4')
+    assert attributes.ndim == 2 and attributes.shape[1] == len(attribute_names)
+
+    lines = ['ply', 'format binary_little_endian 1.0', 'element vertex {}'.format(attributes.shape[0])]
+    lines.extend('property float {}'.format(name) for name in attribute_names)
+    lines.append('end_header')
+    with open(path, 'wb') as f:
+        f.write(('\n'.join(lines) + '\n').encode('ascii'))
+        attributes.tofile(f)
+
+def _parse_vertex_header(f):
+    """
+    Parse the header of a float32-only binary little-endian vertex PLY.
+    Returns (num_vertices, property_names, header_size), or None if the file has any other layout.
+    """
+    if f.readline().strip() != b'ply':
+        return None
+    num_vertices, names, num_elements = 0, [], 0
+    while True:
+        line = f.readline()
+        if not line:
+            return None
+        tokens = line.decode('ascii').split()
+        if not tokens or tokens[0] in ('comment', 'obj_info'):
+            continue
+        if tokens[0] == 'end_header':
+            break
+        if tokens[0] == 'format':
+            if tokens[1] != 'binary_little_endian':
+                return None
+        elif tokens[0] == 'element':
+            num_elements += 1
+            if tokens[1] != 'vertex' or num_elements > 1:
+                return None
+            num_vertices = int(tokens[2])
+        elif tokens[0] == 'property':
+            if tokens[1] not in _FLOAT32_TYPES:
+                return None
+            names.append(tokens[2])
+        else:
+            return None
+    return num_vertices, names, f.tell()
+
+def read_vertex_ply(path, mmap=True):
+    """
+    Read the 'vertex' element of a PLY as (property_names, [N, F] float32 array).
+
+    Files written by write_vertex_ply (or plyfile with float32 properties) are mapped
+    with a single np.memmap view of the vertex block; any other layout falls back to plyfile.
+    """
+    with open(path, 'rb') as f:
+        header = _parse_vertex_header(f)
+    if header is not None:
+        num_vertices, names, offset = header
+        if mmap and num_vertices > 0:
+            vertices = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(num_vertices, len(names)))
+        else:
+            vertices = np.fromfile(path, dtype='<f4', count=num_vertices * len(names), offset=offset)
+            vertices = vertices.reshape(num_vertices, len(names))
+        return names, vertices
+
+    vertex = PlyData.read(path).elements[0]
+    names = [p.name for p in vertex.properties]
+    vertices = np.stack([np.asarray(vertex[name], dtype=np.float32) for name in names], axis=1)
+    return names, vertices
+
+def sorted_attribute_names(names, prefix):
+    """ Names starting with prefix, sorted by their trailing index (e.g. f_rest_0, f_rest_1, ...) """
+    return sorted([name for name in names if name.startswith(prefix)], key=lambda x: int(x.split('_')[-1]))
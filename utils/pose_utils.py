@@ -1,64 +1,53 @@
 import torch
+from torch import nn
 from scene.cameras import Camera
 
 def skew_sym_mat(x):
-    device = x.device
-    dtype = x.dtype
-    ssm = torch.zeros(3, 3, device=device, dtype=dtype)
-    ssm[0, 1] = -x[2]
-    ssm[0, 2] = x[1]
-    ssm[1, 0] = x[2]
-    ssm[1, 2] = -x[0]
-    ssm[2, 0] = -x[1]
-    ssm[2, 1] = x[0]
-    return ssm
+    """ [..., 3] vectors -> [..., 3, 3] skew symmetric matrices """
+    zero = torch.zeros_like(x[..., 0])
+    return torch.stack([
+        torch.stack([zero, -x[..., 2], x[..., 1]], dim=-1),
+        torch.stack([x[..., 2], zero, -x[..., 0]], dim=-1),
+        torch.stack([-x[..., 1], x[..., 0], zero], dim=-1),
+    ], dim=-2)
 
-def SO3_exp(theta):
-    device = theta.device
-    dtype = theta.dtype
+def _so3_coefficients(theta):
+    # sin(a) / a, (1 - cos(a)) / a^2 and (a - sin(a)) / a^3 of the angles a = |theta|, [..., 1, 1],
+    # replaced by their Taylor limits for small angles without a host side branch
+    angle = torch.norm(theta, dim=-1)[..., None, None]
+    small = angle < 1e-5
+    angle = torch.where(small, torch.ones_like(angle), angle)
+    a = torch.where(small, torch.ones_like(angle), torch.sin(angle) / angle)
+    b = torch.where(small, torch.full_like(angle, 0.5), (1 - torch.cos(angle)) / (angle**2))
+    c = torch.where(small, torch.full_like(angle, 1.0 / 6.0), (angle - torch.sin(angle)) / (angle**3))
+    return a, b, c
 
+def SO3_exp(theta):
+    """ [..., 3] tangents -> [..., 3, 3] rotations """
     W = skew_sym_mat(theta)
     W2 = W @ W
-    angle = torch.norm(theta)
-    I = torch.eye(3, device=device, dtype=dtype)
-    if angle < 1e-5:
-        return I + W + 0.5 * W2
-    else:
-        return (
-            I
-            + (torch.sin(angle) / angle) * W
-            + ((1 - torch.cos(angle)) / (angle**2)) * W2
-        )
+    I = torch.eye(3, device=theta.device, dtype=theta.dtype)
+    a, b, _ = _so3_coefficients(theta)
+    return I + a * W + b * W2
 
 def V(theta):
-    dtype = theta.dtype
-    device = theta.device
-    I = torch.eye(3, device=device, dtype=dtype)
+    """ [..., 3] tangents -> [..., 3, 3] left Jacobians of SO3, mapping rho to the translation """
     W = skew_sym_mat(theta)
     W2 = W @ W
-    angle = torch.norm(theta)
-    if angle < 1e-5:
-        V = I + 0.5 * W + (1.0 / 6.0) * W2
-    else:
-        V = (
-            I
-            + W * ((1.0 - torch.cos(angle)) / (angle**2))
-            + W2 * ((angle - torch.sin(angle)) / (angle**3))
-        )
-    return V
+    I = torch.eye(3, device=theta.device, dtype=theta.dtype)
+    _, b, c = _so3_coefficients(theta)
+    return I + b * W + c * W2
 
 def SE3_exp(tau):
-    dtype = tau.dtype
-    device = tau.device
-
-    rho = tau[:3]
-    theta = tau[3:]
+    """ [..., 6] tangents (rho, theta) -> [..., 4, 4] rigid transforms """
+    rho = tau[..., :3]
+    theta = tau[..., 3:]
     R = SO3_exp(theta)
-    t = V(theta) @ rho
+    t = (V(theta) @ rho[..., None])[..., 0]
 
-    T = torch.eye(4, device=device, dtype=dtype)
-    T[:3, :3] = R
-    T[:3, 3] = t
+    T = torch.eye(4, device=tau.device, dtype=tau.dtype).expand(tau.shape[:-1] + (4, 4)).clone()
+    T[..., :3, :3] = R
+    T[..., :3, 3] = t
     return T
 
 def update_pose(camera: Camera, converged_threshold=1e-4):
@@ -90,3 +79,66 @@ def get_loss_tracking(image, opacity, viewpoint):
     # rgb_pixel_mask = rgb_pixel_mask * viewpoint.grad_mask
     l1 = opacity * torch.abs(image * rgb_pixel_mask - gt_image * rgb_pixel_mask)
     return l1.mean()
+
+def refine_poses(views, render_fn, iters, rot_lr=0.0003, trans_lr=0.0001, converged_threshold=1e-4, sync_every=10):
+    """
+    Refine the poses of views (Camera_w_pose) against their images concurrently, as update_pose /
+    get_loss_tracking do for one view: the [B, 6] tangents of all views share one Adam, the poses
+    stay on the device as [B, 4, 4] w2c matrices and a view stops being updated once its step is
+    below converged_threshold. Converged views are only dropped from rendering every sync_every
+    iterations, when the convergence flags are read back.
+
+    render_fn(views, cam_rot_deltas, cam_trans_deltas) renders views with gradients w.r.t. the
+    given [V, 3] pose deltas, e.g. render_batch(views, ..., with_pose=True, cam_rot_deltas=...,
+    cam_trans_deltas=...). Returns the number of updates of every view.
+    """
+    device = views[0].cam_rot_delta.device
+    num_views = len(views)
+    w2c = torch.stack([view.world_view_transform.transpose(0, 1) for view in views])
+    projection = torch.stack([view.projection_matrix for view in views])
+    rot_delta = nn.Parameter(torch.zeros((num_views, 3), device=device))
+    trans_delta = nn.Parameter(torch.zeros((num_views, 3), device=device))
+    pose_optimizer = torch.optim.Adam([
+        {"params": [rot_delta], "lr": rot_lr, "name": "rot"},
+        {"params": [trans_delta], "lr": trans_lr, "name": "trans"},
+    ])
+    active = torch.ones(num_views, dtype=torch.bool, device=device)
+    updates = torch.zeros(num_views, dtype=torch.long, device=device)
+
+    rows = list(range(num_views))
+    rows_t = torch.arange(num_views, device=device)
+    for iteration in range(iters):
+        if iteration > 0 and iteration % sync_every == 0:
+            rows_t = active.nonzero()[:, 0]
+            rows = rows_t.tolist()
+            if len(rows) == 0:
+                break
+        render_pkg = render_fn([views[row] for row in rows], rot_delta[rows_t], trans_delta[rows_t])
+        pose_optimizer.zero_grad()
+        # the sum keeps the gradient of every view that of its own loss
+        loss_tracking = sum(get_loss_tracking(image, opacity, views[row])
+                            for row, image, opacity in zip(rows, render_pkg["render"], render_pkg["rendered_alpha"]))
+        loss_tracking.backward()
+        with torch.no_grad():
+            pose_optimizer.step()
+            tau = torch.cat([trans_delta, rot_delta], dim=-1)
+            w2c = torch.where(active[:, None, None], SE3_exp(tau) @ w2c, w2c)
+            updates += active
+            active &= tau.norm(dim=-1) >= converged_threshold
+            rot_delta.zero_()
+            trans_delta.zero_()
+
+            world_view_transform = w2c.transpose(1, 2).contiguous()
+            full_proj_transform = world_view_transform @ projection
+            camera_center = torch.linalg.inv(world_view_transform)[:, 3, :3]
+            for row in rows:
+                views[row].world_view_transform = world_view_transform[row]
+                views[row].full_proj_transform = full_proj_transform[row]
+                views[row].camera_center = camera_center[row]
+
+    # the host copies of the poses, as update_pose leaves them
+    w2c = w2c.cpu().numpy()
+    for view, pose in zip(views, w2c):
+        view.R = pose[0:3, 0:3].T
+        view.T = pose[0:3, 3]
+    return updates
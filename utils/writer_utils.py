@@ -0,0 +1,158 @@
+import queue
+import subprocess
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+
+def to_uint8(image):
+    """ [3, H, W] image in [0, 1] -> [H, W, 3] uint8, rounded as torchvision.utils.save_image does """
+    return image.mul(255).add_(0.5).clamp_(0, 255).permute(1, 2, 0).to(torch.uint8)
+
+def depth_to_uint8(depth):
+    """
+    [1, H, W] depth -> [H, W] uint8 frame of the depth video: non positive depths take the smallest
+    positive one, then the depths are min-max normalized to [0, 255].
+    """
+    depth = depth[0].float()
+    positive_min = torch.where(depth > 0, depth, torch.full_like(depth, float("inf"))).min()
+    depth = torch.where((depth <= 0) & torch.isfinite(positive_min), positive_min, depth)
+    lo, hi = depth.min(), depth.max()
+    scale = torch.where(hi > lo, 255. / (hi - lo), torch.zeros_like(hi))
+    return ((depth - lo) * scale).to(torch.uint8)
+
+
+class VideoStream:
+    """ Encodes the frames written to it with ffmpeg, fed raw through a pipe from a background thread """
+
+    def __init__(self, writer, path, fps=24, crf=23, pix_fmt=None):
+        self.writer = writer
+        self.path = path
+        self.fps = fps
+        self.crf = crf
+        self.pix_fmt = pix_fmt
+        self.process = None
+        self.frames = queue.Queue(maxsize=writer.max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _open(self, frame):
+        height, width = frame.shape[:2]
+        command = ["ffmpeg", "-y",
+                   "-f", "rawvideo",
+                   "-pix_fmt", "rgb24" if frame.ndim == 3 else "gray",
+                   "-s", f"{width}x{height}",
+                   "-framerate", str(self.fps),
+                   "-i", "-",
+                   "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+                   "-c:v", "libx264",
+                   "-crf", str(self.crf)]
+        if self.pix_fmt is not None:
+            command += ["-pix_fmt", self.pix_fmt]
+        self.process = subprocess.Popen(command + [self.path], stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _run(self):
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+            try:
+                frame = self.writer.wait(item)
+                if self.error is None:
+                    if self.process is None:
+                        self._open(frame)
+                    self.process.stdin.write(frame.tobytes())
+            except Exception as e:
+                self.error = e
+            finally:
+                self.writer.release(item)
+
+    def write(self, frame):
+        """ frame: [H, W, 3] or [H, W] uint8 tensor, on any device """
+        self.frames.put(self.writer.to_host(frame))
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError: # ffmpeg exited early, the error of the write is raised below
+                pass
+            self.process.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class FrameWriter:
+    """
+    Writes rendered frames from background threads, so that rendering does not wait for the disk
+    or the PNG / video encoders. Frames are copied into reused pinned host buffers without blocking
+    the device; at most max_pending frames are in flight, after which writes block. PNGs are
+    encoded by a pool of num_workers threads and videos are piped into ffmpeg in frame order.
+    """
+
+    def __init__(self, num_workers=4, max_pending=16):
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max(num_workers, 1))
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.buffers = defaultdict(list) # free pinned buffers per (shape, dtype)
+        self.futures = []
+        self.videos = []
+
+    def to_host(self, tensor):
+        """ Start the copy of tensor to the host; returns the (buffer, event) handle of the copy """
+        self.slots.acquire()
+        if not tensor.is_cuda:
+            return tensor.detach().clone(), None
+        key = (tuple(tensor.shape), tensor.dtype)
+        with self.lock:
+            buffer = self.buffers[key].pop() if self.buffers[key] else None
+        if buffer is None:
+            buffer = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+        buffer.copy_(tensor, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        return buffer, event
+
+    def wait(self, item):
+        buffer, event = item
+        if event is not None:
+            event.synchronize()
+        return buffer.numpy()
+
+    def release(self, item):
+        buffer, event = item
+        if event is not None:
+            with self.lock:
+                self.buffers[(tuple(buffer.shape), buffer.dtype)].append(buffer)
+        self.slots.release()
+
+    def _save_image(self, item, path):
+        try:
+            Image.fromarray(self.wait(item)).save(path)
+        finally:
+            self.release(item)
+
+    def save_image(self, frame, path):
+        """ frame: [H, W, 3] uint8 tensor, see to_uint8 """
+        self.futures.append(self.pool.submit(self._save_image, self.to_host(frame), path))
+
+    def open_video(self, path, fps=24, crf=23, pix_fmt=None):
+        video = VideoStream(self, path, fps=fps, crf=crf, pix_fmt=pix_fmt)
+        self.videos.append(video)
+        return video
+
+    def close(self):
+        """ Wait for every frame to be written; raises the first error of the background threads """
+        for video in self.videos:
+            video.close()
+        self.pool.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
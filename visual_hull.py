@@ -7,7 +7,6 @@ import camtools as ct
 import numpy as np
 import open3d as o3d
 import torch
-from tqdm import trange
 from scene.dataset_readers import sceneLoadTypeCallbacks
 from utils.camera_utils import cameraList_from_camInfos
 from torch.nn import functional as F
@@ -65,83 +64,131 @@ def query_from_list_with_list(listA: list, listB: list):
 def simple_resize_image(img, size):
     return transforms.Resize(size, antialias=True)(img)
 
-def get_visual_hull(N, bbox, scene_info, cam_center):
-    pcs = []
-    color = []
-    all_pts = []
-    Ks = scene_info.Ks
-    Ts = scene_info.Ts
+def voxel_centers(voxel_ids, N, bbox, cam_center, linspace_xy=True):
+    """
+    World positions of the voxels with linear ids (y * N + x) * N + z of an N^3 grid. The voxels are
+    tested with x and y sampled by linspace over the bbox and z at h / N, while the output points
+    place all three axes at index / N (linspace_xy=False).
+    """
+    [xs, ys, zs], [xe, ye, ze] = bbox[0], bbox[1]
+    a, rest = voxel_ids // (N * N), voxel_ids % (N * N)
+    b, h = rest // N, rest % N
+    step = max(N - 1, 1) if linspace_xy else N
+    pts = torch.stack([b / step * (xe - xs) + xs,
+                       a / step * (ye - ys) + ys,
+                       h / N * (ze - zs) + zs], -1).float()
+    return pts + torch.as_tensor(cam_center, dtype=pts.dtype, device=pts.device)
+
+def project_points(K, T, points):
+    """ Pixel coordinates [M, 2] and camera-space depth [M] of world points [M, 3] in one camera """
+    homopts_cam = points2homopoints(points) @ T.T
+    homopts_img = homopts_cam[:, :3] @ K.T
+    homopts_img = homopts_img / (homopts_img[:, 2:] + 1e-6)
+    return homopts_img[:, :2], homopts_cam[:, 2]
+
+def sample_at(image, uv, size):
+    """ Bilinear samples [M, C] of image [C, H, W] at pixel coordinates uv [M, 2] of a size (W, H) image """
+    grid = torch.stack([uv[:, 0] / size[0] * 2 - 1, uv[:, 1] / size[1] * 2 - 1], -1)
+    return F.grid_sample(image[None].float(), grid[None, None], padding_mode='zeros', align_corners=False)[0, :, 0].T
+
+def carve_voxels(voxel_ids, N, bbox, cam_center, Ks, Ts, masks, sizes, min_votes):
+    """
+    Ids of the voxels seen inside the mask by at least min_votes cameras. The cameras are visited
+    one by one and a voxel is dropped as soon as it misses more than len(Ks) - min_votes of them,
+    so most of the empty space is rejected by the first cameras.
+    """
+    max_misses = len(Ks) - min_votes
+    pts = voxel_centers(voxel_ids, N, bbox, cam_center)
+    misses = torch.zeros_like(voxel_ids, dtype=torch.int32)
+    for K, T, mask, (width, height) in zip(Ks, Ts, masks, sizes):
+        uv, z = project_points(K, T, pts)
+        inside = (z > 0) & (uv[:, 0] > 0) & (uv[:, 0] < width) & (uv[:, 1] > 0) & (uv[:, 1] < height)
+        valid = inside & (sample_at(mask, uv, (width, height))[:, 0] > 0)
+        misses += (~valid).int()
+        keep = misses <= max_misses
+        voxel_ids, pts, misses = voxel_ids[keep], pts[keep], misses[keep]
+        if voxel_ids.numel() == 0:
+            break
+    return voxel_ids
+
+def carve_visual_hull(N, bbox, scene_info, cam_center, sizes, min_votes=None, chunk_size=2 ** 21, octree_levels=0):
+    """
+    Visual hull of an N^3 voxel grid over bbox (shifted by cam_center), carved in chunks of at most
+    chunk_size voxels so that memory does not grow with N. With octree_levels > 0 the grid is first
+    carved at N / 2^levels, and only the children of the occupied voxels (dilated by one voxel, to
+    keep thin parts) are tested at the next level. Colors are sampled for the surviving voxels only.
+    Returns the voxel positions [P, 3] and colors [P, 3] in [0, 1], ordered by linear id.
+    """
+    Ks, Ts, images, masks = scene_info.Ks, scene_info.Ts, scene_info.images, scene_info.masks
+    device = images[0].device
+    Ks = [K.float().to(device) for K in Ks]
+    Ts = [T.float().to(device) for T in Ts]
+    min_votes = len(Ks) - 1 if min_votes is None else min_votes
+
+    def carve(candidates, level_N):
+        # the dense first level enumerates its chunks on the fly instead of materializing level_N^3 ids
+        num_candidates = level_N ** 3 if candidates is None else candidates.numel()
+        chunks = []
+        for start in range(0, num_candidates, chunk_size):
+            if candidates is None:
+                chunk = torch.arange(start, min(start + chunk_size, num_candidates), device=device)
+            else:
+                chunk = candidates[start:start + chunk_size]
+            chunks.append(carve_voxels(chunk, level_N, bbox, cam_center, Ks, Ts, masks, sizes, min_votes))
+        return torch.cat(chunks) if chunks else torch.zeros(0, dtype=torch.long, device=device)
+
+    resolutions = [N]
+    for _ in range(octree_levels):
+        resolutions.insert(0, math.ceil(resolutions[0] / 2))
+    occupied = None
+    for level, level_N in enumerate(resolutions):
+        candidates = None if occupied is None else octree_children(occupied, resolutions[level - 1], level_N)
+        occupied = carve(candidates, level_N)
+
+    pts = voxel_centers(occupied, N, bbox, cam_center)
+    colors = torch.zeros((occupied.numel(), 3), device=device)
+    for start in range(0, occupied.numel(), chunk_size):
+        chunk = pts[start:start + chunk_size]
+        for K, T, image, (width, height) in zip(Ks, Ts, images, sizes):
+            uv, _ = project_points(K, T, chunk)
+            colors[start:start + chunk_size] += sample_at(image, uv, (width, height))[:, :3]
+    return voxel_centers(occupied, N, bbox, cam_center, linspace_xy=False), colors / len(Ks)
+
+def octree_children(voxel_ids, coarse_N, fine_N):
+    """ Linear ids at fine_N of the children of the given coarse voxels and of their 26 neighbours """
+    occupancy = torch.zeros(coarse_N ** 3, device=voxel_ids.device)
+    occupancy[voxel_ids] = 1
+    occupancy = F.max_pool3d(occupancy.view(1, 1, coarse_N, coarse_N, coarse_N), 3, stride=1, padding=1).view(-1)
+    coarse = occupancy.nonzero(as_tuple=True)[0]
+    a, b, h = coarse // (coarse_N * coarse_N), (coarse // coarse_N) % coarse_N, coarse % coarse_N
+    offsets = torch.tensor([[i, j, k] for i in range(2) for j in range(2) for k in range(2)], device=coarse.device)
+    children = torch.stack([a, b, h], -1)[:, None] * 2 + offsets[None] # [V, 8, 3]
+    children = children[(children < fine_N).all(-1)]
+    return torch.unique((children[:, 0] * fine_N + children[:, 1]) * fine_N + children[:, 2])
+
+def get_visual_hull(N, bbox, scene_info, cam_center, min_votes=None, chunk_size=2 ** 21, octree_levels=0):
     images = scene_info.images
     masks = scene_info.masks
 
-    [xs, ys, zs], [xe, ye, ze] = bbox[0], bbox[1]
-
     # please note that in vasedeck, the images are not same size, for simplify, just resize them
+    # (pixel coordinates are still normalized by every camera's own size)
+    sizes = [(image.shape[2], image.shape[1]) for image in images]
     new_images = []
     new_masks = []
     img_size = images[0].shape[1:]
     for image, mask in zip(images, masks):
         new_images.append(simple_resize_image(image, img_size))
         new_masks.append(simple_resize_image(mask, img_size))
+    scene_info = scene_info._replace(images=new_images, masks=new_masks)
 
-    images = torch.stack(new_images) # N C H W
-    masks = torch.stack(new_masks) # N 1 H W
-
-    for h_id in trange(N):
-        i, j = torch.meshgrid(torch.linspace(xs, xe, N).cuda(),
-                              torch.linspace(ys, ye, N).cuda())
-        i, j = i.t(), j.t()
-        pts = torch.stack([i, j, torch.ones_like(i).cuda()], -1)
-        pts[...,2] = h_id / N * (ze - zs) + zs # 100, 100, 3
-
-        # shift the pts to be centered at the camera center
-        pts[...,0] += cam_center[0]  # note the order, [x, y, z], width, height, depth
-        pts[...,1] += cam_center[1]
-        pts[...,2] += cam_center[2]
-
-        all_pts.append(pts)
-
-        # now we have the pts, we need to project them to the image plane
-        # batched projection
-        uv, z = batch_projection(Ks, Ts, pts) # [N, 100, 100, 2], [N, 100, 100]
-        valid_z_mask = z > 0
-        valid_x_y_mask = (uv[...,0] > 0) & (uv[...,0] < cam_info.image_width) & (uv[...,1] > 0) & (uv[...,1] < cam_info.image_height)
-        valid_pt_mask = valid_z_mask & valid_x_y_mask
-
-        # simple resize the uv to [-1, 1]
-        uv[...,0] = uv[...,0] / cam_info.image_width * 2 - 1
-        uv[...,1] = uv[...,1] / cam_info.image_height * 2 - 1
-
-        # now we have the uv, we use grid_sample to sample the image to get the color
-        result = F.grid_sample(images.float(), uv, padding_mode='zeros', align_corners=False).permute(0, 2, 3, 1) # N, 100, 100, 3
-        # sample mask
-        result_mask = F.grid_sample(masks.float(), uv, padding_mode='zeros', align_corners=False).permute(0, 2, 3, 1) # N, 100, 100, 1
-
-        valid_pt_mask = result_mask.squeeze() > 0 & valid_pt_mask
-
-        pcs.append(valid_pt_mask.float().sum(0) >= (images.shape[0] - 1)) # [100, 100]
-        color.append(result.mean(0)) # [100, 100, 3]
-
-    pcs = torch.stack(pcs, -1)
-    color = torch.stack(color, -1)
-
-    r, g, b = color[:, :, 0], color[:, :, 1], color[:, :, 2]
-    idx = torch.where(pcs > 0)
-
-    color = torch.stack((r[idx] * 255, g[idx] * 255, b[idx] * 255), -1)
-
-    idx = torch.stack([idx[1], idx[0], idx[2]], -1) # note the order is hwz -> xyz
-    # turn the idx to the point position used in batch_projection
-    idx = idx.float() / N
-    idx[...,0] = idx[...,0] * (xe - xs) + xs + cam_center[0]
-    idx[...,1] = idx[...,1] * (ye - ys) + ys + cam_center[1]
-    idx[...,2] = idx[...,2] * (ze - zs) + zs + cam_center[2]
+    pts, color = carve_visual_hull(N, bbox, scene_info, cam_center, sizes, min_votes=min_votes,
+                                   chunk_size=chunk_size, octree_levels=octree_levels)
 
-    print("visual hull is Okay, with {} points".format(idx.shape[0]))
+    print("visual hull is Okay, with {} points".format(pts.shape[0]))
     # we get the point cloud, use open3d to visualize it
     pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(idx.cpu().numpy())
-    pcd.colors = o3d.utility.Vector3dVector(color.cpu().numpy() / 255)
+    pcd.points = o3d.utility.Vector3dVector(pts.cpu().numpy())
+    pcd.colors = o3d.utility.Vector3dVector(color.cpu().numpy())
 
     # get bbox
     bbox = pcd.get_axis_aligned_bounding_box()
@@ -159,6 +206,10 @@ if __name__=="__main__":
     parser.add_argument("--cube_size_shift_x", type=float, default=0.0, help="shift sizex of the cube in meters")
     parser.add_argument("--cube_size_shift_y", type=float, default=0.0, help="shift sizey of the cube in meters")
     parser.add_argument("--cube_size_shift_z", type=float, default=0.0, help="shift sizez of the cube in meters")
+    parser.add_argument("--refine_voxel_num", type=int, default=64, help="voxels per axis of the second pass, inside the enlarged bound of the first")
+    parser.add_argument("--chunk_size", type=int, default=2 ** 21, help="max voxels tested at once, bounds the memory of the carving")
+    parser.add_argument("--octree_levels", type=int, default=0, help="coarse-to-fine levels, > 0 skips the empty space at coarse resolution")
+    parser.add_argument("--min_votes", type=int, default=None, help="cameras that must see a voxel inside the mask, default all but one")
     args = parser.parse_args()
 
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
@@ -220,7 +271,8 @@ if __name__=="__main__":
     init_bbox = [[args.cube_size_shift_x-bx, args.cube_size_shift_y-bx, args.cube_size_shift_z-bx],
                  [args.cube_size_shift_x+bx, args.cube_size_shift_y+bx, args.cube_size_shift_z+bx]]
     # we run the get_visual_hull twice, first to get the bound, second to get the visual hull
-    pcd, bbox = get_visual_hull(args.voxel_num, init_bbox, scene_info, cam_center)
+    pcd, bbox = get_visual_hull(args.voxel_num, init_bbox, scene_info, cam_center, min_votes=args.min_votes,
+                                chunk_size=args.chunk_size, octree_levels=args.octree_levels)
 
     # since we get the bound, we use this bound to better recon
     # we use the center of the bound as the center of the scene
@@ -239,7 +291,8 @@ if __name__=="__main__":
     enlarged_bbox_min = center - scaled_extents / 2
     enlarged_bbox_max = center + scaled_extents / 2
 
-    pcd, bbox_new = get_visual_hull(64, [enlarged_bbox_min, enlarged_bbox_max], scene_info, [0,0,0])
+    pcd, bbox_new = get_visual_hull(args.refine_voxel_num, [enlarged_bbox_min, enlarged_bbox_max], scene_info, [0,0,0], min_votes=args.min_votes,
+                                    chunk_size=args.chunk_size, octree_levels=args.octree_levels)
     # save the pointcloud
     if args.sparse_id >= 0:
         o3d.io.write_point_cloud(os.path.join(args.data_dir, f"visual_hull_{str(args.sparse_id)}.ply"), pcd)